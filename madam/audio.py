@@ -1 +1,2 @@
 from madam.ffmpeg import FFmpegProcessor, FFmpegMetadataProcessor
+from madam.tagging import AudioTagMetadataProcessor
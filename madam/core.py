@@ -1,25 +1,58 @@
 import abc
+import array
+import base64
+import bisect
+import contextlib
+import datetime
+import dbm
+import fcntl
 import functools
+import hashlib
+import heapq
 import io
 import importlib
+import json
+import logging
+import lzma
+import mmap
 import os
+import pickle
+import re
 import shelve
 import shutil
+import sqlite3
+import struct
+import tarfile
+import threading
+import time
+import zlib
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
 from collections.abc import MutableMapping
+from enum import Enum
+from fractions import Fraction
 
 from frozendict import frozendict
 
+from madam.mime import MimeType
+
+
+_logger = logging.getLogger(__name__)
+
 
 class Madam:
     """
     Represents an instance of the library.
     """
-    def __init__(self):
+    def __init__(self, cache=None):
         """
         Initializes a new library instance with default configuration.
 
         The default configuration includes a list of all available Processor
         and MetadataProcessor implementations.
+
+        :param cache: Optional cache for the results of :func:`~madam.core.Madam.read`
+        :type cache: MetadataCache
         """
         self.config = dict(
             processors=[
@@ -28,8 +61,10 @@ class Madam:
                 'madam.ffmpeg.FFmpegProcessor',
             ],
             metadata_processors=[
-                'madam.exiv2.Exiv2MetadataProcessor',
+                'madam.jpeg.JPEGMetadataProcessor',
                 'madam.vector.SVGMetadataProcessor',
+                'madam.tagging.AudioTagMetadataProcessor',
+                'madam.mp4.MP4MetadataProcessor',
                 'madam.ffmpeg.FFmpegMetadataProcessor',
             ]
         )
@@ -51,6 +86,11 @@ class Madam:
             processor = processor_class()
             self._metadata_processors.append(processor)
 
+        self.cache = cache
+        from madam import __version__
+        self._cache_version = ' '.join([__version__] + self.config['processors'] +
+                                       self.config['metadata_processors'])
+
     @staticmethod
     def _import_from(member_path):
         """
@@ -85,6 +125,9 @@ class Madam:
         r"""
         Reads the specified file and returns its contents as an :class:`~madam.core.Asset` object.
 
+        If a cache was configured, files whose contents were read before are
+        not processed again.
+
         :param file: file-like object to be parsed
         :type file: file-like object
         :param additional_metadata: optional metadata for the resulting asset.
@@ -108,6 +151,49 @@ class Madam:
         if not file:
             raise TypeError('Unable to read object of type %s' % type(file))
 
+        if self.cache is None:
+            asset, _ = self._read(file)
+        else:
+            file.seek(0)
+            file_data = file.read()
+            digest = MetadataCache.digest(io.BytesIO(file_data))
+            cached_entry = self.cache.get(digest, self._cache_version)
+            metadata_processor_paths = self.config['metadata_processors']
+            if cached_entry is None:
+                asset, metadata_processors = self._read(io.BytesIO(file_data))
+                # Processors are only run again if they changed the essence
+                if MetadataCache.digest(asset.essence) == digest:
+                    metadata_processors = []
+                self.cache.put(digest, self._cache_version, asset.metadata,
+                               [path for path, processor in zip(metadata_processor_paths, self._metadata_processors)
+                                if processor in metadata_processors])
+            else:
+                metadata, stripping_processor_paths = cached_entry
+                essence = io.BytesIO(file_data)
+                for path in stripping_processor_paths:
+                    essence = self._metadata_processors[metadata_processor_paths.index(path)].strip(essence)
+                asset = Asset.__new__(Asset)
+                asset.__setstate__(dict(_essence_data=essence.read(), metadata=metadata))
+
+        if additional_metadata:
+            asset_metadata = dict(asset.metadata)
+            asset_metadata.update(dict(additional_metadata))
+            asset = Asset(asset.essence, **asset_metadata)
+
+        return asset
+
+    def _read(self, file):
+        """
+        Reads the essence and metadata of the specified file using the
+        configured processors.
+
+        :param file: file-like object to be parsed
+        :type file: file-like object
+        :returns: Asset representing the specified file, and the metadata
+                  processors that removed metadata from its essence
+        :rtype: (Asset, list)
+        :raises UnsupportedFormatError: if the file format cannot be recognized or is not supported
+        """
         processor = self.get_processor(file)
         if not processor:
             raise UnsupportedFormatError()
@@ -115,7 +201,10 @@ class Madam:
         asset = processor.read(file)
 
         handled_formats = set()
+        stripping_processors = []
         for metadata_processor in self._metadata_processors:
+            if handled_formats.issuperset(metadata_processor.formats):
+                continue
             asset_metadata = dict(asset.metadata)
             file.seek(0)
             try:
@@ -128,15 +217,11 @@ class Madam:
                 clean_asset = Asset(stripped_essence, **asset_metadata)
                 asset = clean_asset
                 handled_formats.update(metadata_processor.formats)
+                stripping_processors.append(metadata_processor)
             except UnsupportedFormatError:
                 pass
 
-        if additional_metadata:
-            asset_metadata = dict(asset.metadata)
-            asset_metadata.update(dict(additional_metadata))
-            asset = Asset(asset.essence, **asset_metadata)
-
-        return asset
+        return asset, stripping_processors
 
     def write(self, asset, file):
         r"""
@@ -190,6 +275,9 @@ class Madam:
         shutil.copyfileobj(essence_with_metadata, file)
 
 
+_CompressedAsset = namedtuple('_CompressedAsset', 'codec, essence_data, essence_size, state')
+
+
 class AssetStorage(MutableMapping):
     """
     Represents an abstract base class for data stores of
@@ -199,13 +287,268 @@ class AssetStorage(MutableMapping):
 
     The persistence guarantees for stored data may differ based on the
     respective storage implementation.
+
+    Indexes can be added to a storage with
+    :func:`~madam.core.AssetStorage.add_index`. They are updated whenever
+    assets are stored in or removed from the storage object.
+
+    Essences of uncompressed formats can be compressed transparently by the
+    storage. The codec and the minimum essence size for compression are
+    defined per MIME type in
+    :attr:`~madam.core.AssetStorage.compression_by_mime_type`. Formats that
+    are already compressed, like JPEG, MP3, or MP4, are stored unchanged.
     """
+    #: Codec name and minimum essence size in bytes for MIME types whose essences will be compressed
+    compression_by_mime_type = {
+        MimeType('audio/wav'): ('zlib', 4096),
+        MimeType('image/bmp'): ('zlib', 1024),
+        MimeType('image/svg+xml'): ('lzma', 1024),
+        MimeType('image/tiff'): ('zlib', 1024),
+    }
+
+    __codecs = {
+        'lzma': (lzma.compress, lzma.decompress),
+        'zlib': (zlib.compress, zlib.decompress),
+    }
+
+    # Compressed essences that are larger than this ratio are stored unchanged
+    __max_compression_ratio = 0.9
+
     @abc.abstractmethod
-    def __init__(self):
+    def __init__(self, compression=True):
         """
         Initializes a new `AssetStorage`.
+
+        :param compression: Whether essences of uncompressed formats should be compressed
+        :type compression: bool
         """
-        pass
+        self.compression = compression
+        self.indexes = []
+        self._index_lock = threading.Lock()
+
+    def add_index(self, index):
+        """
+        Adds the specified index to this storage.
+
+        The index is filled with all assets that are currently in this storage
+        and will be updated when assets are stored or removed using this
+        storage object.
+
+        :param index: Index to be added
+        :type index: AssetIndex
+        """
+        with self._index_lock:
+            for asset_key, (asset, tags) in self.items():
+                index.add(asset_key, asset, tags)
+            self.indexes.append(index)
+
+    def _update_indexes(self, asset_key, asset, tags):
+        with self._index_lock:
+            for index in self.indexes:
+                index.remove(asset_key)
+                index.add(asset_key, asset, tags)
+
+    def _remove_from_indexes(self, asset_key):
+        with self._index_lock:
+            for index in self.indexes:
+                index.remove(asset_key)
+
+    def _pack(self, asset):
+        """
+        Returns the representation of the specified asset that will be stored.
+
+        :param asset: Asset to be stored
+        :type asset: Asset
+        :return: Compressed asset, or the asset itself if it will not be compressed
+        """
+        if not self.compression or asset.mime_type is None:
+            return asset
+        codec_and_min_size = AssetStorage.compression_by_mime_type.get(MimeType(asset.mime_type))
+        if not codec_and_min_size:
+            return asset
+        codec, min_size = codec_and_min_size
+        essence_data = asset._essence_data
+        if len(essence_data) < min_size:
+            return asset
+        compress, _ = AssetStorage.__codecs[codec]
+        compressed_data = compress(essence_data)
+        if len(compressed_data) > AssetStorage.__max_compression_ratio*len(essence_data):
+            return asset
+        state = {key: value for key, value in asset.__dict__.items() if key != '_essence_data'}
+        return _CompressedAsset(codec=codec, essence_data=compressed_data, essence_size=len(essence_data),
+                                state=state)
+
+    @staticmethod
+    def _unpack(stored_asset):
+        """
+        Returns the asset for the specified stored representation.
+
+        :param stored_asset: Representation returned by :func:`~madam.core.AssetStorage._pack`
+        :return: Asset
+        :rtype: Asset
+        """
+        if not isinstance(stored_asset, _CompressedAsset):
+            return stored_asset
+        _, decompress = AssetStorage.__codecs[stored_asset.codec]
+        state = dict(stored_asset.state)
+        state['_essence_data'] = decompress(stored_asset.essence_data)
+        asset = Asset.__new__(Asset)
+        asset.__setstate__(state)
+        return asset
+
+    def _stored_assets(self):
+        """
+        Returns an iterable of the stored representations of all assets in
+        this storage.
+
+        By default, the assets are read with :meth:`_iter_items`, so they are
+        reported as uncompressed. Implementations can override this method to
+        return the representations created by :func:`~madam.core.AssetStorage._pack`.
+
+        :return: Stored representations of the assets
+        """
+        for _, asset, _ in self._iter_items():
+            yield asset
+
+    def statistics(self):
+        """
+        Returns statistics about the assets in this storage.
+
+        The returned dictionary contains the number of assets
+        (``asset_count``), the number of compressed assets
+        (``compressed_asset_count``), the total size of all essences in bytes
+        (``essence_size``), and the total size of the stored essences in bytes
+        (``stored_essence_size``).
+
+        :return: Storage statistics
+        :rtype: dict
+        """
+        statistics = dict(asset_count=0, compressed_asset_count=0, essence_size=0, stored_essence_size=0)
+        for stored_asset in self._stored_assets():
+            statistics['asset_count'] += 1
+            if isinstance(stored_asset, _CompressedAsset):
+                statistics['compressed_asset_count'] += 1
+                statistics['essence_size'] += stored_asset.essence_size
+                statistics['stored_essence_size'] += len(stored_asset.essence_data)
+            else:
+                statistics['essence_size'] += len(stored_asset._essence_data)
+                statistics['stored_essence_size'] += len(stored_asset._essence_data)
+        return statistics
+
+    def _iter_items(self):
+        """
+        Returns an iterable of all keys with their assets and tags.
+
+        Assets that are removed during the iteration will be skipped.
+        Implementations can override this method to read many assets at once.
+
+        :return: Tuples of asset key, asset, and tags
+        """
+        for asset_key in self:
+            try:
+                asset, tags = self[asset_key]
+            except KeyError:
+                continue
+            yield asset_key, asset, tags
+
+    def _store_items(self, items):
+        """
+        Stores all specified keys with their assets and tags.
+
+        Implementations can override this method to write many assets at once.
+
+        :param items: Tuples of asset key, asset, and tags
+        """
+        for asset_key, asset, tags in items:
+            self[asset_key] = asset, tags
+
+    def export_archive(self, file, buffer_size=1024*1024):
+        """
+        Writes all assets in this storage to the specified file as a stream in
+        tar format.
+
+        For every asset, the archive contains a JSON manifest entry with the
+        key, the metadata and the tags of the asset, which is immediately
+        followed by an entry with the essence. Assets are written one after another, so
+        the memory usage does not depend on the size of the storage.
+
+        :param file: Writable file-like object
+        :type file: file-like object
+        :param buffer_size: Size of the I/O buffer in bytes
+        :type buffer_size: int
+        :return: Number of exported assets
+        :rtype: int
+        """
+        asset_count = 0
+        with tarfile.open(fileobj=file, mode='w|', bufsize=buffer_size) as archive:
+            for asset_key, asset, tags in self._iter_items():
+                manifest = dict(key=_encode_json_value(asset_key),
+                                metadata=_encode_json_value(asset.metadata),
+                                tags=_encode_json_value(frozenset(tags or ())))
+                manifest_data = json.dumps(manifest, sort_keys=True).encode('utf-8')
+                for name, data in (('manifest', manifest_data), ('essence', asset._essence_data)):
+                    info = tarfile.TarInfo('%08d.%s' % (asset_count, name))
+                    info.size = len(data)
+                    archive.addfile(info, io.BytesIO(data))
+                asset_count += 1
+        return asset_count
+
+    def import_archive(self, file, workers=1, batch_size=256, buffer_size=1024*1024):
+        """
+        Stores all assets of an archive that was written by
+        :func:`~madam.core.AssetStorage.export_archive` in this storage.
+
+        The archive is read sequentially as a stream. Assets are stored in
+        batches, which can be processed in parallel by several worker threads.
+        Only a bounded number of batches is kept in memory at any time.
+
+        :param file: Readable file-like object
+        :type file: file-like object
+        :param workers: Number of worker threads that store assets
+        :type workers: int
+        :param batch_size: Number of assets per batch
+        :type batch_size: int
+        :param buffer_size: Size of the I/O buffer in bytes
+        :type buffer_size: int
+        :return: Number of imported assets
+        :rtype: int
+        """
+        if workers < 1:
+            raise ValueError('Invalid number of workers: %r' % workers)
+        asset_count = 0
+        pending_batches = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor, \
+                tarfile.open(fileobj=file, mode='r|', bufsize=buffer_size) as archive:
+            batch = []
+            manifest = None
+            for info in archive:
+                data = archive.extractfile(info).read()
+                if info.name.endswith('.manifest'):
+                    try:
+                        manifest = json.loads(data.decode('utf-8'))
+                    except ValueError:
+                        raise ValueError('Archive entry %r is not a valid manifest.' % info.name)
+                    continue
+                if manifest is None:
+                    raise ValueError('Archive entry %r has no manifest.' % info.name)
+                asset_key = _decode_json_value(manifest['key'])
+                tags = _decode_json_value(manifest['tags'])
+                asset = Asset.__new__(Asset)
+                asset.__setstate__(dict(metadata=_decode_json_value(manifest['metadata']), _essence_data=data))
+                manifest = None
+                batch.append((asset_key, asset, tags))
+                if len(batch) >= batch_size:
+                    pending_batches.append(executor.submit(self._store_items, batch))
+                    asset_count += len(batch)
+                    batch = []
+                    while len(pending_batches) > 2*workers:
+                        pending_batches.popleft().result()
+            if batch:
+                pending_batches.append(executor.submit(self._store_items, batch))
+                asset_count += len(batch)
+            while pending_batches:
+                pending_batches.popleft().result()
+        return asset_count
 
     def filter(self, **kwargs):
         """
@@ -237,6 +580,44 @@ class AssetStorage(MutableMapping):
                    if search_tags <= asset_tags)
 
 
+class AssetIndex(metaclass=abc.ABCMeta):
+    """
+    Represents an index over the assets in an :class:`~madam.core.AssetStorage`.
+
+    Indexes are maintained incrementally by the storages they were added to.
+    """
+    @abc.abstractmethod
+    def __init__(self):
+        """
+        Initializes a new, empty `AssetIndex`.
+        """
+        pass
+
+    @abc.abstractmethod
+    def add(self, asset_key, asset, tags):
+        """
+        Adds the asset with the specified key to this index.
+
+        :param asset_key: Key of the asset in the storage
+        :param asset: Asset to be indexed
+        :type asset: Asset
+        :param tags: Tags associated with the asset
+        :type tags: frozenset
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def remove(self, asset_key):
+        """
+        Removes the asset with the specified key from this index.
+
+        Unknown keys will be ignored.
+
+        :param asset_key: Key of the asset in the storage
+        """
+        raise NotImplementedError()
+
+
 class InMemoryStorage(AssetStorage):
     """
     Represents a non-persistent storage backend for :class:`~madam.core.Asset`
@@ -244,11 +625,14 @@ class InMemoryStorage(AssetStorage):
 
     Assets are not serialized, but stored in memory.
     """
-    def __init__(self):
+    def __init__(self, compression=True):
         """
         Initializes a new, empty `InMemoryStorage` object.
+
+        :param compression: Whether essences of uncompressed formats should be compressed
+        :type compression: bool
         """
-        super().__init__()
+        super().__init__(compression=compression)
         self.store = {}
 
     def __setitem__(self, asset_key, asset_and_tags):
@@ -268,7 +652,8 @@ class InMemoryStorage(AssetStorage):
         asset, tags = asset_and_tags
         if not tags:
             tags = frozenset()
-        self.store[asset_key] = (asset, frozenset(tags))
+        self.store[asset_key] = (self._pack(asset), frozenset(tags))
+        self._update_indexes(asset_key, asset, frozenset(tags))
 
     def __getitem__(self, asset_key):
         """
@@ -284,7 +669,8 @@ class InMemoryStorage(AssetStorage):
         """
         if asset_key not in self.store:
             raise KeyError('Asset with key %r cannot be found in storage' % asset_key)
-        return self.store[asset_key]
+        stored_asset, tags = self.store[asset_key]
+        return self._unpack(stored_asset), tags
 
     def __delitem__(self, asset_key):
         """
@@ -297,6 +683,7 @@ class InMemoryStorage(AssetStorage):
         if asset_key not in self.store:
             raise KeyError('Asset with key %r cannot be found in storage' % asset_key)
         del self.store[asset_key]
+        self._remove_from_indexes(asset_key)
 
     def __contains__(self, asset_key):
         """
@@ -327,6 +714,9 @@ class InMemoryStorage(AssetStorage):
         """
         return len(self.store)
 
+    def _stored_assets(self):
+        return [stored_asset for stored_asset, _ in self.store.values()]
+
 
 class ShelveStorage(AssetStorage):
     """
@@ -334,18 +724,58 @@ class ShelveStorage(AssetStorage):
     objects. Asset keys must be strings.
 
     ShelveStorage uses a file on the file system to serialize Assets.
+
+    Multiple processes can safely access the same storage file concurrently.
+    Read operations acquire a shared lock, whereas write operations acquire an
+    exclusive lock on a separate lock file next to the storage file.
     """
-    def __init__(self, path):
+    # Number of assets that are read or written while the shelve is opened once
+    _batch_size = 256
+
+    def __init__(self, path, compression=True):
         """
         Initializes a new `ShelveStorage` with the specified path.
 
         :param path: File system path where the data should be stored
         :type path: pathlib.Path or str
+        :param compression: Whether essences of uncompressed formats should be compressed
+        :type compression: bool
         """
-        super().__init__()
+        super().__init__(compression=compression)
         if os.path.exists(path) and not os.path.isfile(path):
             raise ValueError('The storage path %r is not a file.' % path)
         self.path = path
+        self.lock_path = '%s.lock' % path
+
+    @contextlib.contextmanager
+    def _open(self, writeable=False):
+        """
+        Opens the underlying shelve while holding a lock on the storage.
+
+        Writers hold an exclusive lock, readers share the lock with other
+        readers. A storage file that does not exist yet is treated as an empty
+        storage when it is opened for reading.
+
+        :param writeable: Whether the shelve should be opened for writing
+        :type writeable: bool
+        :return: Context manager yielding the opened shelve
+        """
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if writeable else fcntl.LOCK_SH)
+            try:
+                if writeable:
+                    with shelve.open(self.path) as store:
+                        yield store
+                    return
+                try:
+                    store = shelve.open(self.path, flag='r')
+                except dbm.error:
+                    yield {}
+                else:
+                    with store:
+                        yield store
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
 
     def __setitem__(self, asset_key, asset_and_tags):
         """
@@ -364,8 +794,9 @@ class ShelveStorage(AssetStorage):
         asset, tags = asset_and_tags
         if not tags:
             tags = frozenset()
-        with shelve.open(self.path) as store:
-            store[asset_key] = (asset, tags)
+        with self._open(writeable=True) as store:
+            store[asset_key] = (self._pack(asset), tags)
+        self._update_indexes(asset_key, asset, tags)
 
     def __getitem__(self, asset_key):
         """
@@ -380,10 +811,11 @@ class ShelveStorage(AssetStorage):
         :rtype: (Asset, set)
         :raise KeyError: if the key does not exist in this storage
         """
-        with shelve.open(self.path) as store:
+        with self._open() as store:
             if asset_key not in store:
                 raise KeyError('Asset with key %r cannot be found in storage' % asset_key)
-            return store[asset_key]
+            stored_asset, tags = store[asset_key]
+        return self._unpack(stored_asset), tags
 
     def __delitem__(self, asset_key):
         """
@@ -394,10 +826,11 @@ class ShelveStorage(AssetStorage):
         :type asset_key: str
         :raise KeyError: if the key does not exist in this storage
         """
-        with shelve.open(self.path) as store:
+        with self._open(writeable=True) as store:
             if asset_key not in store:
                 raise KeyError('Asset with key %r cannot be found in storage' % asset_key)
             del store[asset_key]
+        self._remove_from_indexes(asset_key)
 
     def __contains__(self, asset_key):
         """
@@ -408,7 +841,7 @@ class ShelveStorage(AssetStorage):
         :return: `True` if the key exists, `False` otherwise
         :rtype: bool
         """
-        with shelve.open(self.path) as store:
+        with self._open() as store:
             return asset_key in store
 
     def __iter__(self):
@@ -417,7 +850,7 @@ class ShelveStorage(AssetStorage):
         in this asset storage.
         :return: Iterator object
         """
-        with shelve.open(self.path) as store:
+        with self._open() as store:
             return iter(list(store.keys()))
 
     def __len__(self):
@@ -426,9 +859,1219 @@ class ShelveStorage(AssetStorage):
         :return: Number of assets in this storage
         :rtype: int
         """
-        with shelve.open(self.path) as store:
+        with self._open() as store:
             return len(store)
 
+    def _stored_assets(self):
+        with self._open() as store:
+            for stored_asset, _ in store.values():
+                yield stored_asset
+
+    def _iter_items(self):
+        asset_keys = list(self)
+        for start in range(0, len(asset_keys), ShelveStorage._batch_size):
+            with self._open() as store:
+                items = [(asset_key, store[asset_key])
+                         for asset_key in asset_keys[start:start + ShelveStorage._batch_size]
+                         if asset_key in store]
+            for asset_key, (stored_asset, tags) in items:
+                yield asset_key, self._unpack(stored_asset), tags
+
+    def _store_items(self, items):
+        items = [(asset_key, asset, tags or frozenset()) for asset_key, asset, tags in items]
+        packed_items = [(asset_key, self._pack(asset), tags) for asset_key, asset, tags in items]
+        with self._open(writeable=True) as store:
+            for asset_key, stored_asset, tags in packed_items:
+                store[asset_key] = (stored_asset, tags)
+        for asset_key, asset, tags in items:
+            self._update_indexes(asset_key, asset, tags)
+
+
+class LogStorage(AssetStorage):
+    """
+    Represents a persistent, log-structured storage backend for
+    :class:`~madam.core.Asset` objects. Asset keys must be strings.
+
+    Assets are appended to segment files in a directory. An in-memory index
+    maps each key to the location of its most recent record. Whenever a
+    segment is full, it is sealed and a compact hint file with the locations
+    of its records is written next to it, so the index can be rebuilt on
+    start-up without reading the assets. Stored data is read using memory
+    maps.
+
+    Overwritten and deleted records are reclaimed by compaction, which can be
+    run explicitly or in a background thread.
+
+    A `LogStorage` directory must only be written by a single process at a time.
+    """
+    _RECORD_HEADER = struct.Struct('>BIQ')
+    _HINT_ENTRY = struct.Struct('>BIQQ')
+    _TOMBSTONE = 1
+
+    def __init__(self, path, max_segment_size=64*1024*1024, compaction_threshold=0.5,
+                 background_compaction=False, compression=True):
+        """
+        Initializes a new `LogStorage` in the specified directory.
+
+        Existing data in the directory will be loaded.
+
+        :param path: File system path of the directory where the data should be stored
+        :type path: pathlib.Path or str
+        :param max_segment_size: Size in bytes after which a segment will be sealed
+        :type max_segment_size: int
+        :param compaction_threshold: Minimum ratio of reclaimable bytes in a
+            sealed segment for it to be compacted
+        :type compaction_threshold: float
+        :param background_compaction: Whether segments should be compacted
+            automatically in a background thread
+        :type background_compaction: bool
+        :param compression: Whether essences of uncompressed formats should be compressed
+        :type compression: bool
+        """
+        super().__init__(compression=compression)
+        if os.path.exists(path) and not os.path.isdir(path):
+            raise ValueError('The storage path %r is not a directory.' % path)
+        os.makedirs(str(path), exist_ok=True)
+        self.path = path
+        self.max_segment_size = max_segment_size
+        self.compaction_threshold = compaction_threshold
+
+        self._lock = threading.RLock()
+        self._compaction_lock = threading.Lock()
+        self._index = {}
+        self._segment_sizes = {}
+        self._garbage_sizes = {}
+        self._maps = {}
+        self._load()
+
+        self._compaction_requested = threading.Event()
+        self._closed = False
+        self._compaction_thread = None
+        if background_compaction:
+            self._compaction_thread = threading.Thread(target=self._compact_in_background, daemon=True)
+            self._compaction_thread.start()
+
+    def _segment_path(self, segment_id, extension='log'):
+        return os.path.join(str(self.path), '%08d.%s' % (segment_id, extension))
+
+    def _segment_ids(self):
+        segment_ids = []
+        for file_name in os.listdir(str(self.path)):
+            name, extension = os.path.splitext(file_name)
+            if extension == '.log' and name.isdigit():
+                segment_ids.append(int(name))
+        return sorted(segment_ids)
+
+    def _load(self):
+        """
+        Rebuilds the index from hint files and segments.
+
+        Segments without a hint file are scanned. A partially written record at
+        the end of a segment is discarded. The last segment is reopened for
+        appending unless it is full.
+        """
+        segment_ids = self._segment_ids()
+        for segment_id in segment_ids:
+            hint_path = self._segment_path(segment_id, 'hint')
+            if os.path.exists(hint_path):
+                entries = self._read_hint(hint_path)
+            else:
+                entries = self._scan_segment(segment_id)
+                if segment_id != segment_ids[-1]:
+                    self._write_hint(segment_id)
+            self._segment_sizes[segment_id] = os.path.getsize(self._segment_path(segment_id))
+            self._garbage_sizes[segment_id] = 0
+            for flags, asset_key, value_offset, value_length in entries:
+                self._discard(asset_key)
+                if flags & LogStorage._TOMBSTONE:
+                    self._garbage_sizes[segment_id] += self._record_overhead(asset_key)
+                else:
+                    self._index[asset_key] = (segment_id, value_offset, value_length)
+
+        if segment_ids and self._segment_sizes[segment_ids[-1]] < self.max_segment_size:
+            self._active_id = segment_ids[-1]
+            # The hint file is written again when the segment is sealed
+            hint_path = self._segment_path(self._active_id, 'hint')
+            if os.path.exists(hint_path):
+                os.remove(hint_path)
+        else:
+            self._active_id = segment_ids[-1] + 1 if segment_ids else 0
+            self._segment_sizes[self._active_id] = 0
+            self._garbage_sizes[self._active_id] = 0
+        self._active_file = open(self._segment_path(self._active_id), 'ab')
+
+    @staticmethod
+    def _record_overhead(asset_key):
+        return LogStorage._RECORD_HEADER.size + len(asset_key.encode('utf-8'))
+
+    def _read_hint(self, hint_path):
+        entries = []
+        with open(hint_path, 'rb') as hint_file:
+            data = hint_file.read()
+        position = 0
+        while position < len(data):
+            flags, key_length, value_offset, value_length = LogStorage._HINT_ENTRY.unpack_from(data, position)
+            position += LogStorage._HINT_ENTRY.size
+            asset_key = data[position:position + key_length].decode('utf-8')
+            position += key_length
+            entries.append((flags, asset_key, value_offset, value_length))
+        return entries
+
+    def _scan_segment(self, segment_id):
+        entries = []
+        segment_path = self._segment_path(segment_id)
+        with open(segment_path, 'rb') as segment_file:
+            data = segment_file.read()
+        position = 0
+        header_size = LogStorage._RECORD_HEADER.size
+        while position + header_size <= len(data):
+            flags, key_length, value_length = LogStorage._RECORD_HEADER.unpack_from(data, position)
+            value_offset = position + header_size + key_length
+            if value_offset + value_length > len(data):
+                break
+            asset_key = data[position + header_size:value_offset].decode('utf-8')
+            entries.append((flags, asset_key, value_offset, value_length))
+            position = value_offset + value_length
+        if position < len(data):
+            with open(segment_path, 'r+b') as segment_file:
+                segment_file.truncate(position)
+        return entries
+
+    def _write_hint(self, segment_id):
+        hint_path = self._segment_path(segment_id, 'hint')
+        temp_path = hint_path + '.tmp'
+        with open(temp_path, 'wb') as hint_file:
+            for flags, asset_key, value_offset, value_length in self._scan_segment(segment_id):
+                key_data = asset_key.encode('utf-8')
+                hint_file.write(LogStorage._HINT_ENTRY.pack(flags, len(key_data), value_offset, value_length))
+                hint_file.write(key_data)
+            hint_file.flush()
+            os.fsync(hint_file.fileno())
+        os.replace(temp_path, hint_path)
+
+    def _discard(self, asset_key):
+        location = self._index.pop(asset_key, None)
+        if location is not None:
+            segment_id, _, value_length = location
+            self._garbage_sizes[segment_id] += value_length + self._record_overhead(asset_key)
+        return location
+
+    def _append(self, asset_key, value, flags=0, flush=True):
+        key_data = asset_key.encode('utf-8')
+        record_offset = self._segment_sizes[self._active_id]
+        self._active_file.write(LogStorage._RECORD_HEADER.pack(flags, len(key_data), len(value)))
+        self._active_file.write(key_data)
+        self._active_file.write(value)
+        if flush:
+            self._active_file.flush()
+        value_offset = record_offset + LogStorage._RECORD_HEADER.size + len(key_data)
+        self._segment_sizes[self._active_id] = value_offset + len(value)
+        location = self._active_id, value_offset, len(value)
+        if flags & LogStorage._TOMBSTONE:
+            self._garbage_sizes[self._active_id] += self._record_overhead(asset_key)
+        if self._segment_sizes[self._active_id] >= self.max_segment_size:
+            self._seal_active_segment()
+        return location
+
+    def _seal_active_segment(self):
+        self._active_file.close()
+        self._write_hint(self._active_id)
+        self._active_id += 1
+        self._segment_sizes[self._active_id] = 0
+        self._garbage_sizes[self._active_id] = 0
+        self._active_file = open(self._segment_path(self._active_id), 'ab')
+
+    def _read(self, location):
+        segment_id, value_offset, value_length = location
+        segment_map = self._maps.get(segment_id)
+        if segment_map is None or len(segment_map) < value_offset + value_length:
+            if segment_map is not None:
+                segment_map.close()
+            with open(self._segment_path(segment_id), 'rb') as segment_file:
+                segment_map = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment_id] = segment_map
+        return segment_map[value_offset:value_offset + value_length]
+
+    def __setitem__(self, asset_key, asset_and_tags):
+        """
+        Stores an :class:`~madam.core.Asset` in this asset storage using the
+        specified key.
+
+        The `asset_and_tags` argument is a tuple of the asset and the
+        associated tags.
+
+        Adding an asset key twice overwrites all tags for the asset.
+
+        :param asset_key: Unique value used as a key to store the asset.
+        :type asset_key: str
+        :param asset_and_tags: Tuple of the asset and the tags associated with the asset
+        :type asset_and_tags: (Asset, collections.Iterable)
+        """
+        asset, tags = asset_and_tags
+        if not tags:
+            tags = frozenset()
+        value = pickle.dumps((self._pack(asset), frozenset(tags)), protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._discard(asset_key)
+            self._index[asset_key] = self._append(asset_key, value)
+            self._update_indexes(asset_key, asset, frozenset(tags))
+        self._request_compaction()
+
+    def _store_items(self, items):
+        items = [(asset_key, asset, frozenset(tags or ())) for asset_key, asset, tags in items]
+        values = [pickle.dumps((self._pack(asset), tags), protocol=pickle.HIGHEST_PROTOCOL)
+                  for _, asset, tags in items]
+        with self._lock:
+            for (asset_key, asset, tags), value in zip(items, values):
+                self._discard(asset_key)
+                self._index[asset_key] = self._append(asset_key, value, flush=False)
+                self._update_indexes(asset_key, asset, tags)
+            self._active_file.flush()
+        self._request_compaction()
+
+    def __getitem__(self, asset_key):
+        """
+        Returns a tuple of the :class:`~madam.core.Asset` with the specified
+        key and the tags associated with the asset.
+
+        An error will be raised if the key does not exist.
+
+        :param asset_key: Key of the asset for which the tags should be returned
+        :type asset_key: str
+        :return: A tuple containing an asset and a set of the tags associated with the asset
+        :rtype: (Asset, set)
+        :raise KeyError: if the key does not exist in this storage
+        """
+        with self._lock:
+            if asset_key not in self._index:
+                raise KeyError('Asset with key %r cannot be found in storage' % asset_key)
+            value = self._read(self._index[asset_key])
+        stored_asset, tags = pickle.loads(value)
+        return self._unpack(stored_asset), tags
+
+    def __delitem__(self, asset_key):
+        """
+        Removes the :class:`~madam.core.Asset` with the specified key from this
+        asset storage, as well as all associated data (e.g. tags).
+
+        :param asset_key: Key of the asset to be removed
+        :type asset_key: str
+        :raise KeyError: if the key does not exist in this storage
+        """
+        with self._lock:
+            if asset_key not in self._index:
+                raise KeyError('Asset with key %r cannot be found in storage' % asset_key)
+            self._discard(asset_key)
+            self._append(asset_key, b'', flags=LogStorage._TOMBSTONE)
+            self._remove_from_indexes(asset_key)
+        self._request_compaction()
+
+    def __contains__(self, asset_key):
+        """
+        Returns whether an asset with the specified key is stored in this
+        asset storage.
+
+        :param asset_key: Key of the asset that should be tested
+        :type asset_key: str
+        :return: `True` if the key exists, `False` otherwise
+        :rtype: bool
+        """
+        with self._lock:
+            return asset_key in self._index
+
+    def __iter__(self):
+        """
+        Returns an object that can be used to iterate all asset that are stored
+        in this asset storage.
+
+        :return: Iterator object
+        """
+        with self._lock:
+            return iter(list(self._index.keys()))
+
+    def __len__(self):
+        """
+        Returns the number of assets in this storage.
+
+        :return: Number of assets in this storage
+        :rtype: int
+        """
+        with self._lock:
+            return len(self._index)
+
+    def _stored_assets(self):
+        for asset_key in self:
+            with self._lock:
+                location = self._index.get(asset_key)
+                if location is None:
+                    continue
+                value = self._read(location)
+            stored_asset, _ = pickle.loads(value)
+            yield stored_asset
+
+    def _compactable_segment_ids(self):
+        with self._lock:
+            return [segment_id for segment_id, segment_size in self._segment_sizes.items()
+                    if segment_id != self._active_id and segment_size and
+                    self._garbage_sizes[segment_id] / segment_size >= self.compaction_threshold]
+
+    def _request_compaction(self):
+        if self._compaction_thread is not None and self._compactable_segment_ids():
+            self._compaction_requested.set()
+
+    def _compact_in_background(self):
+        while True:
+            self._compaction_requested.wait()
+            self._compaction_requested.clear()
+            try:
+                self.compact()
+            except Exception:
+                _logger.exception('Compaction of %r failed.', self.path)
+            if self._closed:
+                return
+
+    def compact(self):
+        """
+        Reclaims the space of overwritten and deleted records.
+
+        Live records of all sealed segments whose ratio of reclaimable bytes
+        exceeds the compaction threshold are appended to the active segment
+        and the old segments are removed afterwards.
+
+        Records are copied without holding the lock of the storage, so the
+        storage can be read and written during compaction. Records that are
+        overwritten or deleted in the meantime are not copied.
+
+        :return: Number of bytes that were reclaimed
+        :rtype: int
+        """
+        with self._compaction_lock:
+            return self._compact()
+
+    def _compact(self):
+        with self._lock:
+            segment_ids = self._compactable_segment_ids()
+            if not segment_ids:
+                return 0
+            sealed_segment_ids = [segment_id for segment_id in self._segment_sizes
+                                  if segment_id != self._active_id]
+
+        # Tombstones must be kept as long as they mask records in older segments
+        first_segment_ids = {}
+        segment_entries = {}
+        for segment_id in sorted(sealed_segment_ids):
+            entries = self._read_hint(self._segment_path(segment_id, 'hint'))
+            if segment_id in segment_ids:
+                segment_entries[segment_id] = entries
+            for _, asset_key, _, _ in entries:
+                first_segment_ids.setdefault(asset_key, segment_id)
+
+        reclaimed_size = 0
+        for segment_id in segment_ids:
+            with open(self._segment_path(segment_id), 'rb') as segment_file:
+                segment_map = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for flags, asset_key, value_offset, value_length in segment_entries[segment_id]:
+                    location = segment_id, value_offset, value_length
+                    if flags & LogStorage._TOMBSTONE:
+                        if first_segment_ids[asset_key] < segment_id:
+                            with self._lock:
+                                if asset_key not in self._index:
+                                    self._append(asset_key, b'', flags=LogStorage._TOMBSTONE)
+                        continue
+                    with self._lock:
+                        if self._index.get(asset_key) != location:
+                            continue
+                    value = segment_map[value_offset:value_offset + value_length]
+                    with self._lock:
+                        # The record may have been overwritten or deleted while it was copied
+                        if self._index.get(asset_key) == location:
+                            self._index[asset_key] = self._append(asset_key, value)
+            finally:
+                segment_map.close()
+
+            with self._lock:
+                segment_map = self._maps.pop(segment_id, None)
+                if segment_map is not None:
+                    segment_map.close()
+                reclaimed_size += self._segment_sizes.pop(segment_id)
+                del self._garbage_sizes[segment_id]
+                os.remove(self._segment_path(segment_id, 'hint'))
+                os.remove(self._segment_path(segment_id))
+        return reclaimed_size
+
+    def close(self):
+        """
+        Writes the hint file of the active segment and releases all resources.
+        An empty active segment is removed.
+
+        The storage must not be used after it was closed.
+        """
+        self._closed = True
+        if self._compaction_thread is not None:
+            self._compaction_requested.set()
+            self._compaction_thread.join()
+        with self._lock:
+            self._active_file.close()
+            if self._segment_sizes[self._active_id]:
+                self._write_hint(self._active_id)
+            else:
+                os.remove(self._segment_path(self._active_id))
+            for segment_map in self._maps.values():
+                segment_map.close()
+            self._maps.clear()
+
+
+def _gear_table():
+    table = []
+    for byte in range(256):
+        digest = hashlib.sha256(('madam-gear-%d' % byte).encode('ascii')).digest()
+        table.append(int.from_bytes(digest[:4], 'big'))
+    return tuple(table)
+
+
+_GEAR_TABLE = _gear_table()
+# Tables that map each byte to one byte of its Gear value, starting with the least significant byte
+_GEAR_BYTE_TABLES = tuple(bytes((value >> (8*byte_index)) & 0xFF for value in _GEAR_TABLE)
+                          for byte_index in range(4))
+# Number of bytes that contribute to a 32-bit Gear fingerprint
+_GEAR_WINDOW_SIZE = 32
+# Number of bytes whose fingerprints are computed at once
+_GEAR_BLOCK_SIZE = 64*1024
+
+
+def _gear_boundary_candidates(data, block_start, block_size, masks):
+    """
+    Returns the positions in a block of data at which the Gear fingerprint of
+    the preceding window of bytes has no bits of a mask set.
+
+    Instead of updating the fingerprint byte by byte, the fingerprints of all
+    positions are computed at once: the Gear values are stored in 64-bit lanes
+    of a single integer, which is added to shifted copies of itself until each
+    lane contains the sum of the shifted Gear values of its window.
+
+    :param data: Data to be searched
+    :type data: memoryview
+    :param block_start: Offset of the block in the data
+    :type block_start: int
+    :param block_size: Maximum size of the block in bytes
+    :type block_size: int
+    :param masks: Masks of the fingerprint bits that must not be set
+    :type masks: iterable
+    :return: Sorted list of positions for each mask
+    :rtype: list
+    """
+    window_start = max(0, block_start - _GEAR_WINDOW_SIZE + 1)
+    window_data = bytes(data[window_start:block_start + block_size])
+    count = len(window_data)
+    lanes = bytearray(8*count)
+    for byte_index, byte_table in enumerate(_GEAR_BYTE_TABLES):
+        lanes[byte_index::8] = window_data.translate(byte_table)
+    fingerprints = int.from_bytes(lanes, 'little')
+    # The sums of at most 32 Gear values shifted by less than 32 bits fit into 64 bits
+    window_size = 1
+    while window_size < _GEAR_WINDOW_SIZE:
+        fingerprints += fingerprints << (65*window_size)
+        window_size *= 2
+    lanes = (fingerprints & ((1 << (64*count)) - 1)).to_bytes(8*count, 'little')
+    fingerprint_bytes = [lanes[byte_index::8] for byte_index in range(4)]
+
+    positions_by_mask = []
+    for mask in masks:
+        masked_fingerprints = 0
+        for byte_index, fingerprint_byte in enumerate(fingerprint_bytes):
+            mask_byte = (mask >> (8*byte_index)) & 0xFF
+            if mask_byte:
+                masked_byte = fingerprint_byte.translate(bytes(value & mask_byte for value in range(256)))
+                masked_fingerprints |= int.from_bytes(masked_byte, 'little')
+        masked_fingerprints = masked_fingerprints.to_bytes(count, 'little')[block_start - window_start:]
+        positions_by_mask.append([block_start + match.start()
+                                  for match in re.finditer(b'\x00', masked_fingerprints)])
+    return positions_by_mask
+
+
+def _content_defined_chunks(data, min_size, average_size, max_size):
+    """
+    Splits the specified data into content-defined chunks.
+
+    Chunk boundaries are determined by a Gear rolling hash, so that inserting
+    or removing bytes only changes the chunks around the modified region.
+    Normalized chunking is used to keep chunk sizes close to the average size.
+
+    The fingerprint is reset at the minimum size of each chunk. Once it covers
+    a whole window, it only depends on the window, so boundaries are looked up
+    in fingerprints that are computed for whole blocks of data.
+
+    :param data: Data to be split
+    :type data: bytes
+    :param min_size: Minimum chunk size in bytes
+    :type min_size: int
+    :param average_size: Average chunk size in bytes, must be a power of two
+    :type average_size: int
+    :param max_size: Maximum chunk size in bytes
+    :type max_size: int
+    :return: Generator of memory views of the chunks
+    """
+    bits = average_size.bit_length() - 1
+    # Use a stricter mask before and a looser mask after the average size
+    strict_mask = ((1 << (bits + 1)) - 1) << (32 - bits - 1)
+    loose_mask = ((1 << (bits - 1)) - 1) << (32 - bits + 1)
+    gear = _GEAR_TABLE
+    view = memoryview(data)
+    length = len(data)
+    # Boundary candidates of the current block for both masks
+    candidates_by_block = {}
+
+    def find_candidate(position, limit, mask_index):
+        while position < limit:
+            block_start = position - position % _GEAR_BLOCK_SIZE
+            if block_start not in candidates_by_block:
+                candidates_by_block.clear()
+                candidates_by_block[block_start] = _gear_boundary_candidates(
+                    view, block_start, _GEAR_BLOCK_SIZE, (strict_mask, loose_mask))
+            candidates = candidates_by_block[block_start][mask_index]
+            index = bisect.bisect_left(candidates, position)
+            if index < len(candidates):
+                return candidates[index] if candidates[index] < limit else None
+            position = block_start + _GEAR_BLOCK_SIZE
+        return None
+
+    start = 0
+    while start < length:
+        end = min(length, start + max_size)
+        if end - start <= min_size:
+            yield view[start:end]
+            break
+        normal_end = min(end, start + average_size)
+        position = start + min_size
+        window_end = min(end, position + _GEAR_WINDOW_SIZE - 1)
+        fingerprint = 0
+        for position in range(position, window_end):
+            fingerprint = ((fingerprint << 1) + gear[data[position]]) & 0xFFFFFFFF
+            if not fingerprint & (strict_mask if position < normal_end else loose_mask):
+                boundary = position + 1
+                break
+        else:
+            candidate = find_candidate(window_end, normal_end, 0)
+            if candidate is None:
+                candidate = find_candidate(max(window_end, normal_end), end, 1)
+            boundary = end if candidate is None else candidate + 1
+        yield view[start:boundary]
+        start = boundary
+
+
+class DeduplicatingStorage(AssetStorage):
+    """
+    Represents a storage backend for :class:`~madam.core.Asset` objects that
+    stores identical parts of essences only once. Asset keys must be strings.
+
+    Essences are split into content-defined chunks using a rolling hash. Each
+    distinct chunk is stored once and reference counted, and essences are
+    reassembled from their chunks when they are read. Assets that are derived
+    from each other, e.g. by changing only their metadata or by trimming them,
+    share most of their chunks.
+
+    Chunks and the chunk lists of the assets are kept in another storage, so
+    the deduplicated data persists if that storage is persistent, e.g. a
+    :class:`~madam.core.LogStorage`. The backend must not be used by other
+    storage objects at the same time. New chunks are written to the backend in
+    batches.
+
+    A :class:`~madam.core.ShelveStorage` is unsuitable as a backend: it opens
+    its database for each read, and its performance degrades with the large
+    number of small entries that the chunks of many assets add up to.
+    """
+    _ASSET_PREFIX = 'asset:'
+    _CHUNK_PREFIX = 'chunk:'
+    # Hexadecimal SHA-256 digest and size of a chunk
+    _CHUNK_REFERENCE = struct.Struct('>64sI')
+    # Number of new chunks that are written to the backend at once
+    _batch_size = 256
+
+    def __init__(self, backend=None, min_chunk_size=2*1024, average_chunk_size=8*1024, max_chunk_size=64*1024):
+        """
+        Initializes a new `DeduplicatingStorage` object.
+
+        Assets that are already stored in the backend will be loaded.
+
+        :param backend: Storage for the chunks and the chunk lists of the
+            assets, or `None` to keep them in memory
+        :type backend: AssetStorage or None
+        :param min_chunk_size: Minimum chunk size in bytes
+        :type min_chunk_size: int
+        :param average_chunk_size: Average chunk size in bytes, must be a power of two
+        :type average_chunk_size: int
+        :param max_chunk_size: Maximum chunk size in bytes
+        :type max_chunk_size: int
+        """
+        super().__init__(compression=False)
+        if average_chunk_size & (average_chunk_size - 1) or average_chunk_size < 4:
+            raise ValueError('Average chunk size must be a power of two: %r' % average_chunk_size)
+        if not 0 < min_chunk_size <= average_chunk_size <= max_chunk_size:
+            raise ValueError('Invalid chunk sizes: min=%r, average=%r, max=%r' %
+                             (min_chunk_size, average_chunk_size, max_chunk_size))
+        self.min_chunk_size = min_chunk_size
+        self.average_chunk_size = average_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.backend = InMemoryStorage(compression=False) if backend is None else backend
+
+        # Size and reference count of each distinct chunk
+        self._chunks = {}
+        for backend_key in self.backend:
+            if backend_key.startswith(DeduplicatingStorage._ASSET_PREFIX):
+                for digest, size in self._chunk_references(backend_key):
+                    self._chunks.setdefault(digest, [size, 0])[1] += 1
+        # Remove chunks of assets whose chunk list was not written
+        for backend_key in list(self.backend):
+            if backend_key.startswith(DeduplicatingStorage._CHUNK_PREFIX) and \
+                    backend_key[len(DeduplicatingStorage._CHUNK_PREFIX):] not in self._chunks:
+                del self.backend[backend_key]
+
+    def _chunk_references(self, backend_key):
+        chunk_list, _ = self.backend[backend_key]
+        chunk_list_data = chunk_list._essence_data
+        return [(digest.decode('ascii'), size) for digest, size in
+                DeduplicatingStorage._CHUNK_REFERENCE.iter_unpack(chunk_list_data)]
+
+    def _release(self, chunk_references):
+        for digest, _ in chunk_references:
+            chunk = self._chunks[digest]
+            chunk[1] -= 1
+            if not chunk[1]:
+                del self._chunks[digest]
+                del self.backend[DeduplicatingStorage._CHUNK_PREFIX + digest]
+
+    def __setitem__(self, asset_key, asset_and_tags):
+        """
+        Stores an :class:`~madam.core.Asset` in this asset storage using the
+        specified key.
+
+        The `asset_and_tags` argument is a tuple of the asset and the
+        associated tags.
+
+        Adding an asset key twice overwrites all tags for the asset.
+
+        :param asset_key: Unique value used as a key to store the asset.
+        :param asset_and_tags: Tuple of the asset and the tags associated with the asset
+        :type asset_and_tags: tuple
+        """
+        asset, tags = asset_and_tags
+        if not tags:
+            tags = frozenset()
+        chunk_references = []
+        new_chunks = []
+        for chunk_data in _content_defined_chunks(asset._essence_data, self.min_chunk_size,
+                                                  self.average_chunk_size, self.max_chunk_size):
+            digest = hashlib.sha256(chunk_data).hexdigest()
+            chunk = self._chunks.get(digest)
+            if chunk is None:
+                new_chunks.append((DeduplicatingStorage._CHUNK_PREFIX + digest, Asset(io.BytesIO(chunk_data)), None))
+                self._chunks[digest] = [len(chunk_data), 1]
+            else:
+                chunk[1] += 1
+            chunk_references.append((digest, len(chunk_data)))
+            if len(new_chunks) >= DeduplicatingStorage._batch_size:
+                self.backend._store_items(new_chunks)
+                new_chunks = []
+        if new_chunks:
+            self.backend._store_items(new_chunks)
+
+        backend_key = DeduplicatingStorage._ASSET_PREFIX + asset_key
+        previous_chunk_references = self._chunk_references(backend_key) if backend_key in self.backend else []
+        chunk_list = Asset.__new__(Asset)
+        chunk_list.__setstate__(dict(asset.__dict__, _essence_data=b''.join(
+            DeduplicatingStorage._CHUNK_REFERENCE.pack(digest.encode('ascii'), size)
+            for digest, size in chunk_references)))
+        self.backend[backend_key] = chunk_list, frozenset(tags)
+        self._release(previous_chunk_references)
+        self._update_indexes(asset_key, asset, frozenset(tags))
+
+    def __getitem__(self, asset_key):
+        """
+        Returns a tuple of the :class:`~madam.core.Asset` with the specified
+        key and the tags associated with the asset.
+
+        An error will be raised if the key does not exist.
+
+        :param asset_key: Key of the asset for which the tags should be returned
+        :return: A tuple containing an asset and a set of the tags associated with the asset
+        :rtype: (Asset, set)
+        :raise KeyError: if the key does not exist in this storage
+        """
+        backend_key = DeduplicatingStorage._ASSET_PREFIX + asset_key
+        if backend_key not in self.backend:
+            raise KeyError('Asset with key %r cannot be found in storage' % asset_key)
+        chunk_list, tags = self.backend[backend_key]
+        essence_data = b''.join(self.backend[DeduplicatingStorage._CHUNK_PREFIX + digest][0]._essence_data
+                                for digest, _ in self._chunk_references(backend_key))
+        asset = Asset.__new__(Asset)
+        asset.__setstate__(dict(chunk_list.__dict__, _essence_data=essence_data))
+        return asset, tags
+
+    def __delitem__(self, asset_key):
+        """
+        Removes the :class:`~madam.core.Asset` with the specified key from this
+        asset storage, as well as all associated data (e.g. tags).
+
+        Chunks that are not used by other assets are removed as well.
+
+        :param asset_key: Key of the asset to be removed
+        :raise KeyError: if the key does not exist in this storage
+        """
+        backend_key = DeduplicatingStorage._ASSET_PREFIX + asset_key
+        if backend_key not in self.backend:
+            raise KeyError('Asset with key %r cannot be found in storage' % asset_key)
+        chunk_references = self._chunk_references(backend_key)
+        del self.backend[backend_key]
+        self._release(chunk_references)
+        self._remove_from_indexes(asset_key)
+
+    def __contains__(self, asset_key):
+        """
+        Returns whether an asset with the specified key is stored in this
+        asset storage.
+
+        :param asset_key: Key of the asset that should be tested
+        :return: `True` if the key exists, `False` otherwise
+        :rtype: bool
+        """
+        return DeduplicatingStorage._ASSET_PREFIX + asset_key in self.backend
+
+    def __iter__(self):
+        """
+        Returns an object that can be used to iterate all asset that are stored
+        in this asset storage.
+
+        :return: Iterator object
+        """
+        prefix_length = len(DeduplicatingStorage._ASSET_PREFIX)
+        return iter([backend_key[prefix_length:] for backend_key in self.backend
+                     if backend_key.startswith(DeduplicatingStorage._ASSET_PREFIX)])
+
+    def __len__(self):
+        """
+        Returns the number of assets in this storage.
+
+        :return: Number of assets in this storage
+        :rtype: int
+        """
+        return sum(1 for _ in self)
+
+    def statistics(self):
+        """
+        Returns statistics about the assets in this storage.
+
+        In addition to the entries described in
+        :func:`~madam.core.AssetStorage.statistics`, the returned dictionary
+        contains the number of distinct chunks (``chunk_count``). The size of
+        the stored essences is the total size of all distinct chunks.
+
+        :return: Storage statistics
+        :rtype: dict
+        """
+        return dict(
+            asset_count=len(self),
+            compressed_asset_count=0,
+            essence_size=sum(size*reference_count for size, reference_count in self._chunks.values()),
+            stored_essence_size=sum(size for size, _ in self._chunks.values()),
+            chunk_count=len(self._chunks),
+        )
+
+
+class CatalogSnapshot:
+    """
+    Represents a read-only snapshot of the metadata and tags of all assets in
+    an :class:`~madam.core.AssetStorage`. Asset keys must be strings.
+
+    The snapshot is stored in a file that is accessed using a memory map.
+    Keys are kept in a sorted table, so lookups use a binary search on the
+    mapped data. Tags are stored with lists of the numbers of their entries,
+    and entries are stored with lists of the numbers of their tags, so both
+    can be looked up directly. Only the metadata of requested entries is
+    deserialized. Processes that open the
+    same snapshot file, or that are forked after it was opened, share a single
+    physical copy of the data.
+    """
+    _MAGIC = b'MADAMCT2'
+    _HEADER = struct.Struct('=8sQQ')
+    _ENTRY = struct.Struct('=QIQIQI')
+    _TAG = struct.Struct('=QIQI')
+
+    def __init__(self, path):
+        """
+        Opens the snapshot at the specified path.
+
+        :param path: File system path of the snapshot file
+        :type path: pathlib.Path or str
+        :raise ValueError: if the file is not a valid snapshot
+        """
+        self.path = path
+        with open(str(path), 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._entry_count, self._tag_count = CatalogSnapshot._HEADER.unpack_from(self._map, 0)
+        if magic != CatalogSnapshot._MAGIC:
+            self._map.close()
+            raise ValueError('The file %r is not a catalog snapshot.' % path)
+        self._entries_offset = CatalogSnapshot._HEADER.size
+        self._tags_offset = self._entries_offset + self._entry_count*CatalogSnapshot._ENTRY.size
+
+    @staticmethod
+    def create(storage, path):
+        """
+        Writes a snapshot of the metadata and tags of all assets in the
+        specified storage to a file.
+
+        An existing file at the path will be replaced atomically.
+
+        :param storage: Storage whose assets should be included
+        :type storage: AssetStorage
+        :param path: File system path of the snapshot file
+        :type path: pathlib.Path or str
+        :return: Opened snapshot
+        :rtype: CatalogSnapshot
+        """
+        entries = []
+        for asset_key, asset, tags in storage._iter_items():
+            metadata_data = pickle.dumps(asset.metadata, protocol=pickle.HIGHEST_PROTOCOL)
+            entries.append((asset_key.encode('utf-8'), metadata_data, tags))
+        entries.sort(key=lambda entry: entry[0])
+
+        entry_numbers_by_tag = {}
+        for entry_number, (_, _, tags) in enumerate(entries):
+            for tag in tags:
+                entry_numbers_by_tag.setdefault(pickle.dumps(tag, protocol=pickle.HIGHEST_PROTOCOL), []) \
+                    .append(entry_number)
+        tags = sorted(entry_numbers_by_tag.items())
+        tag_numbers_by_entry = [[] for _ in entries]
+        for tag_number, (_, entry_numbers) in enumerate(tags):
+            for entry_number in entry_numbers:
+                tag_numbers_by_entry[entry_number].append(tag_number)
+
+        data_offset = CatalogSnapshot._HEADER.size + len(entries)*CatalogSnapshot._ENTRY.size + \
+            len(tags)*CatalogSnapshot._TAG.size
+        temp_path = '%s.tmp' % path
+        with open(temp_path, 'wb') as file:
+            file.write(CatalogSnapshot._HEADER.pack(CatalogSnapshot._MAGIC, len(entries), len(tags)))
+            # The tag numbers of the entries are stored after the data of the tags
+            tag_numbers_offset = data_offset + \
+                sum(len(key_data) + len(metadata_data) for key_data, metadata_data, _ in entries) + \
+                sum(len(tag_data) + 4*len(entry_numbers) for tag_data, entry_numbers in tags)
+            offset = data_offset
+            for (key_data, metadata_data, _), tag_numbers in zip(entries, tag_numbers_by_entry):
+                file.write(CatalogSnapshot._ENTRY.pack(offset, len(key_data),
+                                                       offset + len(key_data), len(metadata_data),
+                                                       tag_numbers_offset, len(tag_numbers)))
+                offset += len(key_data) + len(metadata_data)
+                tag_numbers_offset += 4*len(tag_numbers)
+            for tag_data, entry_numbers in tags:
+                file.write(CatalogSnapshot._TAG.pack(offset, len(tag_data),
+                                                     offset + len(tag_data), len(entry_numbers)))
+                offset += len(tag_data) + 4*len(entry_numbers)
+            for key_data, metadata_data, _ in entries:
+                file.write(key_data)
+                file.write(metadata_data)
+            for tag_data, entry_numbers in tags:
+                file.write(tag_data)
+                file.write(array.array('I', entry_numbers).tobytes())
+            for tag_numbers in tag_numbers_by_entry:
+                file.write(array.array('I', tag_numbers).tobytes())
+        os.replace(temp_path, str(path))
+        return CatalogSnapshot(path)
+
+    def _key_data(self, entry_number):
+        key_offset, key_length, _, _, _, _ = CatalogSnapshot._ENTRY.unpack_from(
+            self._map, self._entries_offset + entry_number*CatalogSnapshot._ENTRY.size)
+        return self._map[key_offset:key_offset + key_length]
+
+    def _find(self, asset_key):
+        key_data = asset_key.encode('utf-8')
+        low, high = 0, self._entry_count
+        while low < high:
+            middle = (low + high)//2
+            if self._key_data(middle) < key_data:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._entry_count and self._key_data(low) == key_data:
+            return low
+        return None
+
+    def _entry_numbers(self, tag):
+        tag_data = pickle.dumps(tag, protocol=pickle.HIGHEST_PROTOCOL)
+        low, high = 0, self._tag_count
+        while low < high:
+            middle = (low + high)//2
+            tag_offset, tag_length, _, _ = CatalogSnapshot._TAG.unpack_from(
+                self._map, self._tags_offset + middle*CatalogSnapshot._TAG.size)
+            if self._map[tag_offset:tag_offset + tag_length] < tag_data:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._tag_count:
+            tag_offset, tag_length, numbers_offset, number_count = CatalogSnapshot._TAG.unpack_from(
+                self._map, self._tags_offset + low*CatalogSnapshot._TAG.size)
+            if self._map[tag_offset:tag_offset + tag_length] == tag_data:
+                return memoryview(self._map)[numbers_offset:numbers_offset + 4*number_count].cast('I')
+        return memoryview(b'').cast('I')
+
+    def __len__(self):
+        """
+        Returns the number of assets in this snapshot.
+
+        :return: Number of assets
+        :rtype: int
+        """
+        return self._entry_count
+
+    def __contains__(self, asset_key):
+        """
+        Returns whether an asset with the specified key is contained in this
+        snapshot.
+
+        :param asset_key: Key of the asset that should be tested
+        :type asset_key: str
+        :return: `True` if the key exists, `False` otherwise
+        :rtype: bool
+        """
+        return self._find(asset_key) is not None
+
+    def __iter__(self):
+        """
+        Returns an iterator over the keys of all assets in this snapshot in
+        sorted order.
+
+        :return: Iterator object
+        """
+        for entry_number in range(self._entry_count):
+            yield self._key_data(entry_number).decode('utf-8')
+
+    def metadata(self, asset_key):
+        """
+        Returns the metadata of the asset with the specified key.
+
+        :param asset_key: Key of the asset
+        :type asset_key: str
+        :return: Metadata of the asset
+        :rtype: frozendict
+        :raise KeyError: if the key does not exist in this snapshot
+        """
+        entry_number = self._find(asset_key)
+        if entry_number is None:
+            raise KeyError('Asset with key %r cannot be found in snapshot' % asset_key)
+        _, _, metadata_offset, metadata_length, _, _ = CatalogSnapshot._ENTRY.unpack_from(
+            self._map, self._entries_offset + entry_number*CatalogSnapshot._ENTRY.size)
+        return pickle.loads(self._map[metadata_offset:metadata_offset + metadata_length])
+
+    def tags(self, asset_key):
+        """
+        Returns the tags of the asset with the specified key.
+
+        :param asset_key: Key of the asset
+        :type asset_key: str
+        :return: Tags of the asset
+        :rtype: frozenset
+        :raise KeyError: if the key does not exist in this snapshot
+        """
+        entry_number = self._find(asset_key)
+        if entry_number is None:
+            raise KeyError('Asset with key %r cannot be found in snapshot' % asset_key)
+        _, _, _, _, numbers_offset, number_count = CatalogSnapshot._ENTRY.unpack_from(
+            self._map, self._entries_offset + entry_number*CatalogSnapshot._ENTRY.size)
+        tags = set()
+        for tag_number in array.array('I', self._map[numbers_offset:numbers_offset + 4*number_count]):
+            tag_offset, tag_length, _, _ = CatalogSnapshot._TAG.unpack_from(
+                self._map, self._tags_offset + tag_number*CatalogSnapshot._TAG.size)
+            tags.add(pickle.loads(self._map[tag_offset:tag_offset + tag_length]))
+        return frozenset(tags)
+
+    def filter_by_tags(self, *tags):
+        """
+        Returns a set of all asset keys in this snapshot that have at least the
+        specified tags.
+
+        :param \\*tags: Mandatory tags of an asset to be included in result
+        :return: Keys of the assets whose tags are a superset of the specified tags
+        :rtype: set
+        """
+        if not tags:
+            return set(self)
+        entry_number_lists = sorted((self._entry_numbers(tag) for tag in set(tags)), key=len)
+        entry_numbers = set(entry_number_lists[0])
+        for other_entry_numbers in entry_number_lists[1:]:
+            entry_numbers.intersection_update(other_entry_numbers)
+        for other_entry_numbers in entry_number_lists:
+            other_entry_numbers.release()
+        return {self._key_data(entry_number).decode('utf-8') for entry_number in entry_numbers}
+
+    def close(self):
+        """
+        Releases the memory map of this snapshot.
+        """
+        self._map.close()
+
+
+class MetadataCache:
+    """
+    Represents a persistent cache for the results of
+    :func:`~madam.core.Madam.read`.
+
+    Entries are stored in an SQLite database and are keyed by a digest of the
+    file contents and a version string that identifies the processors that
+    produced them. Only the metadata is stored, together with the names of the
+    metadata processors that removed metadata from the essence. The essence is
+    restored by stripping the file contents with these processors again, so
+    the size of the cache does not depend on the size of the files. Whenever
+    the total size of the stored data exceeds the maximum size, the least
+    recently used entries are evicted.
+
+    Multiple processes can safely share the same cache file.
+    """
+    # Seconds to wait for a lock held by another process
+    _timeout = 30.0
+
+    def __init__(self, path, max_size=16*1024*1024):
+        """
+        Initializes a new `MetadataCache` with the specified path.
+
+        :param path: File system path of the cache database
+        :type path: pathlib.Path or str
+        :param max_size: Maximum number of bytes of stored entry data
+        :type max_size: int
+        """
+        if max_size <= 0:
+            raise ValueError('The maximum cache size must be positive.')
+        self.path = path
+        self.max_size = max_size
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS entries ('
+                               'digest BLOB NOT NULL, version TEXT NOT NULL, '
+                               'entry TEXT NOT NULL, size INTEGER NOT NULL, '
+                               'accessed REAL NOT NULL, PRIMARY KEY (digest, version))')
+            connection.execute('CREATE INDEX IF NOT EXISTS entries_by_access ON entries (accessed)')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        Opens a connection to the cache database. The changes made using the
+        connection are committed when the context is left without an error.
+
+        :return: Context manager yielding the opened connection
+        """
+        connection = sqlite3.connect(str(self.path), timeout=MetadataCache._timeout)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    @staticmethod
+    def digest(file):
+        """
+        Returns the digest of the remaining contents of the specified file.
+
+        :param file: file-like object whose contents should be hashed
+        :type file: file-like object
+        :return: SHA-256 digest
+        :rtype: bytes
+        """
+        hasher = hashlib.sha256()
+        for chunk in iter(functools.partial(file.read, 1024*1024), b''):
+            hasher.update(chunk)
+        return hasher.digest()
+
+    def get(self, digest, version):
+        """
+        Returns the cached metadata and the names of the metadata processors
+        that stripped the essence for the specified key, and marks the entry
+        as recently used.
+
+        :param digest: Digest of the file contents
+        :type digest: bytes
+        :param version: Version of the processors that read the file
+        :type version: str
+        :return: Tuple of the metadata and the names of the metadata
+                 processors, or `None` if the entry does not exist
+        :rtype: (dict, tuple) or None
+        """
+        with self._connect() as connection:
+            row = connection.execute('SELECT entry FROM entries WHERE digest = ? AND version = ?',
+                                     (digest, version)).fetchone()
+            if row is None:
+                return None
+            connection.execute('UPDATE entries SET accessed = ? WHERE digest = ? AND version = ?',
+                               (time.time(), digest, version))
+        entry = json.loads(row[0])
+        return _decode_json_value(entry['metadata']), tuple(entry['metadata_processors'])
+
+    def put(self, digest, version, metadata, metadata_processors=()):
+        """
+        Stores the metadata and the names of the metadata processors that
+        stripped the essence for the specified key, and evicts the least
+        recently used entries if the cache grew too large.
+
+        Entries that are larger than the cache or that contain metadata values
+        which cannot be encoded as JSON are not stored.
+
+        :param digest: Digest of the file contents
+        :type digest: bytes
+        :param version: Version of the processors that read the file
+        :type version: str
+        :param metadata: Metadata that was read from the file
+        :type metadata: dict
+        :param metadata_processors: Names of the metadata processors whose
+               :func:`~madam.core.MetadataProcessor.strip` method must be
+               applied to the file contents in order to obtain the essence
+        :type metadata_processors: iterable
+        """
+        try:
+            entry = json.dumps(dict(metadata=_encode_json_value(metadata),
+                                    metadata_processors=list(metadata_processors)))
+        except ValueError:
+            return
+        size = len(entry)
+        if size > self.max_size:
+            return
+        with self._connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                               (digest, version, entry, size, time.time()))
+            excess_size = connection.execute('SELECT TOTAL(size) FROM entries').fetchone()[0] - self.max_size
+            if excess_size <= 0:
+                return
+            evicted_keys = []
+            for evicted_digest, evicted_version, evicted_size in connection.execute(
+                    'SELECT digest, version, size FROM entries ORDER BY accessed'):
+                evicted_keys.append((evicted_digest, evicted_version))
+                excess_size -= evicted_size
+                if excess_size <= 0:
+                    break
+            connection.executemany('DELETE FROM entries WHERE digest = ? AND version = ?', evicted_keys)
+
+    def clear(self):
+        """
+        Removes all entries from the cache.
+        """
+        with self._connect() as connection:
+            connection.execute('DELETE FROM entries')
+
+    def __len__(self):
+        """
+        Returns the number of entries in the cache.
+
+        :return: Number of entries
+        :rtype: int
+        """
+        with self._connect() as connection:
+            return connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    @property
+    def size(self):
+        """
+        Total number of bytes of entry data in the cache.
+        """
+        with self._connect() as connection:
+            return int(connection.execute('SELECT TOTAL(size) FROM entries').fetchone()[0])
+
 
 def _immutable(value):
     """
@@ -449,6 +2092,87 @@ def _immutable(value):
         return value
 
 
+def _encode_utc_offset(value):
+    utc_offset = value.utcoffset()
+    return None if utc_offset is None else utc_offset.total_seconds()
+
+
+def _decode_utc_offset(seconds):
+    return None if seconds is None else datetime.timezone(datetime.timedelta(seconds=seconds))
+
+
+def _encode_json_value(value):
+    """
+    Converts the specified metadata value to a representation that can be
+    serialized as JSON.
+
+    Values other than strings, numbers, booleans, and `None` are represented
+    as objects with their type and an encoded value.
+
+    :param value: Metadata value
+    :return: JSON-serializable representation of the value
+    :raise ValueError: if the type of the value is not supported
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (dict, frozendict)):
+        return dict(type='dict', value=[[_encode_json_value(k), _encode_json_value(v)] for k, v in value.items()])
+    if isinstance(value, (list, tuple)):
+        return dict(type='tuple', value=[_encode_json_value(v) for v in value])
+    if isinstance(value, (set, frozenset)):
+        return dict(type='frozenset', value=[_encode_json_value(v) for v in value])
+    if isinstance(value, bytes):
+        return dict(type='bytes', value=base64.b64encode(value).decode('ascii'))
+    if isinstance(value, Fraction):
+        return dict(type='fraction', value=[value.numerator, value.denominator])
+    if isinstance(value, datetime.datetime):
+        return dict(type='datetime', value=[value.year, value.month, value.day, value.hour, value.minute,
+                                            value.second, value.microsecond, _encode_utc_offset(value)])
+    if isinstance(value, datetime.date):
+        return dict(type='date', value=[value.year, value.month, value.day])
+    if isinstance(value, datetime.time):
+        return dict(type='time', value=[value.hour, value.minute, value.second, value.microsecond,
+                                        _encode_utc_offset(value)])
+    if isinstance(value, MimeType):
+        return dict(type='mime_type', value=str(value))
+    raise ValueError('Unsupported metadata value: %r' % (value,))
+
+
+def _decode_json_value(value):
+    """
+    Converts the specified representation created by
+    :func:`~madam.core._encode_json_value` back to a read-only metadata value.
+
+    :param value: JSON representation of the value
+    :return: Read-only metadata value
+    :raise ValueError: if the representation is invalid
+    """
+    if not isinstance(value, dict):
+        if isinstance(value, list):
+            raise ValueError('Invalid metadata value: %r' % (value,))
+        return value
+    value_type, encoded_value = value.get('type'), value.get('value')
+    if value_type == 'dict':
+        return frozendict({_decode_json_value(k): _decode_json_value(v) for k, v in encoded_value})
+    if value_type == 'tuple':
+        return tuple(_decode_json_value(v) for v in encoded_value)
+    if value_type == 'frozenset':
+        return frozenset(_decode_json_value(v) for v in encoded_value)
+    if value_type == 'bytes':
+        return base64.b64decode(encoded_value)
+    if value_type == 'fraction':
+        return Fraction(*encoded_value)
+    if value_type == 'datetime':
+        return datetime.datetime(*encoded_value[:7], tzinfo=_decode_utc_offset(encoded_value[7]))
+    if value_type == 'date':
+        return datetime.date(*encoded_value)
+    if value_type == 'time':
+        return datetime.time(*encoded_value[:4], tzinfo=_decode_utc_offset(encoded_value[4]))
+    if value_type == 'mime_type':
+        return MimeType(encoded_value)
+    raise ValueError('Invalid metadata value: %r' % (value,))
+
+
 def _mutable(value):
     """
     Creates a writeable version from the specified (read-only) value.
@@ -583,6 +2307,163 @@ class Pipeline:
         self.operators.append(operator)
 
 
+class Priority(Enum):
+    """
+    Represents the priority class of a job in an :class:`~madam.core.OperatorQueue`.
+    """
+    #: Latency-sensitive work, e.g. thumbnails for interactive requests
+    INTERACTIVE = 0
+    #: Regular work
+    NORMAL = 1
+    #: Long-running background work, e.g. transcoding
+    BATCH = 2
+
+
+class OperatorQueue:
+    """
+    Represents a queue that applies operators to assets in a pool of worker
+    threads.
+
+    Jobs are started in the order of their priority class. Jobs of the same
+    class are started in the order of their deadlines, and jobs without a
+    deadline in the order they were submitted. Thus, queued jobs of lower
+    priority are preempted by every job of higher priority that is submitted
+    before they start. Running jobs are never interrupted. To ensure that
+    interactive jobs do not have to wait for long-running jobs, some workers
+    can be reserved for jobs of the highest priority.
+
+    Jobs can be cancelled using the future that is returned on submission,
+    as long as they did not start yet. Jobs whose deadline passed before they
+    could be started fail with an :class:`~madam.core.OperatorError`.
+    """
+    def __init__(self, workers=1, reserved_workers=0):
+        """
+        Initializes a new `OperatorQueue` and starts its workers.
+
+        :param workers: Total number of worker threads
+        :type workers: int
+        :param reserved_workers: Number of workers that only run jobs with
+            :attr:`~madam.core.Priority.INTERACTIVE` priority
+        :type reserved_workers: int
+        """
+        if workers < 1:
+            raise ValueError('Invalid number of workers: %r' % workers)
+        if not 0 <= reserved_workers < workers:
+            raise ValueError('Invalid number of reserved workers: %r' % reserved_workers)
+        self._condition = threading.Condition()
+        self._jobs = []
+        self._job_count = 0
+        self._shutdown = False
+        self._workers = [threading.Thread(target=self._work, args=(worker_index < reserved_workers,), daemon=True)
+                         for worker_index in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, operator, asset, priority=Priority.NORMAL, deadline=None):
+        """
+        Adds a job that applies the specified operator to the specified asset.
+
+        :param operator: Configured operator, e.g. as returned by a method
+            decorated with :func:`~madam.core.operator`
+        :type operator: callable
+        :param asset: Asset to be processed
+        :type asset: Asset
+        :param priority: Priority class of the job
+        :type priority: Priority
+        :param deadline: Number of seconds after which the job must have
+            been started, or `None` if the job never expires
+        :type deadline: float or None
+        :return: Future that will contain the processed asset
+        :rtype: concurrent.futures.Future
+        :raise RuntimeError: if the queue was shut down
+        """
+        future = Future()
+        expiration_time = float('inf') if deadline is None else time.monotonic() + deadline
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError('Unable to submit job to a queue that was shut down')
+            heapq.heappush(self._jobs, (priority.value, expiration_time, self._job_count,
+                                        future, operator, asset))
+            self._job_count += 1
+            self._condition.notify_all()
+        return future
+
+    @property
+    def queue_depth(self):
+        """
+        Number of jobs that were neither started nor cancelled.
+        """
+        with self._condition:
+            return sum(1 for job in self._jobs if not job[3].cancelled())
+
+    def _next_job(self, reserved):
+        """
+        Removes the next job that can be run by a worker from the queue.
+
+        Must be called while holding the lock of the queue.
+
+        :param reserved: Whether the worker only runs interactive jobs
+        :return: Job tuple, or `None` if there is no suitable job
+        """
+        while self._jobs and self._jobs[0][3].cancelled():
+            heapq.heappop(self._jobs)
+        if not self._jobs:
+            return None
+        if reserved and self._jobs[0][0] != Priority.INTERACTIVE.value:
+            return None
+        return heapq.heappop(self._jobs)
+
+    def _work(self, reserved):
+        while True:
+            with self._condition:
+                job = self._next_job(reserved)
+                while job is None:
+                    if self._shutdown:
+                        return
+                    self._condition.wait()
+                    job = self._next_job(reserved)
+            _, expiration_time, _, future, operator, asset = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            if time.monotonic() > expiration_time:
+                future.set_exception(OperatorError('Deadline of the job was exceeded before it could be started'))
+                continue
+            try:
+                processed_asset = operator(asset)
+            except BaseException as error:
+                future.set_exception(error)
+            else:
+                future.set_result(processed_asset)
+
+    def shutdown(self, wait=True, cancel_jobs=False):
+        """
+        Stops accepting new jobs. Workers exit after all queued jobs have
+        been processed.
+
+        :param wait: Whether to wait until all workers have exited
+        :type wait: bool
+        :param cancel_jobs: Whether jobs that were not started should be cancelled
+        :type cancel_jobs: bool
+        """
+        with self._condition:
+            self._shutdown = True
+            if cancel_jobs:
+                for job in self._jobs:
+                    job[3].cancel()
+                self._jobs.clear()
+            self._condition.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+        return False
+
+
 class Processor(metaclass=abc.ABCMeta):
     """
     Represents an entity that can create :class:`~madam.core.Asset` objects
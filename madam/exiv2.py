@@ -1,6 +1,7 @@
+import contextlib
 import datetime
 import io
-import shutil
+import os
 import tempfile
 from fractions import Fraction
 
@@ -11,6 +12,42 @@ from madam.core import MetadataProcessor, UnsupportedFormatError
 from madam.mime import MimeType
 
 
+#: Directory for temporary files if the exiv2 bindings cannot read from memory
+_TEMPORARY_DIRECTORY = '/dev/shm' if os.access('/dev/shm', os.W_OK) else None
+
+
+@contextlib.contextmanager
+def _image_metadata(data):
+    """
+    Provides the exiv2 metadata of the specified data.
+
+    The data is passed to exiv2 in memory if the bindings support it.
+    Otherwise, a temporary file on a RAM-backed file system is used, if
+    available.
+
+    :param data: Image data
+    :type data: bytes
+    """
+    if hasattr(pyexiv2.ImageMetadata, 'from_buffer'):
+        yield pyexiv2.ImageMetadata.from_buffer(data)
+        return
+    with tempfile.NamedTemporaryFile(dir=_TEMPORARY_DIRECTORY) as tmp:
+        tmp.write(data)
+        tmp.flush()
+        yield pyexiv2.ImageMetadata(tmp.name)
+
+
+def _image_data(metadata):
+    """
+    Returns the image data of the specified exiv2 metadata after it was
+    written.
+    """
+    if metadata.filename is None:
+        return metadata.buffer
+    with open(metadata.filename, 'rb') as file:
+        return file.read()
+
+
 def _convert_sequence(dec_enc):
     return lambda exiv2_values: tuple(map(dec_enc[0], exiv2_values)), \
            lambda values: list(map(dec_enc[1], values))
@@ -153,10 +190,7 @@ class Exiv2MetadataProcessor(MetadataProcessor):
         return 'exif', 'iptc'
 
     def read(self, file):
-        with tempfile.NamedTemporaryFile() as tmp:
-            tmp.write(file.read())
-            tmp.flush()
-            metadata = pyexiv2.ImageMetadata(tmp.name)
+        with _image_metadata(file.read()) as metadata:
             try:
                 metadata.read()
             except OSError:
@@ -178,12 +212,7 @@ class Exiv2MetadataProcessor(MetadataProcessor):
         return metadata_by_format
 
     def strip(self, file):
-        result = io.BytesIO()
-        with tempfile.NamedTemporaryFile() as tmp:
-            tmp.write(file.read())
-            tmp.flush()
-            metadata = pyexiv2.ImageMetadata(tmp.name)
-
+        with _image_metadata(file.read()) as metadata:
             try:
                 metadata.read()
             except OSError:
@@ -196,20 +225,10 @@ class Exiv2MetadataProcessor(MetadataProcessor):
                 except OSError:
                     raise UnsupportedFormatError('Unknown file format.')
 
-            tmp.seek(0)
-
-            shutil.copyfileobj(tmp, result)
-            result.seek(0)
-
-        return result
+            return io.BytesIO(_image_data(metadata))
 
     def combine(self, essence, metadata_by_format):
-        result = io.BytesIO()
-        with tempfile.NamedTemporaryFile() as tmp:
-            tmp.write(essence.read())
-            tmp.flush()
-            exiv2_metadata = pyexiv2.ImageMetadata(tmp.name)
-
+        with _image_metadata(essence.read()) as exiv2_metadata:
             try:
                 exiv2_metadata.read()
             except OSError:
@@ -227,12 +246,7 @@ class Exiv2MetadataProcessor(MetadataProcessor):
 
             try:
                 exiv2_metadata.write()
-                tmp.flush()
-                tmp.seek(0)
             except OSError:
                 raise UnsupportedFormatError('Could not write metadata: %r' % metadata_by_format)
 
-            shutil.copyfileobj(tmp, result)
-            result.seek(0)
-
-        return result
+            return io.BytesIO(_image_data(exiv2_metadata))
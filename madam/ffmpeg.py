@@ -1,11 +1,18 @@
+import bisect
+import contextlib
+import hashlib
 import io
 import json
 import multiprocessing
 import os
 import shutil
+import signal
 import subprocess
 import tempfile
-from collections import namedtuple
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from math import ceil, cos, pi, radians, sin
 
 from bidict import bidict
@@ -13,18 +20,62 @@ from bidict import bidict
 from madam.core import Asset, MetadataProcessor, Processor, operator, OperatorError, UnsupportedFormatError
 from madam.future import CalledProcessError, subprocess_run
 from madam.mime import MimeType
+from madam.probe import probe
 
 
-def _probe(file):
-    with tempfile.NamedTemporaryFile(mode='wb') as temp_in:
-        shutil.copyfileobj(file, temp_in.file)
-        temp_in.flush()
-        file.seek(0)
+# Types of boxes that can be the first box of an ISO base media or QuickTime file
+_ISO_BMFF_TOP_LEVEL_BOX_TYPES = frozenset([
+    b'ftyp', b'styp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pnot', b'uuid', b'pdin', b'meta', b'moof',
+    b'sidx', b'junk',
+])
+
+
+def _requires_seekable_input(file):
+    """
+    Returns whether FFmpeg must be able to seek in the data of the specified
+    file in order to demux it, e.g. because the index is stored at the end.
+    """
+    header = file.read(12)
+    file.seek(0)
+    box_size = int.from_bytes(header[:4], 'big')
+    is_iso_bmff = header[4:8] in _ISO_BMFF_TOP_LEVEL_BOX_TYPES and (box_size in (0, 1) or box_size >= 8)
+    is_avi = header[:4] == b'RIFF' and header[8:12] == b'AVI '
+    return is_iso_bmff or is_avi
+
+
+def _requires_seekable_probe_input(file):
+    """
+    Returns whether ffprobe must be able to seek in the data of the specified
+    file in order to determine all properties. Ogg and MPEG transport streams
+    store no duration, so it is calculated from the end of the file.
+    """
+    header = file.read(189)
+    file.seek(0)
+    is_ogg = header[:4] == b'OggS'
+    is_mpegts = header[:1] == b'\x47' and header[188:189] in (b'', b'\x47')
+    return is_ogg or is_mpegts or _requires_seekable_input(file)
 
-        command = 'ffprobe -loglevel error -print_format json -show_format -show_streams'.split()
-        command.append(temp_in.name)
-        result = subprocess_run(command, stdout=subprocess.PIPE,
+
+def _run_ffprobe(file, arguments):
+    """
+    Runs ffprobe with the specified arguments on the data of the specified
+    file and returns the parsed JSON output.
+    """
+    command = ['ffprobe', '-loglevel', 'error', '-print_format', 'json'] + arguments
+    if _requires_seekable_probe_input(file):
+        with tempfile.NamedTemporaryFile(mode='wb') as temp_in:
+            shutil.copyfileobj(file, temp_in.file)
+            temp_in.flush()
+            file.seek(0)
+
+            command.append(temp_in.name)
+            result = subprocess_run(command, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, check=True)
+    else:
+        command.extend(['-i', 'pipe:0'])
+        result = subprocess_run(command, input=file.read(), stdout=subprocess.PIPE,
                                 stderr=subprocess.PIPE, check=True)
+        file.seek(0)
 
     string_result = result.stdout.decode('utf-8')
     json_obj = json.loads(string_result)
@@ -32,6 +83,22 @@ def _probe(file):
     return json_obj
 
 
+def _probe(file):
+    return _run_ffprobe(file, ['-show_format', '-show_streams'])
+
+
+def _probe_streams(file):
+    """
+    Returns format and stream information of the specified file. The
+    headers of common formats are parsed natively, other formats are
+    analyzed with ffprobe.
+    """
+    probe_data = probe(file)
+    if probe_data is None:
+        probe_data = _probe(file)
+    return probe_data
+
+
 def _combine_metadata(asset, *cloned_keys, **additional_metadata):
     metadata = {key: asset.metadata[key] for key in cloned_keys if key in asset.metadata}
     metadata.update(additional_metadata)
@@ -70,6 +137,15 @@ def _supported_modes():
         )
 
 
+_FrameIndex = namedtuple('_FrameIndex', 'frame_times, keyframe_times')
+
+
+def _format_webvtt_time(seconds):
+    milliseconds = round(seconds*1000)
+    return '%02d:%02d:%02d.%03d' % (milliseconds//3600000, milliseconds//60000 % 60,
+                                    milliseconds//1000 % 60, milliseconds % 1000)
+
+
 def _get_decoder_and_stream_type(probe_data):
     decoder_name = probe_data['format']['format_name']
 
@@ -86,25 +162,472 @@ def _get_decoder_and_stream_type(probe_data):
     return decoder_name, stream_type
 
 
+FFmpegProgress = namedtuple('FFmpegProgress', 'seconds, frame, fps, speed, finished')
+FFmpegProgress.__doc__ = """
+Represents the progress of an FFmpeg process.
+
+Values that were not reported by FFmpeg are `None`.
+"""
+FFmpegProgress.seconds.__doc__ = 'Time of the processed output in seconds'
+FFmpegProgress.frame.__doc__ = 'Number of processed video frames'
+FFmpegProgress.fps.__doc__ = 'Number of processed video frames per second'
+FFmpegProgress.speed.__doc__ = 'Processing speed relative to the playback speed'
+FFmpegProgress.finished.__doc__ = 'Whether processing has finished'
+
+
+def _parse_number(value, number_type=float):
+    try:
+        return number_type(value.rstrip('x'))
+    except ValueError:
+        return None
+
+
+def _report_progress(progress_fd, progress_callback):
+    """
+    Reads the key-value pairs written by FFmpeg's `-progress` option from the
+    specified file descriptor and reports each block of values.
+    """
+    values = {}
+    with open(progress_fd, 'r', encoding='utf-8', errors='replace') as progress_file:
+        for line in progress_file:
+            key, _, value = line.strip().partition('=')
+            if key != 'progress':
+                values[key] = value
+                continue
+            values, block_values = {}, values
+            if progress_callback is None:
+                continue
+            microseconds = _parse_number(block_values.get('out_time_us', block_values.get('out_time_ms', '')), int)
+            progress = FFmpegProgress(
+                seconds=None if microseconds is None else microseconds/1000000,
+                frame=_parse_number(block_values.get('frame', ''), int),
+                fps=_parse_number(block_values.get('fps', '')),
+                speed=_parse_number(block_values.get('speed', '')),
+                finished=(value == 'end'),
+            )
+            try:
+                progress_callback(progress)
+            except Exception:
+                # Keep reading, otherwise FFmpeg blocks when the pipe is full
+                progress_callback = None
+
+
+def _kill(process):
+    """
+    Kills the process group of the specified process and waits until the
+    process has exited.
+    """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+def _feed_input(stream, data):
+    try:
+        stream.write(data)
+        stream.close()
+    except BrokenPipeError:
+        pass
+
+
+def _collect_output(stream, chunks):
+    chunks.append(stream.read())
+    stream.close()
+
+
+def _write_concat_list(path, file_paths):
+    """
+    Writes a list of the specified files for the FFmpeg concat demuxer.
+    """
+    with open(path, 'w') as concat_list:
+        for file_path in file_paths:
+            concat_list.write("file '%s'\n" % file_path.replace("'", "'\\''"))
+
+
+def _remaining_time(expiration_time):
+    """
+    Returns the number of seconds until the specified monotonic time, or
+    `None` if no time is specified.
+    """
+    if expiration_time is None:
+        return None
+    return max(0.0, expiration_time - time.monotonic())
+
+
+class _AnyEvent:
+    """
+    Represents an event that is set as soon as one of several events is set.
+    """
+    def __init__(self, *events):
+        self.__events = [event for event in events if event is not None]
+
+    def is_set(self):
+        return any(event.is_set() for event in self.__events)
+
+
+class JobScheduler:
+    """
+    Represents a scheduler that distributes a budget of CPU threads among
+    concurrent FFmpeg jobs.
+
+    Each job is allotted a share of the budget that depends on the number of
+    running and waiting jobs. A single job is allotted at most half of the
+    budget by default, so jobs that are submitted later can start while long
+    jobs are running. Jobs are started in the order they were submitted as
+    soon as a thread is free.
+    """
+    def __init__(self, cpu_budget=None, max_job_threads=None):
+        """
+        Initializes a new `JobScheduler`.
+
+        :param cpu_budget: Number of threads that can be allotted to jobs.
+            Defaults to the number of CPUs.
+        :type cpu_budget: int or None
+        :param max_job_threads: Maximum number of threads that can be
+            allotted to a single job. Defaults to half of the budget.
+        :type max_job_threads: int or None
+        """
+        if max_job_threads is not None and max_job_threads < 1:
+            raise ValueError('Invalid maximum number of threads per job: %r' % max_job_threads)
+        self._condition = threading.Condition()
+        self._waiting_jobs = deque()
+        self._allotted_threads = 0
+        self._running_job_count = 0
+        self._max_job_threads = max_job_threads
+        self.cpu_budget = cpu_budget or multiprocessing.cpu_count()
+
+    @property
+    def cpu_budget(self):
+        """
+        Number of threads that can be allotted to jobs.
+
+        Changing the budget does not affect running jobs.
+        """
+        return self._cpu_budget
+
+    @cpu_budget.setter
+    def cpu_budget(self, cpu_budget):
+        if cpu_budget < 1:
+            raise ValueError('Invalid CPU budget: %r' % cpu_budget)
+        with self._condition:
+            self._cpu_budget = cpu_budget
+            self._condition.notify_all()
+
+    @property
+    def max_job_threads(self):
+        """
+        Maximum number of threads that can be allotted to a single job.
+        """
+        with self._condition:
+            if self._max_job_threads is None:
+                return max(1, self._cpu_budget//2)
+            return min(self._max_job_threads, self._cpu_budget)
+
+    @property
+    def queue_depth(self):
+        """
+        Number of jobs that wait for threads to be allotted.
+        """
+        with self._condition:
+            return len(self._waiting_jobs)
+
+    @property
+    def running_job_count(self):
+        """
+        Number of jobs that are running.
+        """
+        with self._condition:
+            return self._running_job_count
+
+    @property
+    def utilization(self):
+        """
+        Fraction of the CPU budget that is allotted to running jobs.
+        """
+        with self._condition:
+            return self._allotted_threads/self._cpu_budget
+
+    @contextlib.contextmanager
+    def job(self, max_threads=None):
+        """
+        Waits until threads can be allotted to a new job and releases them
+        when the context is left.
+
+        :param max_threads: Maximum number of threads the job can use
+        :type max_threads: int or None
+        :return: Context manager yielding the number of allotted threads
+        """
+        with self.jobs(1, max_threads=max_threads) as threads:
+            yield threads[0]
+
+    @contextlib.contextmanager
+    def jobs(self, count, max_threads=None):
+        """
+        Waits until threads can be allotted to a number of new jobs that run
+        concurrently and releases them when the context is left.
+
+        Threads are allotted to all jobs at once, so none of the jobs has to
+        wait for the others to finish. Each job is allotted at least one
+        thread, even if there are more jobs than threads in the budget, and at
+        most :attr:`max_job_threads` threads.
+
+        :param count: Number of jobs
+        :type count: int
+        :param max_threads: Maximum number of threads each job can use
+        :type max_threads: int or None
+        :return: Context manager yielding a list with the number of threads allotted to each job
+        """
+        if count < 1:
+            raise ValueError('Invalid job count: %r' % count)
+        ticket = object()
+        with self._condition:
+            self._waiting_jobs.append(ticket)
+            try:
+                while self._waiting_jobs[0] is not ticket or \
+                        self._cpu_budget - self._allotted_threads < min(count, self._cpu_budget):
+                    self._condition.wait()
+            except BaseException:
+                self._waiting_jobs.remove(ticket)
+                self._condition.notify_all()
+                raise
+            self._waiting_jobs.popleft()
+            free_threads = self._cpu_budget - self._allotted_threads
+            fair_share = max(1, self._cpu_budget//(self._running_job_count + len(self._waiting_jobs) + count))
+            job_threads = max(1, min(free_threads//count, fair_share, self.max_job_threads,
+                                     max_threads or free_threads))
+            threads = [job_threads]*count
+            self._allotted_threads += sum(threads)
+            self._running_job_count += count
+            self._condition.notify_all()
+        try:
+            yield threads
+        finally:
+            with self._condition:
+                self._allotted_threads -= sum(threads)
+                self._running_job_count -= count
+                self._condition.notify_all()
+
+
+#: Process-wide scheduler for all FFmpeg invocations
+scheduler = JobScheduler()
+
+
 class _FFmpegContext(tempfile.TemporaryDirectory):
-    def __init__(self, source, result):
+    """
+    Provides the input and output locations for an FFmpeg invocation.
+
+    Data is streamed through the standard input and output of the process
+    whenever the formats allow it. Temporary files are only used for input
+    that must be seekable and for output formats whose headers are rewritten
+    after the data was written.
+    """
+    # Muxers that need to seek in their output to write a valid file
+    _seekable_output_formats = frozenset({'avi', 'matroska', 'mov', 'mp3', 'mp4', 'wav'})
+
+    # Formats that read or write files on disk and their streaming equivalents
+    _pipe_formats = {'image2': 'image2pipe'}
+
+    # Seconds between checks whether a process timed out or was cancelled
+    _poll_interval = 0.1
+
+    def __init__(self, source, result, input_format=None, output_format=None, seek_input=False,
+                 output_directory=False):
+        """
+        Initializes a new `_FFmpegContext`.
+
+        :param source: File-like object with the input data
+        :param result: File-like object that will receive the output data, or
+            `None` if the output is written to a directory
+        :param input_format: Name of the FFmpeg demuxer for the input, if specified in the command
+        :param output_format: Name of the FFmpeg muxer for the output
+        :param seek_input: Whether FFmpeg has to seek in the input, e.g. for input seeking with `-ss`
+        :param output_directory: Whether FFmpeg writes multiple files to a
+            directory whose path is used as output path
+        """
         super().__init__(prefix='madam')
         self.__source = source
         self.__result = result
+        self.__output_directory = output_directory
+        self.__stream_input = not seek_input and not _requires_seekable_input(source)
+        self.__stream_output = not output_directory and \
+            output_format not in _FFmpegContext._seekable_output_formats
+        self.input_format = input_format
+        self.output_format = output_format
+        if self.__stream_input:
+            self.input_format = _FFmpegContext._pipe_formats.get(input_format, input_format)
+        if self.__stream_output:
+            self.output_format = _FFmpegContext._pipe_formats.get(output_format, output_format)
 
     def __enter__(self):
         tmpdir_path = super().__enter__()
-        self.input_path = os.path.join(tmpdir_path, 'input_file')
-        self.output_path = os.path.join(tmpdir_path, 'output_file')
 
-        with open(self.input_path, 'wb') as temp_in:
-            shutil.copyfileobj(self.__source, temp_in)
-            self.__source.seek(0)
+        if self.__stream_input:
+            self.input_path = 'pipe:0'
+        else:
+            self.input_path = os.path.join(tmpdir_path, 'input_file')
+            with open(self.input_path, 'wb') as temp_in:
+                shutil.copyfileobj(self.__source, temp_in)
+                self.__source.seek(0)
+
+        if self.__stream_output:
+            self.output_path = 'pipe:1'
+        elif self.__output_directory:
+            self.output_path = os.path.join(tmpdir_path, 'output')
+            os.mkdir(self.output_path)
+        else:
+            self.output_path = os.path.join(tmpdir_path, 'output_file')
 
         return self
 
+    def run(self, command, progress_callback=None, timeout=None, cancel_event=None, threads=None):
+        """
+        Runs the specified FFmpeg command and passes the data of the source
+        and the result through the standard streams if required.
+
+        Unless the number of threads is specified, the command is run as a
+        job of the process-wide scheduler. The number of decoding threads of
+        each input and the number of encoding threads of the output are
+        limited to the threads allotted to the job, so the command must not
+        specify `-threads`.
+
+        If the process exceeds the timeout or is cancelled, it is killed and
+        an :class:`~madam.core.OperatorError` is raised.
+
+        :param command: FFmpeg command using the input and output paths of this context,
+            with the output path or another file in the temporary directory as last argument
+        :type command: list
+        :param progress_callback: Function that is called with an
+            :class:`~madam.ffmpeg.FFmpegProgress` object whenever FFmpeg
+            reports progress. It is called from a separate thread.
+        :type progress_callback: callable or None
+        :param timeout: Maximum number of seconds the process may run
+        :type timeout: float or None
+        :param cancel_event: Event that cancels the process when it is set
+        :type cancel_event: threading.Event or None
+        :param threads: Number of threads that were allotted to the command by
+            :func:`~madam.ffmpeg.JobScheduler.jobs`
+        :type threads: int or None
+        :raise CalledProcessError: if FFmpeg fails
+        :raise OperatorError: if the process timed out or was cancelled
+        """
+        input_data = None
+        if self.__stream_input and self.input_path in command:
+            input_data = self.__source.read()
+            self.__source.seek(0)
+        stream_output = self.__stream_output and command[-1] == self.output_path
+        with contextlib.ExitStack() as stack:
+            if threads is None:
+                threads = stack.enter_context(scheduler.job())
+            output_data, termination_reason = self.__run_process(_FFmpegContext.__with_threads(command, threads),
+                                                                 input_data, stream_output, progress_callback,
+                                                                 timeout, cancel_event)
+        if termination_reason:
+            raise OperatorError('FFmpeg process %s' % termination_reason)
+        if stream_output:
+            self.__result.write(output_data)
+            self.__result.seek(0)
+
+    @staticmethod
+    def __with_threads(command, threads):
+        """
+        Returns the command with a thread option in front of each input and
+        in front of the output.
+
+        :param command: FFmpeg command with a single output as last argument
+        :type command: list
+        :param threads: Number of threads
+        :type threads: int
+        :return: Command with thread options
+        :rtype: list
+        """
+        thread_option = ['-threads', str(threads)]
+        # Inputs are specified by "-i" options, which are never option values in FFmpeg commands
+        option_indexes = [index for index, argument in enumerate(command[:-1]) if argument == '-i']
+        option_indexes.append(len(command) - 1)
+        command_with_threads = command[:option_indexes[0]]
+        for index, next_index in zip(option_indexes, option_indexes[1:] + [len(command)]):
+            command_with_threads.extend(thread_option)
+            command_with_threads.extend(command[index:next_index])
+        return command_with_threads
+
+    def __run_process(self, command, input_data, stream_output, progress_callback, timeout, cancel_event):
+        """
+        Runs the specified command while exchanging data with the process in
+        separate threads, and kills the process when it times out or is
+        cancelled.
+
+        :return: Tuple of the data written to the standard output and the
+            reason why the process was killed, or `None`
+        """
+        progress_fds = None
+        pass_fds = ()
+        if progress_callback is not None:
+            progress_fds = os.pipe()
+            pass_fds = (progress_fds[1],)
+            command = command[:1] + ['-nostats', '-progress', 'pipe:%d' % progress_fds[1]] + command[1:]
+
+        try:
+            process = subprocess.Popen(command,
+                                       stdin=subprocess.PIPE if input_data is not None else subprocess.DEVNULL,
+                                       stdout=subprocess.PIPE if stream_output else subprocess.DEVNULL,
+                                       stderr=subprocess.PIPE, pass_fds=pass_fds, start_new_session=True)
+        except BaseException:
+            if progress_fds:
+                os.close(progress_fds[0])
+                os.close(progress_fds[1])
+            raise
+        if progress_fds:
+            os.close(progress_fds[1])
+
+        output_chunks = []
+        error_chunks = []
+        workers = [
+            threading.Thread(target=_collect_output, args=(process.stderr, error_chunks), daemon=True),
+        ]
+        if input_data is not None:
+            workers.append(threading.Thread(target=_feed_input, args=(process.stdin, input_data), daemon=True))
+        if stream_output:
+            workers.append(threading.Thread(target=_collect_output, args=(process.stdout, output_chunks),
+                                            daemon=True))
+        if progress_fds:
+            workers.append(threading.Thread(target=_report_progress, args=(progress_fds[0], progress_callback),
+                                            daemon=True))
+        for worker in workers:
+            worker.start()
+
+        termination_reason = None
+        expiration_time = None if timeout is None else time.monotonic() + timeout
+        poll_interval = None if timeout is None and cancel_event is None else _FFmpegContext._poll_interval
+        try:
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    termination_reason = 'was cancelled'
+                elif expiration_time is not None and time.monotonic() >= expiration_time:
+                    termination_reason = 'timed out after %g seconds' % timeout
+                if termination_reason:
+                    _kill(process)
+                    break
+                try:
+                    process.wait(timeout=poll_interval)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+        except BaseException:
+            _kill(process)
+            raise
+
+        for worker in workers:
+            worker.join()
+
+        if termination_reason is None and process.returncode:
+            raise CalledProcessError(process.returncode, command, output=b''.join(output_chunks),
+                                     stderr=b''.join(error_chunks))
+        return b''.join(output_chunks), termination_reason
+
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if os.path.exists(self.output_path):
+        if exc_type is None and not self.__stream_output and os.path.isfile(self.output_path):
             with open(self.output_path, 'rb') as temp_out:
                 shutil.copyfileobj(temp_out, self.__result)
                 self.__result.seek(0)
@@ -200,10 +723,108 @@ class FFmpegProcessor(Processor):
         ],
     }
 
+    # Codecs of the streams that can be copied into a container without re-encoding
+    __container_codecs = {
+        MimeType('video/x-matroska'): {
+            'video': {'av1', 'h264', 'hevc', 'mjpeg', 'mpeg2video', 'mpeg4', 'prores', 'theora', 'vp8', 'vp9'},
+            'audio': {'aac', 'ac3', 'alac', 'flac', 'mp2', 'mp3', 'opus', 'pcm_s16le', 'vorbis'},
+            'subtitle': {'ass', 'dvb_subtitle', 'hdmv_pgs_subtitle', 'ssa', 'subrip', 'webvtt'},
+        },
+        MimeType('video/quicktime'): {
+            'video': {'av1', 'h264', 'hevc', 'mjpeg', 'mpeg4', 'prores', 'vp9'},
+            'audio': {'aac', 'ac3', 'alac', 'mp3', 'pcm_s16le'},
+            'subtitle': {'mov_text'},
+        },
+        MimeType('video/x-msvideo'): {
+            'video': {'h264', 'mjpeg', 'mpeg2video', 'mpeg4'},
+            'audio': {'ac3', 'mp3', 'pcm_s16le'},
+            'subtitle': set(),
+        },
+        MimeType('video/mp2t'): {
+            'video': {'h264', 'hevc', 'mpeg1video', 'mpeg2video'},
+            'audio': {'aac', 'ac3', 'mp2', 'mp3', 'opus'},
+            'subtitle': {'dvb_subtitle'},
+        },
+        MimeType('video/ogg'): {
+            'video': {'theora'},
+            'audio': {'flac', 'opus', 'vorbis'},
+            'subtitle': set(),
+        },
+        MimeType('audio/mpeg'): {
+            'video': set(),
+            'audio': {'mp3'},
+            'subtitle': set(),
+        },
+        MimeType('audio/ogg'): {
+            'video': set(),
+            'audio': {'flac', 'opus', 'vorbis'},
+            'subtitle': set(),
+        },
+        MimeType('audio/wav'): {
+            'video': set(),
+            'audio': {'pcm_s16le', 'pcm_s24le', 'pcm_s32le', 'pcm_u8'},
+            'subtitle': set(),
+        },
+    }
+
     __ffmpeg_mode_to_bit_depth = {
         mode.name: mode.bits_per_pixel for mode in _supported_modes() if mode.bits_per_pixel > 0
     }
 
+    # Number of assets whose frame times are cached
+    __frame_index_cache_size = 64
+
+    # Number of times a video segment is encoded before a conversion fails
+    __segment_attempts = 3
+
+    # Encoders for video codecs that are re-encoded with the same codec
+    __codec_to_encoder = {
+        'h264': 'libx264',
+        'hevc': 'libx265',
+        'mpeg2video': 'mpeg2video',
+        'mpeg4': 'mpeg4',
+        'theora': 'libtheora',
+        'vp8': 'libvpx',
+        'vp9': 'libvpx-vp9',
+    }
+
+    # Containers that store the rotation of video streams as display matrix
+    __rotation_metadata_formats = frozenset({MimeType('video/quicktime')})
+
+    # Video codecs whose parameter sets are repeated in the stream when muxed to MPEG-TS, so
+    # partial GOPs that are re-encoded when trimming do not depend on the extradata of the source
+    __transport_stream_codecs = frozenset({'h264', 'hevc', 'mpeg2video'})
+
+    # Bitstream filters that move the parameter sets of copied streams into the stream
+    __annex_b_filters = {
+        'h264': 'h264_mp4toannexb',
+        'hevc': 'hevc_mp4toannexb',
+    }
+
+    # Encoder profiles for the profiles reported by ffprobe
+    __encoder_profiles = {
+        'libx264': {
+            'Baseline': 'baseline',
+            'Constrained Baseline': 'baseline',
+            'Main': 'main',
+            'High': 'high',
+            'High 10': 'high10',
+            'High 4:2:2': 'high422',
+            'High 4:4:4 Predictive': 'high444',
+        },
+        'libx265': {
+            'Main': 'main',
+            'Main 10': 'main10',
+            'Main Still Picture': 'mainstillpicture',
+        },
+        'mpeg2video': {
+            '4:2:2': '0',
+            'High': '1',
+            'Main': '4',
+            'Simple': '5',
+        },
+    }
+
     def __init__(self):
         """
         Initializes a new `FFmpegProcessor`.
@@ -221,18 +842,85 @@ class FFmpegProcessor(Processor):
             raise EnvironmentError('Found ffprobe version %s. Requiring at least version %s.'
                                    % (version_string, self._min_version))
 
-        self.__threads = multiprocessing.cpu_count()
+        self.__frame_indexes = OrderedDict()
+        self.__frame_index_lock = threading.Lock()
+
+    def __frame_index(self, asset):
+        """
+        Returns the presentation times of all frames and of the keyframes in
+        the first video stream of the specified asset.
+
+        The times are determined from the stored packets without decoding
+        the video. The results for the most recently used essences are cached
+        by the digest of the essence data.
+
+        :param asset: Video asset
+        :type asset: Asset
+        :return: Frame index with sorted times in seconds from the start
+        :rtype: _FrameIndex
+        :raise UnsupportedFormatError: if the frame times cannot be determined
+        """
+        asset_key = hashlib.sha256(asset.essence.read()).digest()
+        with self.__frame_index_lock:
+            if asset_key in self.__frame_indexes:
+                self.__frame_indexes.move_to_end(asset_key)
+                return self.__frame_indexes[asset_key]
+
+        try:
+            probe_data = _run_ffprobe(asset.essence, ['-select_streams', 'v:0',
+                                                      '-show_entries', 'packet=pts_time,dts_time,flags:'
+                                                                       'format=start_time'])
+        except CalledProcessError:
+            raise UnsupportedFormatError('Unsupported file format.')
+
+        start_time = float(probe_data.get('format', {}).get('start_time', 0))
+        frame_times = set()
+        keyframe_times = set()
+        for packet in probe_data.get('packets', []):
+            packet_time = packet.get('pts_time', packet.get('dts_time', 'N/A'))
+            if packet_time == 'N/A':
+                continue
+            packet_time = max(0.0, float(packet_time) - start_time)
+            frame_times.add(packet_time)
+            if 'K' in packet.get('flags', ''):
+                keyframe_times.add(packet_time)
+        frame_index = _FrameIndex(frame_times=tuple(sorted(frame_times)),
+                                  keyframe_times=tuple(sorted(keyframe_times)))
+
+        with self.__frame_index_lock:
+            self.__frame_indexes[asset_key] = frame_index
+            while len(self.__frame_indexes) > FFmpegProcessor.__frame_index_cache_size:
+                self.__frame_indexes.popitem(last=False)
+
+        return frame_index
+
+    def keyframes(self, asset):
+        """
+        Returns the times of the keyframes in the first video stream of the
+        specified asset.
+
+        The keyframes are determined from the flags of the stored packets
+        without decoding the video. The results for the most recently used
+        essences are cached.
+
+        :param asset: Video asset
+        :type asset: Asset
+        :return: Sorted times of the keyframes in seconds from the start
+        :rtype: tuple
+        :raise UnsupportedFormatError: if the keyframes cannot be determined
+        """
+        return self.__frame_index(asset).keyframe_times
 
     def can_read(self, file):
         try:
-            probe_data = _probe(file)
+            probe_data = _probe_streams(file)
             return bool(probe_data)
         except CalledProcessError:
             return False
 
     def read(self, file):
         try:
-            probe_data = _probe(file)
+            probe_data = _probe_streams(file)
         except CalledProcessError:
             raise UnsupportedFormatError('Unsupported file format.')
 
@@ -271,7 +959,7 @@ class FFmpegProcessor(Processor):
         return Asset(essence=file, **metadata)
 
     @operator
-    def resize(self, asset, width, height):
+    def resize(self, asset, width, height, progress_callback=None, timeout=None, cancel_event=None):
         """
         Creates a new image or video asset of the specified width and height
         from the essence of the specified image or video asset.
@@ -284,6 +972,14 @@ class FFmpegProcessor(Processor):
         :type width: int
         :param height: Height of the resized asset
         :type height: int
+        :param progress_callback: Function that is called with an
+            :class:`~madam.ffmpeg.FFmpegProgress` object whenever FFmpeg
+            reports progress
+        :type progress_callback: callable or None
+        :param timeout: Maximum number of seconds FFmpeg may run
+        :type timeout: float or None
+        :param cancel_event: Event that cancels the operation when it is set
+        :type cancel_event: threading.Event or None
         :return: New asset with specified width and height
         :rtype: Asset
         """
@@ -298,19 +994,15 @@ class FFmpegProcessor(Processor):
             raise OperatorError('Cannot resize asset of type %s')
 
         result = io.BytesIO()
-        with _FFmpegContext(asset.essence, result) as ctx:
-            with open(ctx.input_path, 'wb') as temp_in:
-                shutil.copyfileobj(asset.essence, temp_in)
-                temp_in.flush()
-
+        with _FFmpegContext(asset.essence, result, input_format=encoder_name, output_format=encoder_name) as ctx:
             command = ['ffmpeg', '-loglevel', 'error',
-                       '-f', encoder_name, '-i', ctx.input_path,
+                       '-f', ctx.input_format, '-i', ctx.input_path,
                        '-filter:v', 'scale=%d:%d' % (width, height),
-                       '-threads', str(self.__threads),
-                       '-f', encoder_name, '-y', ctx.output_path]
+                       '-f', ctx.output_format, '-y', ctx.output_path]
 
             try:
-                subprocess_run(command, stderr=subprocess.PIPE, check=True)
+                ctx.run(command, progress_callback=progress_callback, timeout=timeout,
+                        cancel_event=cancel_event)
             except CalledProcessError as ffmpeg_error:
                 error_message = ffmpeg_error.stderr.decode('utf-8')
                 raise OperatorError('Could not resize asset: %s' % error_message)
@@ -321,8 +1013,53 @@ class FFmpegProcessor(Processor):
 
         return Asset(essence=result, **metadata)
 
+    def plan_conversion(self, asset, mime_type, video=None, audio=None, subtitle=None):
+        """
+        Determines how each stream of the specified asset is processed when
+        it is converted to the specified MIME type.
+
+        A stream is copied without re-encoding if no codec or bitrate is
+        specified for it and the target container supports its codec.
+        Otherwise it is transcoded, or dropped if its codec is set to `None`.
+
+        :param asset: Asset that will be converted
+        :type asset: Asset
+        :param mime_type: MIME type of the target container
+        :type mime_type: MimeType or str
+        :param video: Dictionary with options for video streams.
+        :type video: dict or None
+        :param audio: Dictionary with options for audio streams.
+        :type audio: dict or None
+        :param subtitle: Dictionary with the options for subtitle streams.
+        :type subtitle: dict or None
+        :return: Processing of each stream type of the asset as `'copy'`,
+            `'transcode'`, or `'drop'`
+        :rtype: dict
+        :raise UnsupportedFormatError: if the MIME type is not supported
+        """
+        mime_type = MimeType(mime_type)
+        if mime_type not in self.__mime_type_to_encoder:
+            raise UnsupportedFormatError('Unsupported asset type: %s' % mime_type)
+        container_codecs = FFmpegProcessor.__container_codecs.get(mime_type, {})
+
+        plan = {}
+        for stream_type, options in (('video', video), ('audio', audio), ('subtitle', subtitle)):
+            if stream_type not in asset.metadata:
+                continue
+            options = options or {}
+            if 'codec' in options and not options['codec']:
+                plan[stream_type] = 'drop'
+            elif options.get('codec') or options.get('bitrate'):
+                plan[stream_type] = 'transcode'
+            elif asset.metadata[stream_type].get('codec') in container_codecs.get(stream_type, ()):
+                plan[stream_type] = 'copy'
+            else:
+                plan[stream_type] = 'transcode'
+        return plan
+
     @operator
-    def convert(self, asset, mime_type, video=None, audio=None, subtitle=None):
+    def convert(self, asset, mime_type, video=None, audio=None, subtitle=None, segments=1,
+                progress_callback=None, timeout=None, cancel_event=None):
         """
         Creates a new asset of the specified MIME type from the essence of the
         specified asset.
@@ -345,6 +1082,24 @@ class FFmpegProcessor(Processor):
 
         - **codec** – Processor-specific name of the subtitle format as string
 
+        Streams without options whose codec is supported by the target
+        container are copied without re-encoding. Use :meth:`plan_conversion`
+        to determine which streams are copied.
+
+        If more than one segment is requested and a video codec is specified,
+        the video stream is split at keyframes into segments that are encoded
+        in parallel and joined without re-encoding. A segment that fails is
+        encoded again on its own. The first audio stream and, if a subtitle
+        codec is specified, the first subtitle stream are converted when the
+        segments are joined. The conversion falls back to a single encoding
+        process if the video does not have enough keyframes.
+
+        The metadata of the converted asset contains the entry
+        ``conversion_plan`` that describes how the conversion was done. It maps
+        each stream type of the source asset to `'copy'`, `'transcode'`, or
+        `'drop'`, like :meth:`plan_conversion`, and the key `'segments'` to the
+        number of video segments that were encoded.
+
         :param asset: Asset whose contents will be converted
         :type asset: Asset
         :param mime_type: MIME type of the video container
@@ -355,6 +1110,16 @@ class FFmpegProcessor(Processor):
         :type audio: dict or None
         :param subtitle: Dictionary with the options for subtitle streams.
         :type subtitle: dict or None
+        :param segments: Maximum number of video segments that are encoded in parallel
+        :type segments: int
+        :param progress_callback: Function that is called with an
+            :class:`~madam.ffmpeg.FFmpegProgress` object whenever FFmpeg
+            reports progress
+        :type progress_callback: callable or None
+        :param timeout: Maximum number of seconds FFmpeg may run
+        :type timeout: float or None
+        :param cancel_event: Event that cancels the operation when it is set
+        :type cancel_event: threading.Event or None
         :return: New asset with converted essence
         :rtype: Asset
         """
@@ -363,69 +1128,241 @@ class FFmpegProcessor(Processor):
         if not encoder_name:
             raise UnsupportedFormatError('Unsupported asset type: %s' % mime_type)
 
-        result = io.BytesIO()
-        with _FFmpegContext(asset.essence, result) as ctx:
-            command = ['ffmpeg', '-loglevel', 'error',
-                       '-i', ctx.input_path]
-            if video:
-                if 'codec' in video:
-                    if video['codec']:
-                        command.extend(['-c:v', video['codec']])
-                        codec_options = FFmpegProcessor.__codec_options.get('video', {})
-                        command.extend(codec_options.get(video['codec'], []))
-                    else:
-                        command.extend(['-vn'])
-                if video.get('bitrate'):
-                    # Set minimum at 50% of bitrate and maximum at 145% of bitrate
-                    # (see https://developers.google.com/media/vp9/settings/vod/)
-                    command.extend(['-minrate', '%dk' % round(0.5*video['bitrate']),
-                                    '-b:v', '%dk' % video['bitrate'],
-                                    '-maxrate', '%dk' % round(1.45*video['bitrate'])])
-            if audio:
-                if 'codec' in audio:
-                    if audio['codec']:
-                        command.extend(['-c:a', audio['codec']])
-                        codec_options = FFmpegProcessor.__codec_options.get('audio', {})
-                        command.extend(codec_options.get(audio['codec'], []))
-                    else:
-                        command.extend(['-an'])
-                if audio.get('bitrate'):
-                    command.extend(['-b:a', '%dk' % audio['bitrate']])
-            if subtitle:
-                if 'codec' in subtitle:
-                    if subtitle['codec']:
-                        command.extend(['-c:s', subtitle['codec']])
-                        codec_options = FFmpegProcessor.__codec_options.get('subtitles', {})
-                        command.extend(codec_options.get(subtitle['codec'], []))
-                    else:
-                        command.extend(['-sn'])
-
-            container_options = FFmpegProcessor.__container_options.get(mime_type, [])
-            command.extend(container_options)
-
-            command.extend(['-threads', str(self.__threads),
-                            '-f', encoder_name, '-y', ctx.output_path])
+        segment_ranges = []
+        if segments > 1 and video and video.get('codec') and mime_type.type == 'video' and \
+                MimeType(asset.mime_type).type == 'video':
+            try:
+                segment_ranges = self.__segment_ranges(asset, segments)
+            except UnsupportedFormatError:
+                pass
+        segmented = len(segment_ranges) > 1
+        plan = self.plan_conversion(asset, mime_type, video=video, audio=audio, subtitle=subtitle)
+        conversion_plan = dict(plan, segments=len(segment_ranges) if segmented else 1)
+        if segmented and 'subtitle' in plan and not (subtitle and subtitle.get('codec')):
+            # Only subtitles with a codec are mapped when the segments are joined
+            conversion_plan['subtitle'] = 'drop'
+        expiration_time = None if timeout is None else time.monotonic() + timeout
 
+        result = io.BytesIO()
+        with _FFmpegContext(asset.essence, result, output_format=encoder_name, seek_input=segmented) as ctx:
             try:
-                subprocess_run(command, stderr=subprocess.PIPE, check=True)
+                if segmented:
+                    segment_list_path = self.__encode_segments(ctx, segment_ranges, video, progress_callback,
+                                                               expiration_time, cancel_event)
+                    command = ['ffmpeg', '-loglevel', 'error',
+                               '-f', 'concat', '-safe', '0', '-i', segment_list_path,
+                               '-i', ctx.input_path,
+                               '-map', '0:v', '-map', '1:a:0?']
+                    if subtitle and subtitle.get('codec'):
+                        command.extend(['-map', '1:s:0?'])
+                    command.extend(['-c:v', 'copy'])
+                    progress_callback = None
+                else:
+                    command = ['ffmpeg', '-loglevel', 'error']
+                    if 'copy' in plan.values():
+                        # Copied streams from containers like AVI can lack presentation timestamps
+                        command.extend(['-fflags', '+genpts'])
+                    command.extend(['-i', ctx.input_path])
+                    if plan.get('video') == 'copy':
+                        command.extend(['-c:v', 'copy'])
+                    else:
+                        command.extend(self.__video_options(video))
+                if plan.get('audio') == 'copy':
+                    command.extend(['-c:a', 'copy'])
+                else:
+                    command.extend(self.__audio_options(audio))
+                if plan.get('subtitle') == 'copy':
+                    command.extend(['-c:s', 'copy'])
+                else:
+                    command.extend(self.__subtitle_options(subtitle))
+
+                container_options = FFmpegProcessor.__container_options.get(mime_type, [])
+                command.extend(container_options)
+
+                command.extend(['-f', ctx.output_format, '-y', ctx.output_path])
+
+                ctx.run(command, progress_callback=progress_callback, timeout=_remaining_time(expiration_time),
+                        cancel_event=cancel_event)
             except CalledProcessError as ffmpeg_error:
                 error_message = ffmpeg_error.stderr.decode('utf-8')
                 raise OperatorError('Could not convert asset: %s' % error_message)
 
-        return self.read(result)
+        converted_asset = self.read(result)
+        metadata = dict(converted_asset.metadata, conversion_plan=conversion_plan)
+        return Asset(essence=converted_asset.essence, **metadata)
+
+    def __video_options(self, video):
+        options = []
+        if video:
+            if 'codec' in video:
+                if video['codec']:
+                    options.extend(['-c:v', video['codec']])
+                    codec_options = FFmpegProcessor.__codec_options.get('video', {})
+                    options.extend(codec_options.get(video['codec'], []))
+                else:
+                    options.extend(['-vn'])
+            if video.get('bitrate'):
+                # Set minimum at 50% of bitrate and maximum at 145% of bitrate
+                # (see https://developers.google.com/media/vp9/settings/vod/)
+                options.extend(['-minrate', '%dk' % round(0.5*video['bitrate']),
+                                '-b:v', '%dk' % video['bitrate'],
+                                '-maxrate', '%dk' % round(1.45*video['bitrate'])])
+        return options
+
+    def __audio_options(self, audio):
+        options = []
+        if audio:
+            if 'codec' in audio:
+                if audio['codec']:
+                    options.extend(['-c:a', audio['codec']])
+                    codec_options = FFmpegProcessor.__codec_options.get('audio', {})
+                    options.extend(codec_options.get(audio['codec'], []))
+                else:
+                    options.extend(['-an'])
+            if audio.get('bitrate'):
+                options.extend(['-b:a', '%dk' % audio['bitrate']])
+        return options
+
+    def __subtitle_options(self, subtitle):
+        options = []
+        if subtitle:
+            if 'codec' in subtitle:
+                if subtitle['codec']:
+                    options.extend(['-c:s', subtitle['codec']])
+                    codec_options = FFmpegProcessor.__codec_options.get('subtitles', {})
+                    options.extend(codec_options.get(subtitle['codec'], []))
+                else:
+                    options.extend(['-sn'])
+        return options
+
+    def __segment_ranges(self, asset, segment_count):
+        """
+        Splits the first video stream of the specified asset at the keyframes
+        that are closest to equally spaced times.
+
+        :param asset: Video asset
+        :type asset: Asset
+        :param segment_count: Maximum number of segments
+        :type segment_count: int
+        :return: Start time in seconds and number of frames of each segment,
+            where the number of frames of the last segment is `None`
+        :rtype: list
+        """
+        frame_times, keyframe_times = self.__frame_index(asset)
+        if not frame_times or not keyframe_times:
+            return []
+        duration = float(asset.duration or frame_times[-1])
+
+        start_times = [0.0]
+        for segment_index in range(1, segment_count):
+            target_time = duration*segment_index/segment_count
+            keyframe_time = min(keyframe_times, key=lambda t: abs(t - target_time))
+            if keyframe_time > start_times[-1]:
+                start_times.append(keyframe_time)
+
+        start_frames = [bisect.bisect_left(frame_times, start_time) for start_time in start_times]
+        frame_counts = [end - start for start, end in zip(start_frames, start_frames[1:])] + [None]
+        return list(zip(start_times, frame_counts))
+
+    def __encode_segments(self, ctx, segment_ranges, video, progress_callback, expiration_time, cancel_event):
+        """
+        Encodes the segments of the first video stream in parallel and writes
+        a list of the encoded segments for the FFmpeg concat demuxer.
+
+        :return: Path of the segment list
+        :rtype: str
+        :raise CalledProcessError: if a segment could not be encoded
+        :raise OperatorError: if the encoding timed out or was cancelled
+        """
+        failure_event = threading.Event()
+        segment_cancel_event = _AnyEvent(cancel_event, failure_event)
+        segment_progress = {}
+        progress_lock = threading.Lock()
+
+        def encode_segment(segment_index, start_time, frame_count, threads):
+            segment_path = os.path.join(ctx.name, 'segment%04d.mkv' % segment_index)
+            # Seek slightly before the keyframe to keep it despite rounding errors
+            command = ['ffmpeg', '-loglevel', 'error',
+                       '-ss', '%.6f' % max(0.0, start_time - 0.0005), '-i', ctx.input_path,
+                       '-map', '0:v:0', '-an', '-sn']
+            if frame_count is not None:
+                command.extend(['-frames:v', str(frame_count)])
+            command.extend(self.__video_options(video))
+            command.extend(['-f', 'matroska', '-y', segment_path])
+
+            report_progress = None
+            if progress_callback is not None:
+                def report_progress(progress):
+                    with progress_lock:
+                        segment_progress[segment_index] = progress
+                        progress_callback(FFmpegProgress(
+                            seconds=sum(p.seconds or 0.0 for p in segment_progress.values()),
+                            frame=sum(p.frame or 0 for p in segment_progress.values()),
+                            fps=None, speed=None, finished=False))
+
+            for attempt in range(1, FFmpegProcessor.__segment_attempts + 1):
+                try:
+                    ctx.run(command, progress_callback=report_progress, timeout=_remaining_time(expiration_time),
+                            cancel_event=segment_cancel_event, threads=threads)
+                    return segment_path
+                except CalledProcessError:
+                    if attempt == FFmpegProcessor.__segment_attempts:
+                        failure_event.set()
+                        raise
+                except OperatorError:
+                    failure_event.set()
+                    raise
+
+        # Threads are allotted to all segments at once, so they are encoded concurrently
+        with scheduler.jobs(len(segment_ranges)) as segment_threads, \
+                ThreadPoolExecutor(max_workers=len(segment_ranges)) as executor:
+            futures = [executor.submit(encode_segment, segment_index, start_time, frame_count, threads)
+                       for segment_index, ((start_time, frame_count), threads)
+                       in enumerate(zip(segment_ranges, segment_threads))]
+
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            if cancel_event is not None and cancel_event.is_set():
+                raise OperatorError('FFmpeg process was cancelled')
+            raise next((error for error in errors if isinstance(error, CalledProcessError)), errors[0])
+
+        segment_list_path = os.path.join(ctx.name, 'segments.txt')
+        _write_concat_list(segment_list_path, [future.result() for future in futures])
+        return segment_list_path
 
     @operator
-    def trim(self, asset, from_seconds=0, to_seconds=0):
+    def trim(self, asset, from_seconds=0, to_seconds=0, smart_render=False,
+             progress_callback=None, timeout=None, cancel_event=None):
         """
         Creates a trimmed audio or video asset that only contains the data
         between from_seconds and to_seconds.
 
+        By default, the streams are copied without re-encoding, so video
+        cuts snap to keyframes. With smart rendering, only the partial groups
+        of pictures at the start and the end of the clip are re-encoded and
+        the video between them is copied, which results in frame-accurate
+        cuts. The re-encoded parts match the pixel format, profile, level,
+        frame rate, and sample aspect ratio of the source. Smart rendering is
+        supported for H.264, HEVC, and MPEG-2 video and falls back to copying
+        for other video codecs.
+
         :param asset: Audio or video asset, which will serve as the source
         :type asset: Asset
         :param from_seconds: Start time of the clip in seconds
         :type from_seconds: float
         :param to_seconds: End time of the clip in seconds
         :type to_seconds: float
+        :param smart_render: Whether partial groups of pictures are re-encoded
+            for frame-accurate cuts
+        :type smart_render: bool
+        :param progress_callback: Function that is called with an
+            :class:`~madam.ffmpeg.FFmpegProgress` object whenever FFmpeg
+            reports progress
+        :type progress_callback: callable or None
+        :param timeout: Maximum number of seconds FFmpeg may run
+        :type timeout: float or None
+        :param cancel_event: Event that cancels the operation when it is set
+        :type cancel_event: threading.Event or None
         :return: New asset with trimmed essence
         :rtype: Asset
         """
@@ -442,15 +1379,36 @@ class FFmpegProcessor(Processor):
         if duration <= 0:
             raise ValueError('Start time must be before end time')
 
-        result = io.BytesIO()
-        with _FFmpegContext(asset.essence, result) as ctx:
-            command = ['ffmpeg', '-v', 'error',
-                       '-ss', str(float(from_seconds)), '-t', str(duration),
-                       '-i', ctx.input_path, '-codec', 'copy',
-                       '-f', encoder_name, '-y', ctx.output_path]
+        trim_parts = []
+        if smart_render and mime_type.type == 'video':
+            try:
+                trim_parts = self.__trim_parts(asset, float(from_seconds), float(to_seconds))
+                if trim_parts:
+                    encoding_options = FFmpegProcessor.__trim_part_encoding_options(asset)
+            except UnsupportedFormatError:
+                trim_parts = []
+        expiration_time = None if timeout is None else time.monotonic() + timeout
 
+        result = io.BytesIO()
+        with _FFmpegContext(asset.essence, result, output_format=encoder_name, seek_input=True) as ctx:
             try:
-                subprocess_run(command, stderr=subprocess.PIPE, check=True)
+                if trim_parts:
+                    part_list_path = self.__render_trim_parts(ctx, asset, trim_parts, encoding_options,
+                                                              expiration_time, cancel_event)
+                    command = ['ffmpeg', '-v', 'error',
+                               '-f', 'concat', '-safe', '0', '-i', part_list_path,
+                               '-ss', str(float(from_seconds)), '-t', str(duration),
+                               '-i', ctx.input_path,
+                               '-map', '0:v', '-map', '1:a:0?', '-map', '1:s:0?', '-codec', 'copy',
+                               '-f', ctx.output_format, '-y', ctx.output_path]
+                else:
+                    command = ['ffmpeg', '-v', 'error',
+                               '-ss', str(float(from_seconds)), '-t', str(duration),
+                               '-i', ctx.input_path, '-codec', 'copy',
+                               '-f', ctx.output_format, '-y', ctx.output_path]
+
+                ctx.run(command, progress_callback=progress_callback, timeout=_remaining_time(expiration_time),
+                        cancel_event=cancel_event)
             except CalledProcessError as ffmpeg_error:
                 error_message = ffmpeg_error.stderr.decode('utf-8')
                 raise OperatorError('Could not trim asset: %s' % error_message)
@@ -461,8 +1419,138 @@ class FFmpegProcessor(Processor):
 
         return Asset(essence=result, **metadata)
 
+    def __trim_parts(self, asset, from_seconds, to_seconds):
+        """
+        Splits the frames of the first video stream between the specified
+        times into partial groups of pictures at the boundaries, which have
+        to be re-encoded, and complete groups of pictures in between, which
+        can be copied.
+
+        :param asset: Video asset
+        :type asset: Asset
+        :param from_seconds: Start time of the clip in seconds
+        :type from_seconds: float
+        :param to_seconds: End time of the clip in seconds
+        :type to_seconds: float
+        :return: Tuples of whether the part is copied, its start time in
+            seconds, and its number of frames, or an empty list if the video
+            cannot be rendered in parts
+        :rtype: list
+        """
+        if asset.metadata.get('video', {}).get('codec') not in FFmpegProcessor.__transport_stream_codecs:
+            return []
+        frame_times, keyframe_times = self.__frame_index(asset)
+        start_frame = bisect.bisect_left(frame_times, from_seconds - 1e-6)
+        end_frame = bisect.bisect_left(frame_times, to_seconds - 1e-6)
+        if start_frame >= end_frame:
+            return []
+
+        # Complete groups of pictures within the clip lie between the first
+        # and the last group boundary, where the end of the stream also counts
+        keyframe_numbers = {bisect.bisect_left(frame_times, keyframe_time - 1e-6) for keyframe_time in keyframe_times}
+        boundaries = sorted(frame_number for frame_number in keyframe_numbers | {len(frame_times)}
+                            if start_frame <= frame_number <= end_frame)
+        if len(boundaries) < 2:
+            return [(False, frame_times[start_frame], end_frame - start_frame)]
+        copy_start_frame, copy_end_frame = boundaries[0], boundaries[-1]
+
+        parts = []
+        if start_frame < copy_start_frame:
+            parts.append((False, frame_times[start_frame], copy_start_frame - start_frame))
+        parts.append((True, frame_times[copy_start_frame], copy_end_frame - copy_start_frame))
+        if copy_end_frame < end_frame:
+            parts.append((False, frame_times[copy_end_frame], end_frame - copy_end_frame))
+        return parts
+
+    @staticmethod
+    def __trim_part_encoding_options(asset):
+        """
+        Returns the options for re-encoding partial groups of pictures of the
+        first video stream, so that they match the copied groups of pictures
+        in pixel format, profile, level, frame rate, and sample aspect ratio.
+
+        :param asset: Video asset
+        :type asset: Asset
+        :return: FFmpeg options
+        :rtype: list
+        :raise UnsupportedFormatError: if the stream properties cannot be determined
+        """
+        try:
+            probe_data = _run_ffprobe(asset.essence, ['-select_streams', 'v:0', '-show_streams'])
+            stream = probe_data['streams'][0]
+        except (CalledProcessError, KeyError, IndexError):
+            raise UnsupportedFormatError('Unsupported file format.')
+
+        encoder = FFmpegProcessor.__codec_to_encoder[asset.metadata['video']['codec']]
+        codec_options = FFmpegProcessor.__codec_options['video'].get(encoder, [])
+        options = ['-c:v', encoder]
+        for option, value in zip(codec_options[::2], codec_options[1::2]):
+            if option != '-pix_fmt':
+                options.extend([option, value])
+        if encoder not in FFmpegProcessor.__codec_options['video'] and asset.metadata['video'].get('bitrate'):
+            options.extend(['-b:v', '%dk' % asset.metadata['video']['bitrate']])
+
+        if stream.get('pix_fmt'):
+            options.extend(['-pix_fmt', stream['pix_fmt']])
+        profile = FFmpegProcessor.__encoder_profiles[encoder].get(stream.get('profile'))
+        if profile:
+            options.extend(['-profile:v', profile])
+        level = stream.get('level', -99)
+        if level > 0:
+            if encoder == 'libx265':
+                # HEVC levels are reported as 30 times the level number
+                options.extend(['-x265-params', 'level-idc=%g' % (level/30)])
+            else:
+                options.extend(['-level:v', str(level)])
+        frame_rate = stream.get('r_frame_rate', '0/0')
+        if not frame_rate.startswith('0/') and not frame_rate.endswith('/0'):
+            options.extend(['-r:v', frame_rate])
+        sample_aspect_ratio = stream.get('sample_aspect_ratio', '0:1')
+        if not sample_aspect_ratio.startswith('0:') and not sample_aspect_ratio.endswith(':0'):
+            options.extend(['-filter:v', 'setsar=%s' % sample_aspect_ratio.replace(':', '/')])
+        return options
+
+    def __render_trim_parts(self, ctx, asset, trim_parts, encoding_options, expiration_time, cancel_event):
+        """
+        Re-encodes or copies the parts of the first video stream and writes
+        a list of the parts for the FFmpeg concat demuxer.
+
+        The parts are muxed to MPEG-TS with the parameter sets in the stream,
+        because the concat demuxer only uses the extradata of the first part.
+
+        :return: Path of the part list
+        :rtype: str
+        :raise CalledProcessError: if a part could not be rendered
+        :raise OperatorError: if the rendering timed out or was cancelled
+        """
+        copy_options = ['-c:v', 'copy']
+        annex_b_filter = FFmpegProcessor.__annex_b_filters.get(asset.metadata['video']['codec'])
+        if annex_b_filter and MimeType(asset.mime_type) != MimeType('video/mp2t'):
+            copy_options.extend(['-bsf:v', annex_b_filter])
+
+        part_paths = []
+        for part_index, (copy, start_seconds, frame_count) in enumerate(trim_parts):
+            part_path = os.path.join(ctx.name, 'part%d' % part_index)
+            if copy:
+                # Seek slightly after the keyframe to make sure it is found despite rounding errors
+                seek_seconds = start_seconds + 0.0005
+            else:
+                # Seek slightly before the frame to keep it despite rounding errors
+                seek_seconds = max(0.0, start_seconds - 0.0005)
+            command = ['ffmpeg', '-loglevel', 'error',
+                       '-ss', '%.6f' % seek_seconds, '-i', ctx.input_path,
+                       '-map', '0:v:0', '-an', '-sn', '-frames:v', str(frame_count)]
+            command.extend(copy_options if copy else encoding_options)
+            command.extend(['-f', 'mpegts', '-y', part_path])
+            ctx.run(command, timeout=_remaining_time(expiration_time), cancel_event=cancel_event)
+            part_paths.append(part_path)
+
+        part_list_path = os.path.join(ctx.name, 'parts.txt')
+        _write_concat_list(part_list_path, part_paths)
+        return part_list_path
+
     @operator
-    def extract_frame(self, asset, mime_type, seconds=0):
+    def extract_frame(self, asset, mime_type, seconds=0, progress_callback=None, timeout=None, cancel_event=None):
         """
         Creates a new image asset of the specified MIME type from the essence
         of the specified video asset.
@@ -473,6 +1561,14 @@ class FFmpegProcessor(Processor):
         :type mime_type: MimeType or str
         :param seconds: Offset of the frame in seconds
         :type seconds: float
+        :param progress_callback: Function that is called with an
+            :class:`~madam.ffmpeg.FFmpegProgress` object whenever FFmpeg
+            reports progress
+        :type progress_callback: callable or None
+        :param timeout: Maximum number of seconds FFmpeg may run
+        :type timeout: float or None
+        :param cancel_event: Event that cancels the operation when it is set
+        :type cancel_event: threading.Event or None
         :return: New image asset with converted essence
         :rtype: Asset
         """
@@ -486,16 +1582,24 @@ class FFmpegProcessor(Processor):
         if not (encoder_name and codec_name):
             raise UnsupportedFormatError('Unsupported target asset type: %s' % mime_type)
 
+        # Seek to the preceding keyframe in the input and only decode the
+        # frames between the keyframe and the requested time
+        keyframes = self.keyframes(asset)
+        keyframe_index = bisect.bisect_right(keyframes, float(seconds)) - 1
+        keyframe_seconds = keyframes[keyframe_index] if keyframe_index >= 0 else 0.0
+
         result = io.BytesIO()
-        with _FFmpegContext(asset.essence, result) as ctx:
+        with _FFmpegContext(asset.essence, result, output_format=encoder_name, seek_input=True) as ctx:
             command = ['ffmpeg', '-v', 'error',
+                       '-ss', '%f' % keyframe_seconds,
                        '-i', ctx.input_path,
-                       '-ss', str(float(seconds)),
+                       '-ss', '%f' % (float(seconds) - keyframe_seconds),
                        '-codec:v', codec_name, '-vframes', '1',
-                       '-f', encoder_name, '-y', ctx.output_path]
+                       '-f', ctx.output_format, '-y', ctx.output_path]
 
             try:
-                subprocess_run(command, stderr=subprocess.PIPE, check=True)
+                ctx.run(command, progress_callback=progress_callback, timeout=timeout,
+                        cancel_event=cancel_event)
             except CalledProcessError as ffmpeg_error:
                 error_message = ffmpeg_error.stderr.decode('utf-8')
                 raise OperatorError('Could not extract frame from asset: %s' % error_message)
@@ -509,7 +1613,295 @@ class FFmpegProcessor(Processor):
         return Asset(essence=result, **metadata)
 
     @operator
-    def crop(self, asset, x, y, width, height):
+    def extract_frames(self, asset, mime_type, seconds=None, interval=None, sprite=None,
+                       progress_callback=None, timeout=None, cancel_event=None):
+        """
+        Creates new image assets of the specified MIME type from multiple
+        frames of the specified video asset using a single FFmpeg process.
+
+        The frames are either specified as a list of offsets or as an
+        interval between frames. Optionally, the frames can also be combined
+        to a sprite sheet that is described by a WebVTT thumbnail track.
+
+        **Options for sprite sheets:**
+
+        - **columns** – Number of frames per row (default: 10)
+        - **width** – Width of each frame in the sprite sheet (default: width of the asset)
+        - **height** – Height of each frame in the sprite sheet (default: height of the asset)
+        - **url** – URL of the sprite sheet used in the WebVTT track (default: 'sprite')
+
+        :param asset: Video asset which will serve as the source for the frames
+        :type asset: Asset
+        :param mime_type: MIME type of the destination images
+        :type mime_type: MimeType or str
+        :param seconds: Offsets of the frames in seconds
+        :type seconds: list or None
+        :param interval: Number of seconds between frames, starting at zero
+        :type interval: float or None
+        :param sprite: Dictionary with options for a sprite sheet, or `None`
+            if no sprite sheet should be created
+        :type sprite: dict or None
+        :param progress_callback: Function that is called with an
+            :class:`~madam.ffmpeg.FFmpegProgress` object whenever FFmpeg
+            reports progress
+        :type progress_callback: callable or None
+        :param timeout: Maximum number of seconds FFmpeg may run
+        :type timeout: float or None
+        :param cancel_event: Event that cancels the operation when it is set
+        :type cancel_event: threading.Event or None
+        :return: New image assets in the order of the offsets, followed by
+            the sprite sheet and the WebVTT asset if a sprite sheet was requested
+        :rtype: list
+        """
+        source_mime_type = MimeType(asset.mime_type)
+        if source_mime_type.type != 'video':
+            raise UnsupportedFormatError('Unsupported source asset type: %s' % source_mime_type)
+
+        mime_type = MimeType(mime_type)
+        codec_name = self.__mime_type_to_codec.get(mime_type)
+        if not codec_name:
+            raise UnsupportedFormatError('Unsupported target asset type: %s' % mime_type)
+
+        if seconds is None:
+            if interval is None:
+                raise ValueError('Either frame offsets or an interval must be specified')
+            if interval <= 0:
+                raise ValueError('Invalid interval: %r' % interval)
+            seconds = []
+            while len(seconds)*interval < asset.duration:
+                seconds.append(len(seconds)*interval)
+        seconds = [float(offset) for offset in seconds]
+        if not seconds:
+            raise ValueError('No frame offsets specified')
+
+        frame_index = self.__frame_index(asset)
+        frame_times = frame_index.frame_times
+        if not frame_times:
+            raise OperatorError('Could not determine the frames of the asset')
+
+        # Seek to the keyframe preceding the first frame and select the
+        # frames by their number relative to that keyframe
+        keyframes = frame_index.keyframe_times
+        keyframe_index = bisect.bisect_right(keyframes, min(seconds)) - 1
+        keyframe_seconds = keyframes[keyframe_index] if keyframe_index >= 0 else 0.0
+        first_frame_number = bisect.bisect_left(frame_times, keyframe_seconds - 1e-6)
+        frame_numbers = [min(bisect.bisect_left(frame_times, offset - 1e-6), len(frame_times) - 1) -
+                         first_frame_number for offset in seconds]
+        selected_frame_numbers = sorted(set(frame_numbers))
+        output_index_by_frame_number = {frame_number: output_index
+                                        for output_index, frame_number in enumerate(selected_frame_numbers)}
+        frame_count = len(selected_frame_numbers)
+        frame_selection = 'select=%s' % '+'.join('eq(n\\,%d)' % frame_number
+                                                 for frame_number in selected_frame_numbers)
+
+        if sprite is not None:
+            columns = sprite.get('columns', 10)
+            tile_width = sprite.get('width', asset.width)
+            tile_height = sprite.get('height', asset.height)
+            if columns < 1 or tile_width < 1 or tile_height < 1:
+                raise ValueError('Invalid sprite sheet options: %r' % sprite)
+            rows = ceil(frame_count/columns)
+
+        frame_metadata = _combine_metadata(asset, 'width', 'height', mime_type=mime_type)
+        if 'video' in asset.metadata:
+            frame_metadata['depth'] = asset.metadata['video']['depth']
+
+        with _FFmpegContext(asset.essence, None, seek_input=True, output_directory=True) as ctx:
+            frame_path_pattern = os.path.join(ctx.output_path, 'frame%06d')
+            sprite_path = os.path.join(ctx.output_path, 'sprite')
+            command = ['ffmpeg', '-v', 'error', '-vsync', '0',
+                       '-ss', '%f' % keyframe_seconds,
+                       '-i', ctx.input_path]
+            if sprite is None:
+                command.extend(['-filter:v', frame_selection,
+                                '-frames:v', str(frame_count), '-codec:v', codec_name,
+                                '-f', 'image2', '-y', frame_path_pattern])
+            else:
+                command.extend(['-filter_complex',
+                                '[0:v]%s,split=2[frames][tiles];'
+                                '[tiles]scale=%d:%d,tile=%dx%d:nb_frames=%d[sprite]'
+                                % (frame_selection, tile_width, tile_height, columns, rows, frame_count),
+                                '-map', '[frames]',
+                                '-frames:v', str(frame_count), '-codec:v', codec_name,
+                                '-f', 'image2', '-y', frame_path_pattern,
+                                '-map', '[sprite]',
+                                '-frames:v', '1', '-update', '1', '-codec:v', codec_name,
+                                '-f', 'image2', '-y', sprite_path])
+
+            try:
+                ctx.run(command, progress_callback=progress_callback, timeout=timeout,
+                        cancel_event=cancel_event)
+            except CalledProcessError as ffmpeg_error:
+                error_message = ffmpeg_error.stderr.decode('utf-8')
+                raise OperatorError('Could not extract frames from asset: %s' % error_message)
+
+            frame_assets = []
+            for output_index in range(frame_count):
+                try:
+                    with open(frame_path_pattern % (output_index + 1), 'rb') as frame_file:
+                        frame_assets.append(Asset(essence=frame_file, **frame_metadata))
+                except FileNotFoundError:
+                    raise OperatorError('Could not extract frame %d from asset' % selected_frame_numbers[output_index])
+            assets = [frame_assets[output_index_by_frame_number[frame_number]] for frame_number in frame_numbers]
+
+            if sprite is not None:
+                with open(sprite_path, 'rb') as sprite_file:
+                    sprite_metadata = dict(frame_metadata,
+                                           width=tile_width*min(columns, frame_count), height=tile_height*rows)
+                    assets.append(Asset(essence=sprite_file, **sprite_metadata))
+
+        if sprite is not None:
+            cues = []
+            offsets_and_frame_numbers = sorted(set(zip(seconds, frame_numbers)))
+            for cue_index, (offset, frame_number) in enumerate(offsets_and_frame_numbers):
+                if cue_index + 1 < len(offsets_and_frame_numbers):
+                    end_offset = offsets_and_frame_numbers[cue_index + 1][0]
+                else:
+                    end_offset = max(offset, asset.metadata.get('duration', offset))
+                output_index = output_index_by_frame_number[frame_number]
+                cues.append('%s --> %s\n%s#xywh=%d,%d,%d,%d\n' % (
+                    _format_webvtt_time(offset), _format_webvtt_time(end_offset), sprite.get('url', 'sprite'),
+                    (output_index % columns)*tile_width, (output_index//columns)*tile_height,
+                    tile_width, tile_height))
+            webvtt_data = '\n'.join(['WEBVTT\n'] + cues).encode('utf-8')
+            assets.append(Asset(essence=io.BytesIO(webvtt_data), mime_type='text/vtt'))
+
+        return assets
+
+    @operator
+    def encode_ladder(self, asset, renditions, segment_duration=4.0, video=None, audio=None,
+                      progress_callback=None, timeout=None, cancel_event=None):
+        """
+        Creates HTTP Live Streaming (HLS) renditions of the specified video
+        asset in different sizes and bitrates using a single FFmpeg process.
+
+        The source is decoded once and scaled to each rendition. Keyframes
+        are forced at the segment boundaries, so the segments of all
+        renditions are aligned.
+
+        **Options for renditions:**
+
+        - **height** – Height of the rendition in pixels
+        - **width** – Width of the rendition in pixels (default: scaled
+          according to the aspect ratio of the asset)
+        - **bitrate** – Target video bitrate in kBit/s as float number
+
+        **Options for video streams:**
+
+        - **codec** – Processor-specific name of the video codec as string (default: 'libx264')
+
+        **Options for audio streams:**
+
+        - **codec** – Processor-specific name of the audio codec as string (default: 'aac')
+        - **bitrate** – Target bitrate in kBit/s as float number (default: 128)
+
+        :param asset: Video asset which will serve as the source for the renditions
+        :type asset: Asset
+        :param renditions: Dictionaries with the options for each rendition
+        :type renditions: list
+        :param segment_duration: Target duration of the segments in seconds
+        :type segment_duration: float
+        :param video: Dictionary with options for video streams.
+        :type video: dict or None
+        :param audio: Dictionary with options for audio streams.
+        :type audio: dict or None
+        :param progress_callback: Function that is called with an
+            :class:`~madam.ffmpeg.FFmpegProgress` object whenever FFmpeg
+            reports progress
+        :type progress_callback: callable or None
+        :param timeout: Maximum number of seconds FFmpeg may run
+        :type timeout: float or None
+        :param cancel_event: Event that cancels the operation when it is set
+        :type cancel_event: threading.Event or None
+        :return: Assets by their file name, starting with the master playlist
+            `master.m3u8`, followed by the media playlist `stream<n>.m3u8`
+            and the segments of each rendition
+        :rtype: OrderedDict
+        """
+        source_mime_type = MimeType(asset.mime_type)
+        if source_mime_type.type != 'video':
+            raise UnsupportedFormatError('Unsupported source asset type: %s' % source_mime_type)
+        if not renditions:
+            raise ValueError('No renditions specified')
+        if segment_duration <= 0:
+            raise ValueError('Invalid segment duration: %r' % segment_duration)
+
+        rendition_sizes = []
+        for rendition in renditions:
+            height = rendition.get('height', 0)
+            width = rendition.get('width') or 2*max(1, round(asset.width*height/asset.height/2))
+            if width < 1 or height < 1 or not rendition.get('bitrate'):
+                raise ValueError('Invalid rendition options: %r' % rendition)
+            rendition_sizes.append((width, height))
+
+        video = video or {}
+        audio = audio or {}
+        has_audio = 'audio' in asset.metadata and audio.get('codec', 'aac') is not None
+
+        with _FFmpegContext(asset.essence, None, output_directory=True) as ctx:
+            playlist_path_pattern = os.path.join(ctx.output_path, 'stream%v.m3u8')
+            command = ['ffmpeg', '-loglevel', 'error',
+                       '-i', ctx.input_path,
+                       '-filter_complex', '[0:v]split=%d%s;%s' % (
+                           len(renditions),
+                           ''.join('[split%d]' % index for index in range(len(renditions))),
+                           ';'.join('[split%d]scale=%d:%d[scaled%d]' % (index, width, height, index)
+                                    for index, (width, height) in enumerate(rendition_sizes)))]
+            for index in range(len(renditions)):
+                command.extend(['-map', '[scaled%d]' % index])
+                if has_audio:
+                    command.extend(['-map', '0:a:0'])
+            command.extend(['-c:v', video.get('codec', 'libx264'), '-pix_fmt', 'yuv420p',
+                            '-force_key_frames', 'expr:gte(t,n_forced*%g)' % segment_duration])
+            for index, rendition in enumerate(renditions):
+                bitrate = rendition['bitrate']
+                command.extend(['-b:v:%d' % index, '%dk' % bitrate,
+                                '-maxrate:v:%d' % index, '%dk' % round(1.45*bitrate),
+                                '-bufsize:v:%d' % index, '%dk' % round(2*bitrate)])
+            if has_audio:
+                command.extend(['-c:a', audio.get('codec', 'aac'), '-b:a', '%dk' % audio.get('bitrate', 128)])
+            command.extend(['-f', 'hls', '-hls_time', '%g' % segment_duration,
+                            '-hls_playlist_type', 'vod', '-hls_flags', 'independent_segments',
+                            '-hls_segment_filename', os.path.join(ctx.output_path, 'stream%v_%05d.ts'),
+                            '-master_pl_name', 'master.m3u8',
+                            '-var_stream_map', ' '.join('v:%d,a:%d' % (index, index) if has_audio else 'v:%d' % index
+                                                        for index in range(len(renditions))),
+                            '-y', playlist_path_pattern])
+
+            try:
+                ctx.run(command, progress_callback=progress_callback, timeout=timeout,
+                        cancel_event=cancel_event)
+            except CalledProcessError as ffmpeg_error:
+                error_message = ffmpeg_error.stderr.decode('utf-8')
+                raise OperatorError('Could not encode renditions of asset: %s' % error_message)
+
+            assets = OrderedDict()
+            try:
+                with open(os.path.join(ctx.output_path, 'master.m3u8'), 'rb') as master_playlist_file:
+                    assets['master.m3u8'] = Asset(essence=master_playlist_file,
+                                                  mime_type='application/vnd.apple.mpegurl')
+                for index, (width, height) in enumerate(rendition_sizes):
+                    playlist_name = 'stream%d.m3u8' % index
+                    with open(os.path.join(ctx.output_path, playlist_name), 'rb') as playlist_file:
+                        playlist = playlist_file.read()
+                    assets[playlist_name] = Asset(essence=io.BytesIO(playlist),
+                                                  mime_type='application/vnd.apple.mpegurl')
+                    duration = 0.0
+                    for line in playlist.decode('utf-8').splitlines():
+                        if line.startswith('#EXTINF:'):
+                            duration = float(line[len('#EXTINF:'):].split(',')[0])
+                        elif line and not line.startswith('#'):
+                            with open(os.path.join(ctx.output_path, line), 'rb') as segment_file:
+                                assets[line] = Asset(essence=segment_file, mime_type='video/mp2t',
+                                                     width=width, height=height, duration=duration)
+            except FileNotFoundError as missing_file_error:
+                raise OperatorError('Could not encode renditions of asset: %s is missing'
+                                    % os.path.basename(missing_file_error.filename))
+
+        return assets
+
+    @operator
+    def crop(self, asset, x, y, width, height, progress_callback=None, timeout=None, cancel_event=None):
         """
         Creates a cropped video asset whose essence is cropped to the specified
         rectangular area.
@@ -524,6 +1916,14 @@ class FFmpegProcessor(Processor):
         :type width: int
         :param height: Height of the cropping area
         :type height: int
+        :param progress_callback: Function that is called with an
+            :class:`~madam.ffmpeg.FFmpegProgress` object whenever FFmpeg
+            reports progress
+        :type progress_callback: callable or None
+        :param timeout: Maximum number of seconds FFmpeg may run
+        :type timeout: float or None
+        :param cancel_event: Event that cancels the operation when it is set
+        :type cancel_event: threading.Event or None
         :return: New asset with cropped essence
         :rtype: Asset
         """
@@ -547,14 +1947,15 @@ class FFmpegProcessor(Processor):
         height = max_y - min_y
 
         result = io.BytesIO()
-        with _FFmpegContext(asset.essence, result) as ctx:
+        with _FFmpegContext(asset.essence, result, output_format=encoder_name) as ctx:
             command = ['ffmpeg', '-v', 'error',
                        '-i', ctx.input_path, '-codec', 'copy',
                        '-f:v', 'crop=w=%d:h=%d:x=%d:y=%d' % (width, height, x, y),
-                       '-f', encoder_name, '-y', ctx.output_path]
+                       '-f', ctx.output_format, '-y', ctx.output_path]
 
             try:
-                subprocess_run(command, stderr=subprocess.PIPE, check=True)
+                ctx.run(command, progress_callback=progress_callback, timeout=timeout,
+                        cancel_event=cancel_event)
             except CalledProcessError as ffmpeg_error:
                 error_message = ffmpeg_error.stderr.decode('utf-8')
                 raise OperatorError('Could not crop asset: %s' % error_message)
@@ -565,12 +1966,49 @@ class FFmpegProcessor(Processor):
 
         return Asset(essence=result, **metadata)
 
+    def plan_rotation(self, asset, angle, expand=False):
+        """
+        Determines how the specified asset is processed when it is rotated by
+        the specified angle.
+
+        Rotations by multiples of 90 degrees are stored as display matrix
+        without re-encoding if the container supports it and the rotated
+        video fits the requested dimensions. Otherwise the video is rotated
+        with a filter and re-encoded.
+
+        :param asset: Asset that will be rotated
+        :type asset: Asset
+        :param angle: Angle in degrees, counter clockwise
+        :type angle: float
+        :param expand: Whether the dimensions of the rotated asset can change
+        :type expand: bool
+        :return: `'copy'` if only the rotation metadata is changed, or `'transcode'`
+        :rtype: str
+        """
+        if angle % 90.0 != 0.0 or MimeType(asset.mime_type) not in FFmpegProcessor.__rotation_metadata_formats:
+            return 'transcode'
+        if angle % 180.0 != 0.0 and not expand and asset.width != asset.height:
+            return 'transcode'
+        return 'copy'
+
     @operator
-    def rotate(self, asset, angle, expand=False):
+    def rotate(self, asset, angle, expand=False, progress_callback=None, timeout=None, cancel_event=None):
         """
         Creates an asset whose essence is rotated by the specified angle in
         degrees.
 
+        Rotations by multiples of 90 degrees are lossless if the container
+        can store the rotation as metadata. Use :meth:`plan_rotation` to
+        determine whether the video is re-encoded. The metadata of the rotated
+        asset contains the entry ``rotation_plan`` with the value of
+        :meth:`plan_rotation` that was used, unless the angle is a multiple of
+        360 degrees and the asset is returned unchanged.
+
+        The width and height of the rotated asset are its display dimensions.
+        If only the rotation metadata was changed, the video stream keeps its
+        coded dimensions, so :meth:`read` reports the dimensions before the
+        rotation when the essence is read again.
+
         :param asset: Asset whose contents will be rotated
         :type asset: Asset
         :param angle: Angle in degrees, counter clockwise
@@ -579,6 +2017,14 @@ class FFmpegProcessor(Processor):
             can hold the entire rotated essence, otherwise the dimensions of
             the original asset will be used.
         :type expand: bool
+        :param progress_callback: Function that is called with an
+            :class:`~madam.ffmpeg.FFmpegProgress` object whenever FFmpeg
+            reports progress
+        :type progress_callback: callable or None
+        :param timeout: Maximum number of seconds FFmpeg may run
+        :type timeout: float or None
+        :param cancel_event: Event that cancels the operation when it is set
+        :type cancel_event: threading.Event or None
         :return: New asset with rotated essence
         :rtype: Asset
         """
@@ -608,25 +2054,77 @@ class FFmpegProcessor(Processor):
             width = ceil(round(width_ * cos_a + height_ * sin_a, 7))
             height = ceil(round(width_ * sin_a + height_ * cos_a, 7))
 
-        result = io.BytesIO()
-        with _FFmpegContext(asset.essence, result) as ctx:
-            command = ['ffmpeg', '-v', 'error',
-                       '-i', ctx.input_path, '-codec', 'copy',
-                       '-f:v', 'rotate=a=%(a)f:ow=%(w)d:oh=%(h)d)' % dict(a=angle_rad, w=width, h=height),
-                       '-f', encoder_name, '-y', ctx.output_path]
+        expiration_time = None if timeout is None else time.monotonic() + timeout
+        rotation_plan = self.plan_rotation(asset, angle, expand=expand)
 
+        result = io.BytesIO()
+        with _FFmpegContext(asset.essence, result, output_format=encoder_name) as ctx:
             try:
-                subprocess_run(command, stderr=subprocess.PIPE, check=True)
+                if rotation_plan == 'copy':
+                    display_rotation = (self.__display_rotation(asset) + angle) % 360.0
+                    command = ['ffmpeg', '-v', 'error',
+                               '-display_rotation:v:0', '%g' % display_rotation,
+                               '-i', ctx.input_path, '-codec', 'copy',
+                               '-f', ctx.output_format, '-y', ctx.output_path]
+                    try:
+                        ctx.run(command, progress_callback=progress_callback,
+                                timeout=_remaining_time(expiration_time), cancel_event=cancel_event)
+                    except CalledProcessError as ffmpeg_error:
+                        if b'display_rotation' not in ffmpeg_error.stderr:
+                            raise
+                        # FFmpeg versions before 6.0 only support the clockwise rotation tag
+                        command = ['ffmpeg', '-v', 'error',
+                                   '-i', ctx.input_path, '-codec', 'copy',
+                                   '-metadata:s:v:0', 'rotate=%g' % (-display_rotation % 360.0),
+                                   '-f', ctx.output_format, '-y', ctx.output_path]
+                        ctx.run(command, progress_callback=progress_callback,
+                                timeout=_remaining_time(expiration_time), cancel_event=cancel_event)
+                else:
+                    command = ['ffmpeg', '-v', 'error',
+                               '-i', ctx.input_path,
+                               '-filter:v', 'rotate=a=%(a)f:ow=%(w)d:oh=%(h)d' % dict(a=-angle_rad, w=width, h=height)]
+                    encoder = FFmpegProcessor.__codec_to_encoder.get(asset.metadata.get('video', {}).get('codec'))
+                    if encoder:
+                        command.extend(['-c:v', encoder])
+                        command.extend(FFmpegProcessor.__codec_options['video'].get(encoder, []))
+                    command.extend(['-c:a', 'copy', '-c:s', 'copy',
+                                    '-f', ctx.output_format, '-y', ctx.output_path])
+                    ctx.run(command, progress_callback=progress_callback,
+                            timeout=_remaining_time(expiration_time), cancel_event=cancel_event)
             except CalledProcessError as ffmpeg_error:
                 error_message = ffmpeg_error.stderr.decode('utf-8')
                 raise OperatorError('Could not rotate asset: %s' % error_message)
 
         metadata = _combine_metadata(asset,
                                      'mime_type', 'duration', 'video', 'audio', 'subtitle',
-                                     width=width, height=height)
+                                     width=width, height=height, rotation_plan=rotation_plan)
 
         return Asset(essence=result, **metadata)
 
+    def __display_rotation(self, asset):
+        """
+        Returns the rotation of the first video stream of the specified asset
+        that is stored in its metadata.
+
+        :param asset: Video asset
+        :type asset: Asset
+        :return: Angle in degrees, counter clockwise
+        :rtype: float
+        """
+        try:
+            probe_data = _run_ffprobe(asset.essence, ['-select_streams', 'v:0',
+                                                      '-show_entries', 'stream_side_data=rotation:'
+                                                                       'stream_tags=rotate'])
+        except CalledProcessError:
+            return 0.0
+        for stream in probe_data.get('streams', []):
+            for side_data in stream.get('side_data_list', []):
+                if 'rotation' in side_data:
+                    return float(side_data['rotation'])
+            if 'rotate' in stream.get('tags', {}):
+                return -float(stream['tags']['rotate'])
+        return 0.0
+
 
 class FFmpegMetadataProcessor(MetadataProcessor):
     """
@@ -659,7 +2157,34 @@ class FFmpegMetadataProcessor(MetadataProcessor):
         MimeType('video/x-matroska'): bidict({}),
         MimeType('video/x-msvideo'): bidict({}),
         MimeType('video/mp2t'): bidict({}),
-        MimeType('video/quicktime'): bidict({}),
+        MimeType('video/quicktime'): bidict({
+            'album': 'album',                   # ©alb Album
+            'album_artist': 'album_artist',     # aART Album artist
+            'album_sort': 'sort_album',         # soal Album sort order
+            'artist': 'artist',                 # ©ART Artist
+            'artist_sort': 'sort_artist',       # soar Artist sort order
+            'comment': 'comment',               # ©cmt Comment
+            'compilation': 'compilation',       # cpil Part of a compilation
+            'composer': 'composer',             # ©wrt Composer
+            'copyright': 'copyright',           # cprt Copyright
+            'date': 'date',                     # ©day Release date
+            'description': 'description',       # desc Description
+            'disc': 'disc',                     # disk Disc number
+            'encoder': 'encoder',               # ©too Encoding tool
+            'episode_id': 'episode_id',         # tven TV episode ID
+            'episode_sort': 'episode_sort',     # tves TV episode number
+            'genre': 'genre',                   # ©gen Genre
+            'grouping': 'grouping',             # ©grp Grouping
+            'lyrics': 'lyrics',                 # ©lyr Lyrics
+            'media_type': 'media_type',         # stik Media kind
+            'network': 'network',               # tvnn TV network name
+            'season_number': 'season_number',   # tvsn TV season
+            'show': 'show',                     # tvsh TV show name
+            'synopsis': 'synopsis',             # ldes Long description
+            'title': 'title',                   # ©nam Title
+            'title_sort': 'sort_name',          # sonm Title sort order
+            'track': 'track',                   # trkn Track number
+        }),
         MimeType('video/ogg'): bidict({}),
         MimeType('audio/mpeg'): bidict({
             'album': 'album',                   # TALB Album
@@ -791,14 +2316,14 @@ class FFmpegMetadataProcessor(MetadataProcessor):
 
         # Strip metadata
         result = io.BytesIO()
-        with _FFmpegContext(file, result) as ctx:
-            encoder_name = self.__mime_type_to_encoder[mime_type]
+        encoder_name = self.__mime_type_to_encoder[mime_type]
+        with _FFmpegContext(file, result, output_format=encoder_name) as ctx:
             command = ['ffmpeg', '-loglevel', 'error',
                        '-i', ctx.input_path,
                        '-map_metadata', '-1', '-codec', 'copy',
-                       '-y', '-f', encoder_name, ctx.output_path]
+                       '-y', '-f', ctx.output_format, ctx.output_path]
             try:
-                subprocess_run(command, stderr=subprocess.PIPE, check=True)
+                ctx.run(command)
             except CalledProcessError as ffmpeg_error:
                 error_message = ffmpeg_error.stderr.decode('utf-8')
                 raise OperatorError('Could not strip metadata: %s' % error_message)
@@ -827,10 +2352,10 @@ class FFmpegMetadataProcessor(MetadataProcessor):
 
         # Add metadata to file
         result = io.BytesIO()
-        with _FFmpegContext(file, result) as ctx:
-            encoder_name = self.__mime_type_to_encoder[mime_type]
+        encoder_name = self.__mime_type_to_encoder[mime_type]
+        with _FFmpegContext(file, result, input_format=encoder_name, output_format=encoder_name) as ctx:
             command = ['ffmpeg', '-loglevel', 'error',
-                       '-f', encoder_name, '-i', ctx.input_path]
+                       '-f', ctx.input_format, '-i', ctx.input_path]
 
             ffmetadata = metadata_by_type['ffmetadata']
             metadata_keys = self.metadata_keys_by_mime_type[mime_type]
@@ -842,10 +2367,10 @@ class FFmpegMetadataProcessor(MetadataProcessor):
                 command.append('%s=%s' % (ffmetadata_key, value))
 
             command.extend(['-codec', 'copy',
-                            '-y', '-f', encoder_name, ctx.output_path])
+                            '-y', '-f', ctx.output_format, ctx.output_path])
 
             try:
-                subprocess_run(command, stderr=subprocess.PIPE, check=True)
+                ctx.run(command)
             except CalledProcessError as ffmpeg_error:
                 error_message = ffmpeg_error.stderr.decode('utf-8')
                 raise OperatorError('Could not add metadata: %s' % error_message)
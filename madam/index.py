@@ -0,0 +1,389 @@
+import bisect
+import math
+import re
+from collections import defaultdict
+from collections.abc import Mapping
+
+from madam.core import AssetIndex
+
+
+_TOKEN_PATTERN = re.compile(r'\w+')
+_QUERY_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def _tokenize(text):
+    return _TOKEN_PATTERN.findall(text.casefold())
+
+
+class FullTextIndex(AssetIndex):
+    """
+    Represents an inverted index over textual metadata of assets.
+
+    The values of all configured metadata fields are tokenized and stored in
+    an index that maps each token to the positions where it occurs in each
+    asset. Fields are looked up in the metadata of an asset, as well as in
+    all nested metadata formats (e.g. ``exif``, ``iptc``, or ``ffmetadata``).
+
+    The index can be queried with :func:`~madam.index.FullTextIndex.search`
+    without loading any asset.
+    """
+    #: Metadata fields that are indexed by default
+    default_fields = frozenset({
+        'album', 'album_artist', 'artist', 'byline_titles', 'bylines', 'caption', 'comment', 'composer',
+        'copyright', 'credit', 'description', 'genre', 'headline', 'keywords', 'performer', 'source',
+        'subjects', 'title',
+    })
+
+    # Gap between the positions of separate values so phrases cannot span values
+    __value_gap = 100
+
+    # BM25 ranking parameters
+    __k1 = 1.2
+    __b = 0.75
+
+    def __init__(self, fields=None):
+        """
+        Initializes a new, empty `FullTextIndex`.
+
+        :param fields: Names of the metadata fields to be indexed, or `None`
+            if the default fields should be indexed
+        :type fields: collections.Iterable or None
+        """
+        super().__init__()
+        self.fields = frozenset(fields) if fields is not None else FullTextIndex.default_fields
+        self._postings = {}
+        self._tokens = []
+        self._token_counts = {}
+        self._tokens_by_key = {}
+
+    def _texts(self, metadata):
+        for key, value in metadata.items():
+            if isinstance(value, Mapping):
+                yield from self._texts(value)
+            elif key in self.fields:
+                if isinstance(value, str):
+                    yield value
+                elif isinstance(value, (tuple, list, frozenset, set)):
+                    yield from (item for item in value if isinstance(item, str))
+
+    def add(self, asset_key, asset, tags):
+        """
+        Adds the textual metadata of the specified asset to this index.
+
+        :param asset_key: Key of the asset in the storage
+        :param asset: Asset to be indexed
+        :type asset: Asset
+        :param tags: Tags associated with the asset
+        :type tags: frozenset
+        """
+        positions_by_token = defaultdict(list)
+        position = 0
+        for text in self._texts(asset.metadata):
+            for token in _tokenize(text):
+                positions_by_token[token].append(position)
+                position += 1
+            position += FullTextIndex.__value_gap
+        if not positions_by_token:
+            return
+        for token, positions in positions_by_token.items():
+            if token not in self._postings:
+                self._postings[token] = {}
+                bisect.insort(self._tokens, token)
+            self._postings[token][asset_key] = positions
+        self._token_counts[asset_key] = sum(len(positions) for positions in positions_by_token.values())
+        self._tokens_by_key[asset_key] = frozenset(positions_by_token)
+
+    def remove(self, asset_key):
+        """
+        Removes the asset with the specified key from this index.
+
+        :param asset_key: Key of the asset in the storage
+        """
+        if self._token_counts.pop(asset_key, None) is None:
+            return
+        for token in self._tokens_by_key.pop(asset_key):
+            postings = self._postings[token]
+            del postings[asset_key]
+            if not postings:
+                del self._postings[token]
+                del self._tokens[bisect.bisect_left(self._tokens, token)]
+
+    def __len__(self):
+        """
+        Returns the number of indexed assets.
+
+        :return: Number of assets in this index
+        :rtype: int
+        """
+        return len(self._token_counts)
+
+    def _expand(self, term):
+        if term.endswith('*'):
+            prefix = ''.join(_tokenize(term[:-1]))
+            start = bisect.bisect_left(self._tokens, prefix)
+            end = bisect.bisect_left(self._tokens, prefix + '\U0010ffff')
+            return self._tokens[start:end]
+        return _tokenize(term)
+
+    def _term_frequencies(self, term):
+        frequencies = defaultdict(int)
+        for token in self._expand(term):
+            for asset_key, positions in self._postings.get(token, {}).items():
+                frequencies[asset_key] += len(positions)
+        return frequencies
+
+    def _phrase_frequencies(self, phrase):
+        tokens = _tokenize(phrase)
+        if len(tokens) <= 1:
+            return self._term_frequencies(phrase)
+        postings = [self._postings.get(token, {}) for token in tokens]
+        candidates = set(postings[0])
+        for token_postings in postings[1:]:
+            candidates &= set(token_postings)
+        frequencies = {}
+        for asset_key in candidates:
+            following_positions = [frozenset(token_postings[asset_key]) for token_postings in postings[1:]]
+            count = sum(1 for position in postings[0][asset_key]
+                        if all(position + offset in positions
+                               for offset, positions in enumerate(following_positions, 1)))
+            if count:
+                frequencies[asset_key] = count
+        return frequencies
+
+    def search(self, query, limit=None):
+        """
+        Returns the keys of all assets that match the specified query, ranked
+        by relevance.
+
+        The query consists of terms separated by whitespace, all of which have
+        to match. Terms ending with ``*`` match all tokens with the specified
+        prefix. Terms enclosed in double quotes and terms consisting of several
+        tokens, like ``e-mail``, match only if they occur as a phrase.
+        Matching is case-insensitive.
+
+        :param query: Search query, e.g. ``'"red car" berl*'``
+        :type query: str
+        :param limit: Maximum number of results, or `None` for all results
+        :type limit: int or None
+        :return: Asset keys ordered by descending relevance
+        :rtype: list
+        """
+        clauses = []
+        for phrase, term in _QUERY_PATTERN.findall(query):
+            if phrase:
+                clauses.append(self._phrase_frequencies(phrase))
+            elif not term.endswith('*') and len(_tokenize(term)) > 1:
+                # Terms like "e-mail" consist of several tokens that must occur as a phrase
+                clauses.append(self._phrase_frequencies(term))
+            elif term.endswith('*') or _tokenize(term):
+                clauses.append(self._term_frequencies(term))
+        if not clauses:
+            return []
+
+        matches = set(clauses[0])
+        for frequencies in clauses[1:]:
+            matches &= set(frequencies)
+
+        asset_count = len(self._token_counts)
+        average_length = sum(self._token_counts.values()) / asset_count if asset_count else 0
+        scores = {}
+        for asset_key in matches:
+            length_norm = 1 - FullTextIndex.__b + FullTextIndex.__b*self._token_counts[asset_key]/average_length
+            score = 0.0
+            for frequencies in clauses:
+                idf = math.log(1 + (asset_count - len(frequencies) + 0.5)/(len(frequencies) + 0.5))
+                frequency = frequencies[asset_key]
+                score += idf*frequency*(FullTextIndex.__k1 + 1)/(frequency + FullTextIndex.__k1*length_norm)
+            scores[asset_key] = score
+
+        ranked_keys = sorted(scores, key=lambda asset_key: (-scores[asset_key], str(asset_key)))
+        if limit is not None:
+            ranked_keys = ranked_keys[:limit]
+        return ranked_keys
+
+
+_EARTH_RADIUS = 6371008.8
+
+
+def _decimal_degrees(values, ref, negative_ref):
+    if not values:
+        return None
+    if isinstance(values, (int, float)):
+        values = (values,)
+    degrees = sum(float(value)/60**power for power, value in enumerate(values))
+    return -degrees if ref == negative_ref else degrees
+
+
+def _haversine_distance(latitude1, longitude1, latitude2, longitude2):
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    delta_phi = phi2 - phi1
+    delta_lambda = math.radians(longitude2 - longitude1)
+    a = math.sin(delta_phi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(delta_lambda/2)**2
+    return 2*_EARTH_RADIUS*math.asin(min(1.0, math.sqrt(a)))
+
+
+class GeoIndex(AssetIndex):
+    """
+    Represents a spatial index over the GPS coordinates of assets.
+
+    Coordinates are read from the ``gps.latitude``, ``gps.latitude_ref``,
+    ``gps.longitude``, and ``gps.longitude_ref`` entries of the Exif metadata.
+    Assets are assigned to buckets of a regular grid, so that bounding box and
+    radius queries only need to inspect the buckets that overlap the queried
+    area.
+    """
+    def __init__(self, cell_size=0.1):
+        """
+        Initializes a new, empty `GeoIndex`.
+
+        :param cell_size: Edge length of a grid bucket in degrees
+        :type cell_size: float
+        """
+        super().__init__()
+        if cell_size <= 0:
+            raise ValueError('Invalid cell size: %r' % cell_size)
+        self.cell_size = cell_size
+        self._cells = {}
+        self._locations = {}
+
+    @staticmethod
+    def location(asset):
+        """
+        Returns the location of the specified asset in decimal degrees.
+
+        :param asset: Asset with Exif GPS metadata
+        :type asset: Asset
+        :return: Tuple of latitude and longitude, or `None` if the asset has no location
+        :rtype: (float, float) or None
+        """
+        exif = asset.metadata.get('exif', {})
+        latitude = _decimal_degrees(exif.get('gps.latitude'), exif.get('gps.latitude_ref'), 'south')
+        longitude = _decimal_degrees(exif.get('gps.longitude'), exif.get('gps.longitude_ref'), 'west')
+        if latitude is None or longitude is None:
+            return None
+        return latitude, longitude
+
+    def _cell(self, latitude, longitude):
+        return math.floor(latitude/self.cell_size), math.floor(longitude/self.cell_size)
+
+    def add(self, asset_key, asset, tags):
+        """
+        Adds the location of the specified asset to this index.
+
+        Assets without location will be ignored.
+
+        :param asset_key: Key of the asset in the storage
+        :param asset: Asset to be indexed
+        :type asset: Asset
+        :param tags: Tags associated with the asset
+        :type tags: frozenset
+        """
+        location = GeoIndex.location(asset)
+        if location is None:
+            return
+        self._locations[asset_key] = location
+        self._cells.setdefault(self._cell(*location), {})[asset_key] = location
+
+    def remove(self, asset_key):
+        """
+        Removes the asset with the specified key from this index.
+
+        :param asset_key: Key of the asset in the storage
+        """
+        location = self._locations.pop(asset_key, None)
+        if location is None:
+            return
+        cell = self._cell(*location)
+        del self._cells[cell][asset_key]
+        if not self._cells[cell]:
+            del self._cells[cell]
+
+    def __len__(self):
+        """
+        Returns the number of indexed assets.
+
+        :return: Number of assets in this index
+        :rtype: int
+        """
+        return len(self._locations)
+
+    def _locations_in_cells(self, min_latitude, min_longitude, max_latitude, max_longitude):
+        min_row, min_column = self._cell(min_latitude, min_longitude)
+        max_row, max_column = self._cell(max_latitude, max_longitude)
+        cell_count = (max_row - min_row + 1)*(max_column - min_column + 1)
+        if cell_count > len(self._cells):
+            cells = (locations for (row, column), locations in self._cells.items()
+                     if min_row <= row <= max_row and min_column <= column <= max_column)
+        else:
+            cells = (self._cells.get((row, column), {})
+                     for row in range(min_row, max_row + 1)
+                     for column in range(min_column, max_column + 1))
+        for locations in cells:
+            yield from locations.items()
+
+    def within_bounds(self, min_latitude, min_longitude, max_latitude, max_longitude):
+        """
+        Returns the keys of all assets that are located in the specified
+        bounding box.
+
+        Bounding boxes that cross the antimeridian can be specified with a
+        minimum longitude that is larger than the maximum longitude.
+
+        :param min_latitude: Southern boundary in decimal degrees
+        :type min_latitude: float
+        :param min_longitude: Western boundary in decimal degrees
+        :type min_longitude: float
+        :param max_latitude: Northern boundary in decimal degrees
+        :type max_latitude: float
+        :param max_longitude: Eastern boundary in decimal degrees
+        :type max_longitude: float
+        :return: Keys of the assets inside the bounding box
+        :rtype: set
+        """
+        if min_longitude > max_longitude:
+            return self.within_bounds(min_latitude, min_longitude, max_latitude, 180.0) | \
+                   self.within_bounds(min_latitude, -180.0, max_latitude, max_longitude)
+        return {asset_key for asset_key, (latitude, longitude)
+                in self._locations_in_cells(min_latitude, min_longitude, max_latitude, max_longitude)
+                if min_latitude <= latitude <= max_latitude and min_longitude <= longitude <= max_longitude}
+
+    def within_radius(self, latitude, longitude, radius):
+        """
+        Returns the keys of all assets that are located within the specified
+        distance of a point, ordered by ascending distance.
+
+        :param latitude: Latitude of the center point in decimal degrees
+        :type latitude: float
+        :param longitude: Longitude of the center point in decimal degrees
+        :type longitude: float
+        :param radius: Maximum distance in meters
+        :type radius: float
+        :return: Keys of the assets inside the radius
+        :rtype: list
+        """
+        delta_latitude = math.degrees(radius/_EARTH_RADIUS)
+        min_latitude = max(-90.0, latitude - delta_latitude)
+        max_latitude = min(90.0, latitude + delta_latitude)
+        min_cos = min(math.cos(math.radians(min_latitude)), math.cos(math.radians(max_latitude)))
+        if max_latitude >= 90.0 or min_latitude <= -90.0 or delta_latitude >= 90.0*min_cos:
+            bounds = [(-180.0, 180.0)]
+        else:
+            delta_longitude = delta_latitude/min_cos
+            min_longitude = longitude - delta_longitude
+            max_longitude = longitude + delta_longitude
+            if min_longitude < -180.0:
+                bounds = [(min_longitude + 360.0, 180.0), (-180.0, max_longitude)]
+            elif max_longitude > 180.0:
+                bounds = [(min_longitude, 180.0), (-180.0, max_longitude - 360.0)]
+            else:
+                bounds = [(min_longitude, max_longitude)]
+
+        distances = {}
+        for min_longitude, max_longitude in bounds:
+            for asset_key, location in self._locations_in_cells(min_latitude, min_longitude,
+                                                                max_latitude, max_longitude):
+                distance = _haversine_distance(latitude, longitude, *location)
+                if distance <= radius:
+                    distances[asset_key] = distance
+        return sorted(distances, key=distances.get)
@@ -0,0 +1,677 @@
+import datetime
+import io
+import struct
+from collections import OrderedDict, namedtuple
+from fractions import Fraction
+
+from bidict import bidict
+
+from madam.core import MetadataProcessor, UnsupportedFormatError
+
+
+_SOI = 0xD8
+_EOI = 0xD9
+_SOS = 0xDA
+_APP1 = 0xE1
+_APP13 = 0xED
+_COM = 0xFE
+_STANDALONE_MARKERS = frozenset(range(0xD0, 0xD8)) | {0x01, _SOI, _EOI}
+
+_EXIF_HEADER = b'Exif\x00\x00'
+_XMP_HEADER = b'http://ns.adobe.com/xap/1.0/\x00'
+_PHOTOSHOP_HEADER = b'Photoshop 3.0\x00'
+_PHOTOSHOP_RESOURCE_TYPE = b'8BIM'
+_IPTC_RESOURCE_ID = 0x0404
+_MAX_SEGMENT_SIZE = 0xFFFF - 2
+
+
+class _Segment:
+    """
+    Represents a marker segment of a JPEG file.
+
+    The payload is a view into the original data, so segments can be spliced
+    without copying.
+    """
+    __slots__ = 'marker', 'payload', 'data'
+
+    def __init__(self, marker, payload, data):
+        self.marker = marker
+        self.payload = payload
+        self.data = data
+
+    def is_exif(self):
+        return self.marker == _APP1 and self.payload[:len(_EXIF_HEADER)] == _EXIF_HEADER
+
+    def is_xmp(self):
+        return self.marker == _APP1 and self.payload[:len(_XMP_HEADER)] == _XMP_HEADER
+
+    def is_photoshop(self):
+        return self.marker == _APP13 and self.payload[:len(_PHOTOSHOP_HEADER)] == _PHOTOSHOP_HEADER
+
+
+def _read_segments(data):
+    """
+    Splits JPEG data into its marker segments.
+
+    Parsing stops at the first *start of scan* marker. The returned tail
+    contains the scan and all following data.
+
+    :param data: JPEG data
+    :type data: memoryview
+    :return: Tuple of the header segments and the remaining data
+    :raise UnsupportedFormatError: if the data is not a valid JPEG file
+    """
+    if data[:2] != b'\xff\xd8':
+        raise UnsupportedFormatError('Unknown file format.')
+    segments = []
+    position = 2
+    length = len(data)
+    while position < length:
+        if data[position] != 0xFF:
+            raise UnsupportedFormatError('Invalid JPEG marker at offset %d.' % position)
+        # Skip fill bytes
+        while position + 1 < length and data[position + 1] == 0xFF:
+            position += 1
+        if position + 1 >= length:
+            break
+        marker = data[position + 1]
+        if marker == _SOS or marker == _EOI:
+            return segments, data[position:]
+        if marker in _STANDALONE_MARKERS:
+            segments.append(_Segment(marker, data[position + 2:position + 2], data[position:position + 2]))
+            position += 2
+            continue
+        if position + 4 > length:
+            break
+        segment_length = struct.unpack_from('>H', data, position + 2)[0]
+        end = position + 2 + segment_length
+        if segment_length < 2 or end > length:
+            break
+        segments.append(_Segment(marker, data[position + 4:end], data[position:end]))
+        position = end
+    raise UnsupportedFormatError('Truncated JPEG data.')
+
+
+def _segment_data(marker, payload):
+    if len(payload) > _MAX_SEGMENT_SIZE:
+        raise UnsupportedFormatError('Metadata exceeds maximum JPEG segment size.')
+    return struct.pack('>BBH', 0xFF, marker, len(payload) + 2) + payload
+
+
+# Exif/TIFF data types: (size in bytes, struct format)
+_BYTE = 1
+_ASCII = 2
+_SHORT = 3
+_LONG = 4
+_RATIONAL = 5
+_UNDEFINED = 7
+_SRATIONAL = 10
+_TYPE_FORMATS = {
+    1: (1, 'B'), 2: (1, 'B'), 3: (2, 'H'), 4: (4, 'L'), 5: (8, 'LL'), 6: (1, 'b'), 7: (1, 'B'),
+    8: (2, 'h'), 9: (4, 'l'), 10: (8, 'll'), 11: (4, 'f'), 12: (8, 'd'),
+}
+
+_IFD0 = 'Image'
+_EXIF_IFD = 'Photo'
+_GPS_IFD = 'GPSInfo'
+_INTEROP_IFD = 'Iop'
+_THUMBNAIL_IFD = 'Thumbnail'
+_IFD_POINTERS = OrderedDict([
+    (_EXIF_IFD, (_IFD0, 0x8769)),
+    (_GPS_IFD, (_IFD0, 0x8825)),
+    (_INTEROP_IFD, (_EXIF_IFD, 0xA005)),
+])
+_THUMBNAIL_OFFSET_TAG = 0x0201
+_THUMBNAIL_LENGTH_TAG = 0x0202
+
+
+_ExifEntry = namedtuple('_ExifEntry', 'value_type, count, raw_value, offset')
+
+
+class _ExifData:
+    """
+    Represents the image file directories (IFDs) of Exif data.
+
+    Entries are stored as raw values in the byte order of the data. When the
+    data is serialized, the values of unmodified entries stay at their
+    original offsets, and only new and modified values are appended. Blobs
+    that contain absolute offsets, e.g. maker notes, therefore remain valid.
+    Entries with unknown types are written back unchanged.
+    """
+    def __init__(self, byte_order='<'):
+        self.byte_order = byte_order
+        self.ifds = OrderedDict((name, OrderedDict()) for name in (_IFD0, _EXIF_IFD, _GPS_IFD, _INTEROP_IFD))
+        self.thumbnail_ifd = OrderedDict()
+        self.thumbnail = b''
+        self.thumbnail_offset = None
+        # Original TIFF data, and offsets and entry counts of the parsed IFDs
+        self.data = b''
+        self.ifd_locations = {}
+
+    @staticmethod
+    def parse(tiff_data):
+        """
+        Parses TIFF-structured Exif data.
+
+        :param tiff_data: Exif data without the ``Exif`` header
+        :type tiff_data: memoryview
+        :return: Parsed Exif data
+        :rtype: _ExifData
+        """
+        byte_order_mark = bytes(tiff_data[:2])
+        if byte_order_mark == b'II':
+            exif = _ExifData('<')
+        elif byte_order_mark == b'MM':
+            exif = _ExifData('>')
+        else:
+            raise UnsupportedFormatError('Invalid Exif byte order.')
+        exif.data = bytes(tiff_data)
+        try:
+            magic, ifd0_offset = struct.unpack_from(exif.byte_order + 'HL', tiff_data, 2)
+            if magic != 42:
+                raise UnsupportedFormatError('Invalid TIFF header in Exif data.')
+            thumbnail_offset = exif._parse_ifd(tiff_data, ifd0_offset, _IFD0, exif.ifds[_IFD0])
+            for ifd_name, (parent_name, pointer_tag) in _IFD_POINTERS.items():
+                pointer = exif.ifds[parent_name].pop(pointer_tag, None)
+                if pointer is not None:
+                    offset = struct.unpack_from(exif.byte_order + 'L', pointer.raw_value)[0]
+                    exif._parse_ifd(tiff_data, offset, ifd_name, exif.ifds[ifd_name])
+            if thumbnail_offset:
+                exif._parse_ifd(tiff_data, thumbnail_offset, _THUMBNAIL_IFD, exif.thumbnail_ifd)
+                offset_entry = exif.thumbnail_ifd.pop(_THUMBNAIL_OFFSET_TAG, None)
+                length_entry = exif.thumbnail_ifd.pop(_THUMBNAIL_LENGTH_TAG, None)
+                if offset_entry and length_entry:
+                    offset = exif._decode(offset_entry)[0]
+                    length = exif._decode(length_entry)[0]
+                    exif.thumbnail = bytes(tiff_data[offset:offset + length])
+                    if len(exif.thumbnail) == length:
+                        exif.thumbnail_offset = offset
+        except struct.error:
+            raise UnsupportedFormatError('Truncated Exif data.')
+        return exif
+
+    def _parse_ifd(self, tiff_data, offset, ifd_name, entries):
+        entry_count = struct.unpack_from(self.byte_order + 'H', tiff_data, offset)[0]
+        self.ifd_locations[ifd_name] = offset, entry_count
+        for entry_index in range(entry_count):
+            entry_offset = offset + 2 + 12*entry_index
+            tag, value_type, count = struct.unpack_from(self.byte_order + 'HHL', tiff_data, entry_offset)
+            if value_type not in _TYPE_FORMATS:
+                # The size of values with unknown types is unknown, so the value field is kept as is
+                entries[tag] = _ExifEntry(value_type, count, bytes(tiff_data[entry_offset + 8:entry_offset + 12]), None)
+                continue
+            size = _TYPE_FORMATS[value_type][0]*count
+            if size <= 4:
+                value_offset = None
+                raw_value = bytes(tiff_data[entry_offset + 8:entry_offset + 8 + size])
+            else:
+                value_offset = struct.unpack_from(self.byte_order + 'L', tiff_data, entry_offset + 8)[0]
+                raw_value = bytes(tiff_data[value_offset:value_offset + size])
+            if len(raw_value) != size:
+                continue
+            entries[tag] = _ExifEntry(value_type, count, raw_value, value_offset)
+        return struct.unpack_from(self.byte_order + 'L', tiff_data, offset + 2 + 12*entry_count)[0]
+
+    def _decode(self, entry):
+        value_type, count, raw_value, _ = entry
+        if value_type == _ASCII:
+            return raw_value.split(b'\x00', 1)[0].decode('utf-8', errors='replace')
+        if value_type == _UNDEFINED:
+            return raw_value
+        type_format = _TYPE_FORMATS[value_type][1]
+        values = struct.unpack(self.byte_order + type_format*count, raw_value)
+        if value_type in (_RATIONAL, _SRATIONAL):
+            return tuple(Fraction(numerator, denominator) if denominator else Fraction(0)
+                         for numerator, denominator in zip(values[::2], values[1::2]))
+        return values
+
+    def _encode(self, value_type, values):
+        if value_type == _ASCII:
+            raw_value = values.encode('utf-8') + b'\x00'
+            return _ExifEntry(value_type, len(raw_value), raw_value, None)
+        if value_type in (_RATIONAL, _SRATIONAL):
+            values = [part for value in values for part in (value.numerator, value.denominator)]
+            count = len(values)//2
+        else:
+            count = len(values)
+        type_format = _TYPE_FORMATS[value_type][1]
+        return _ExifEntry(value_type, count, struct.pack(self.byte_order + type_format*count, *values), None)
+
+    def get(self, ifd_name, tag):
+        entry = self.ifds[ifd_name].get(tag)
+        if entry is None or entry.value_type not in _TYPE_FORMATS:
+            return None
+        return entry.value_type, self._decode(entry)
+
+    def set(self, ifd_name, tag, value_type, values):
+        entry = self._encode(value_type, values)
+        previous_entry = self.ifds[ifd_name].get(tag)
+        if previous_entry is not None and previous_entry.offset is not None and \
+                previous_entry[:3] == entry[:3]:
+            entry = previous_entry
+        self.ifds[ifd_name][tag] = entry
+
+    def __bool__(self):
+        return any(self.ifds.values())
+
+    def _write_ifd(self, data, entries, offset, next_ifd_offset=0):
+        """
+        Writes an IFD to the specified offset. Values that do not fit into an
+        entry and are not stored in the data yet are appended to the data.
+        """
+        ifd = [struct.pack(self.byte_order + 'H', len(entries))]
+        for tag in sorted(entries):
+            value_type, count, raw_value, value_offset = entries[tag]
+            if value_type not in _TYPE_FORMATS or len(raw_value) <= 4:
+                ifd.append(struct.pack(self.byte_order + 'HHL', tag, value_type, count) +
+                           raw_value.ljust(4, b'\x00'))
+                continue
+            if value_offset is None:
+                value_offset = _ExifData._allocate(data, len(raw_value))
+                data[value_offset:value_offset + len(raw_value)] = raw_value
+            ifd.append(struct.pack(self.byte_order + 'HHLL', tag, value_type, count, value_offset))
+        ifd.append(struct.pack(self.byte_order + 'L', next_ifd_offset))
+        ifd_data = b''.join(ifd)
+        data[offset:offset + len(ifd_data)] = ifd_data
+
+    @staticmethod
+    def _allocate(data, size):
+        """
+        Appends space for the specified number of bytes at a word boundary
+        to the data and returns its offset.
+        """
+        data.extend(b'\x00'*(len(data) % 2))
+        offset = len(data)
+        data.extend(b'\x00'*size)
+        return offset
+
+    def _ifd_offset(self, data, ifd_name, entries):
+        """
+        Returns the offset of an IFD. The IFD is written in place if it has
+        not more entries than the original IFD.
+        """
+        original_offset, original_entry_count = self.ifd_locations.get(ifd_name, (None, 0))
+        if original_offset is not None and len(entries) <= original_entry_count:
+            return original_offset
+        return _ExifData._allocate(data, 2 + 12*len(entries) + 4)
+
+    def serialize(self):
+        """
+        Returns the TIFF-structured Exif data.
+
+        :return: Exif data without the ``Exif`` header
+        :rtype: bytes
+        """
+        byte_order_mark = b'II' if self.byte_order == '<' else b'MM'
+        data = bytearray(self.data or byte_order_mark + struct.pack(self.byte_order + 'HL', 42, 8))
+
+        ifds = OrderedDict((name, OrderedDict(entries)) for name, entries in self.ifds.items())
+        pointer_entry = _ExifEntry(_LONG, 1, b'\x00'*4, None)
+        for ifd_name, (parent_name, pointer_tag) in reversed(list(_IFD_POINTERS.items())):
+            if ifds[ifd_name]:
+                ifds[parent_name][pointer_tag] = pointer_entry
+            else:
+                del ifds[ifd_name]
+        thumbnail_ifd = None
+        if self.thumbnail:
+            thumbnail_ifd = OrderedDict(self.thumbnail_ifd)
+            thumbnail_ifd[_THUMBNAIL_OFFSET_TAG] = pointer_entry
+            thumbnail_ifd[_THUMBNAIL_LENGTH_TAG] = self._encode(_LONG, [len(self.thumbnail)])
+
+        # Determine the offsets of all IFDs before writing the pointers to them
+        offsets = OrderedDict((ifd_name, self._ifd_offset(data, ifd_name, entries))
+                              for ifd_name, entries in ifds.items())
+        for ifd_name, (parent_name, pointer_tag) in _IFD_POINTERS.items():
+            if ifd_name in ifds:
+                ifds[parent_name][pointer_tag] = self._encode(_LONG, [offsets[ifd_name]])
+        thumbnail_ifd_offset = 0
+        if thumbnail_ifd is not None:
+            thumbnail_ifd_offset = self._ifd_offset(data, _THUMBNAIL_IFD, thumbnail_ifd)
+            thumbnail_offset = self.thumbnail_offset
+            if thumbnail_offset is None:
+                thumbnail_offset = _ExifData._allocate(data, len(self.thumbnail))
+                data[thumbnail_offset:thumbnail_offset + len(self.thumbnail)] = self.thumbnail
+            thumbnail_ifd[_THUMBNAIL_OFFSET_TAG] = self._encode(_LONG, [thumbnail_offset])
+
+        struct.pack_into(self.byte_order + 'L', data, 4, offsets[_IFD0])
+        for ifd_name, entries in ifds.items():
+            self._write_ifd(data, entries, offsets[ifd_name], thumbnail_ifd_offset if ifd_name == _IFD0 else 0)
+        if thumbnail_ifd is not None:
+            self._write_ifd(data, thumbnail_ifd, thumbnail_ifd_offset)
+        return bytes(data)
+
+
+def _parse_iptc(data):
+    """
+    Returns the IPTC datasets as list of tuples of record number, dataset
+    number and data.
+    """
+    datasets = []
+    position = 0
+    while position + 5 <= len(data) and data[position] == 0x1C:
+        record, dataset, size = struct.unpack_from('>BBH', data, position + 1)
+        position += 5
+        if size & 0x8000:
+            size_length = size & 0x7FFF
+            size = int.from_bytes(bytes(data[position:position + size_length]), 'big')
+            position += size_length
+        datasets.append((record, dataset, bytes(data[position:position + size])))
+        position += size
+    return datasets
+
+
+def _serialize_iptc(datasets):
+    parts = []
+    for record, dataset, value in datasets:
+        if len(value) > 0x7FFF:
+            parts.append(struct.pack('>BBBHL', 0x1C, record, dataset, 0x8004, len(value)))
+        else:
+            parts.append(struct.pack('>BBBH', 0x1C, record, dataset, len(value)))
+        parts.append(value)
+    return b''.join(parts)
+
+
+def _parse_photoshop_resources(data):
+    """
+    Returns the Photoshop image resources as list of tuples of resource ID,
+    name and data.
+    """
+    resources = []
+    position = 0
+    while position + 12 <= len(data) and data[position:position + 4] == _PHOTOSHOP_RESOURCE_TYPE:
+        resource_id = struct.unpack_from('>H', data, position + 4)[0]
+        name_length = data[position + 6]
+        name_size = name_length + 1 + (name_length + 1) % 2
+        name = bytes(data[position + 7:position + 7 + name_length])
+        position += 6 + name_size
+        size = struct.unpack_from('>L', data, position)[0]
+        position += 4
+        resources.append((resource_id, name, data[position:position + size]))
+        position += size + size % 2
+    return resources
+
+
+def _serialize_photoshop_resources(resources):
+    parts = []
+    for resource_id, name, value in resources:
+        name_data = bytes([len(name)]) + name
+        parts.append(_PHOTOSHOP_RESOURCE_TYPE + struct.pack('>H', resource_id))
+        parts.append(name_data + b'\x00'*(len(name_data) % 2))
+        parts.append(struct.pack('>L', len(value)))
+        parts.append(bytes(value) + b'\x00'*(len(value) % 2))
+    return b''.join(parts)
+
+
+def _photoshop_segments_data(data):
+    """
+    Returns APP13 segments containing the Photoshop image resource data.
+
+    Resource data that does not fit into a single segment is split across
+    consecutive segments, which are concatenated again when read.
+    """
+    max_size = _MAX_SEGMENT_SIZE - len(_PHOTOSHOP_HEADER)
+    return b''.join(_segment_data(_APP13, _PHOTOSHOP_HEADER + data[position:position + max_size])
+                    for position in range(0, max(len(data), 1), max_size))
+
+
+def _exif_mapping(mapping, value_type):
+    bidi = bidict(mapping)
+    return (value_type,
+            lambda values: bidi[values if value_type == _ASCII else values[0]],
+            lambda value: bidi.inv[value] if value_type == _ASCII else [bidi.inv[value]])
+
+
+def _exif_date(values):
+    return datetime.datetime.strptime(values, '%Y:%m:%d').date()
+
+
+_EXIF_STRING = _ASCII, str, str
+_EXIF_SHORT = _SHORT, lambda values: int(values[0]), lambda value: [int(value)]
+_EXIF_RATIONAL = _RATIONAL, lambda values: float(values[0]), lambda value: [Fraction(value).limit_denominator()]
+_EXIF_SRATIONAL = _SRATIONAL, lambda values: float(values[0]), lambda value: [Fraction(value).limit_denominator()]
+_EXIF_RATIONALS = (_RATIONAL,
+                   lambda values: tuple(map(float, values)),
+                   lambda value: [Fraction(item).limit_denominator() for item in value])
+_EXIF_DATE = _ASCII, _exif_date, lambda value: value.strftime('%Y:%m:%d')
+_EXIF_TIME = (_RATIONAL,
+              lambda values: datetime.time(*map(round, values)),
+              lambda value: [Fraction(value.hour), Fraction(value.minute), Fraction(value.second)])
+
+
+def _iptc_date(value):
+    return datetime.datetime.strptime(value, '%Y%m%d').date()
+
+
+def _iptc_time(value):
+    return datetime.datetime.strptime(value[:6], '%H%M%S').time()
+
+
+_IPTC_STRING = str, str
+_IPTC_DATE = _iptc_date, lambda value: value.strftime('%Y%m%d')
+_IPTC_TIME = _iptc_time, lambda value: value.strftime('%H%M%S') + '+0000'
+
+_IPTC_RECORD = 2
+_IPTC_CHARACTER_SET = 1, 90, b'\x1b%G'
+_IPTC_RECORD_VERSION = _IPTC_RECORD, 0, b'\x00\x04'
+# Object preview datasets contain binary data instead of text
+_IPTC_BINARY_DATASETS = frozenset((200, 201, 202))
+
+
+class JPEGMetadataProcessor(MetadataProcessor):
+    """
+    Represents a metadata processor that reads and writes Exif and IPTC
+    metadata of JPEG files natively.
+
+    Metadata segments are located by scanning the JPEG marker segments.
+    Stripping and combining metadata splices segments into the original data
+    without temporary files or external libraries.
+    """
+    #: Mapping of metadata keys to the IFD, the tag number, and the converter of an Exif entry
+    exif_tags = {
+        'aperture': (_EXIF_IFD, 0x9202, _EXIF_RATIONAL),
+        'artist': (_IFD0, 0x013B, _EXIF_STRING),
+        'brightness': (_EXIF_IFD, 0x9203, _EXIF_SRATIONAL),
+        'camera.manufacturer': (_IFD0, 0x010F, _EXIF_STRING),
+        'camera.model': (_IFD0, 0x0110, _EXIF_STRING),
+        'description': (_IFD0, 0x010E, _EXIF_STRING),
+        'exposure_time': (_EXIF_IFD, 0x829A, _EXIF_RATIONAL),
+        'firmware': (_IFD0, 0x0131, _EXIF_STRING),
+        'fnumber': (_EXIF_IFD, 0x829D, _EXIF_RATIONAL),
+        'focal_length': (_EXIF_IFD, 0x920A, _EXIF_RATIONAL),
+        'focal_length_35mm': (_EXIF_IFD, 0xA405, _EXIF_SHORT),
+        'gps.altitude': (_GPS_IFD, 0x0006, _EXIF_RATIONAL),
+        'gps.altitude_ref': (_GPS_IFD, 0x0005,
+                             _exif_mapping({0: 'm_above_sea_level', 1: 'm_below_sea_level'}, _BYTE)),
+        'gps.latitude': (_GPS_IFD, 0x0002, _EXIF_RATIONALS),
+        'gps.latitude_ref': (_GPS_IFD, 0x0001, _exif_mapping({'N': 'north', 'S': 'south'}, _ASCII)),
+        'gps.longitude': (_GPS_IFD, 0x0004, _EXIF_RATIONALS),
+        'gps.longitude_ref': (_GPS_IFD, 0x0003, _exif_mapping({'E': 'east', 'W': 'west'}, _ASCII)),
+        'gps.map_datum': (_GPS_IFD, 0x0012, _EXIF_STRING),
+        'gps.speed': (_GPS_IFD, 0x000D, _EXIF_RATIONAL),
+        'gps.speed_ref': (_GPS_IFD, 0x000C, _exif_mapping({'K': 'km/h', 'M': 'mph', 'N': 'kn'}, _ASCII)),
+        'gps.date_stamp': (_GPS_IFD, 0x001D, _EXIF_DATE),
+        'gps.time_stamp': (_GPS_IFD, 0x0007, _EXIF_TIME),
+        'lens.manufacturer': (_EXIF_IFD, 0xA433, _EXIF_STRING),
+        'lens.model': (_EXIF_IFD, 0xA434, _EXIF_STRING),
+        'orientation': (_IFD0, 0x0112, _EXIF_SHORT),
+        'shutter_speed': (_EXIF_IFD, 0x9201, _EXIF_SRATIONAL),
+        'software': (_IFD0, 0x000B, _EXIF_STRING),
+    }
+
+    #: Mapping of metadata keys to the dataset number, the repeatability, and the converter of an IPTC dataset
+    iptc_datasets = {
+        'bylines': (80, True, _IPTC_STRING),
+        'byline_titles': (85, True, _IPTC_STRING),
+        'caption': (120, False, _IPTC_STRING),
+        'contacts': (118, True, _IPTC_STRING),
+        'copyright': (116, False, _IPTC_STRING),
+        'creation_date': (55, False, _IPTC_DATE),
+        'creation_time': (60, False, _IPTC_TIME),
+        'credit': (110, False, _IPTC_STRING),
+        'expiration_date': (37, False, _IPTC_DATE),
+        'expiration_time': (38, False, _IPTC_TIME),
+        'headline': (105, False, _IPTC_STRING),
+        'keywords': (25, True, _IPTC_STRING),
+        'language': (135, False, _IPTC_STRING),
+        'release_date': (30, False, _IPTC_DATE),
+        'release_time': (35, False, _IPTC_TIME),
+        'source': (115, False, _IPTC_STRING),
+        'subjects': (12, True, _IPTC_STRING),
+    }
+
+    def __init__(self):
+        """
+        Initializes a new `JPEGMetadataProcessor`.
+        """
+        super().__init__()
+
+    @property
+    def formats(self):
+        return 'exif', 'iptc'
+
+    @staticmethod
+    def __read_data(file):
+        data = file.read()
+        return memoryview(data)
+
+    def read(self, file):
+        segments, _ = _read_segments(JPEGMetadataProcessor.__read_data(file))
+
+        metadata_by_format = {}
+
+        exif_metadata = {}
+        for segment in segments:
+            if segment.is_exif():
+                exif = _ExifData.parse(segment.payload[len(_EXIF_HEADER):])
+                for madam_key, (ifd_name, tag, (value_type, convert_to_madam, _)) in self.exif_tags.items():
+                    entry = exif.get(ifd_name, tag)
+                    if entry is None or entry[0] != value_type and \
+                            not {entry[0], value_type} <= {_BYTE, _SHORT, _LONG}:
+                        continue
+                    try:
+                        exif_metadata[madam_key] = convert_to_madam(entry[1])
+                    except (IndexError, KeyError, ValueError):
+                        continue
+                break
+        if exif_metadata:
+            metadata_by_format['exif'] = exif_metadata
+
+        iptc_metadata = {}
+        values_by_dataset = {}
+        iptc_datasets = self.__iptc_datasets(segments)
+        character_set = JPEGMetadataProcessor.__iptc_character_set(iptc_datasets)
+        for record, dataset, value in iptc_datasets:
+            if record == _IPTC_RECORD:
+                values_by_dataset.setdefault(dataset, []).append(value)
+        for madam_key, (dataset, repeatable, (convert_to_madam, _)) in self.iptc_datasets.items():
+            values = values_by_dataset.get(dataset)
+            if not values:
+                continue
+            try:
+                values = [convert_to_madam(value.decode(character_set)) for value in values]
+            except (UnicodeDecodeError, ValueError):
+                continue
+            iptc_metadata[madam_key] = tuple(values) if repeatable else values[0]
+        if iptc_metadata:
+            metadata_by_format['iptc'] = iptc_metadata
+
+        return metadata_by_format
+
+    @staticmethod
+    def __iptc_datasets(segments):
+        photoshop_data = b''.join(bytes(segment.payload[len(_PHOTOSHOP_HEADER):])
+                                  for segment in segments if segment.is_photoshop())
+        for resource_id, _, value in _parse_photoshop_resources(photoshop_data):
+            if resource_id == _IPTC_RESOURCE_ID:
+                return _parse_iptc(value)
+        return []
+
+    @staticmethod
+    def __iptc_character_set(datasets):
+        """
+        Returns the character set of the text in IPTC datasets. Text with a
+        character set declaration other than UTF-8 is assumed to be ISO 8859-1.
+        """
+        for record, dataset, value in datasets:
+            if (record, dataset) == _IPTC_CHARACTER_SET[:2] and value != _IPTC_CHARACTER_SET[2]:
+                return 'latin-1'
+        return 'utf-8'
+
+    def strip(self, file):
+        segments, tail = _read_segments(JPEGMetadataProcessor.__read_data(file))
+
+        parts = [b'\xff\xd8']
+        for segment in segments:
+            if segment.is_exif() or segment.is_xmp() or segment.is_photoshop() or segment.marker == _COM:
+                continue
+            parts.append(segment.data)
+        parts.append(tail)
+
+        return io.BytesIO(b''.join(parts))
+
+    def combine(self, file, metadata_by_format):
+        segments, tail = _read_segments(JPEGMetadataProcessor.__read_data(file))
+
+        for metadata_format in metadata_by_format:
+            if metadata_format not in self.formats:
+                raise UnsupportedFormatError('Metadata format %r is not supported.' % metadata_format)
+
+        exif_segment = next((segment for segment in segments if segment.is_exif()), None)
+        photoshop_segments = [segment for segment in segments if segment.is_photoshop()]
+
+        exif_data = None
+        if 'exif' in metadata_by_format:
+            if exif_segment is not None:
+                exif = _ExifData.parse(exif_segment.payload[len(_EXIF_HEADER):])
+            else:
+                exif = _ExifData()
+            for madam_key, madam_value in metadata_by_format['exif'].items():
+                if madam_key not in self.exif_tags:
+                    continue
+                ifd_name, tag, (value_type, _, convert_to_exif) = self.exif_tags[madam_key]
+                exif.set(ifd_name, tag, value_type, convert_to_exif(madam_value))
+            exif_data = _segment_data(_APP1, _EXIF_HEADER + exif.serialize())
+
+        photoshop_data = None
+        if 'iptc' in metadata_by_format:
+            iptc_datasets = self.__iptc_datasets(segments)
+            character_set = JPEGMetadataProcessor.__iptc_character_set(iptc_datasets)
+            # Kept text is converted to UTF-8, which is declared for the written datasets
+            datasets = [(record, dataset, value if character_set == 'utf-8' or dataset in _IPTC_BINARY_DATASETS
+                         else value.decode(character_set).encode('utf-8'))
+                        for record, dataset, value in iptc_datasets if record == _IPTC_RECORD and dataset != 0]
+            updated_datasets = set()
+            new_datasets = []
+            for madam_key, madam_value in metadata_by_format['iptc'].items():
+                if madam_key not in self.iptc_datasets:
+                    continue
+                dataset, repeatable, (_, convert_to_iptc) = self.iptc_datasets[madam_key]
+                updated_datasets.add(dataset)
+                values = madam_value if repeatable else [madam_value]
+                new_datasets.extend((_IPTC_RECORD, dataset, convert_to_iptc(value).encode('utf-8'))
+                                    for value in values)
+            datasets = [dataset for dataset in datasets if dataset[1] not in updated_datasets]
+            iptc_data = _serialize_iptc([_IPTC_CHARACTER_SET, _IPTC_RECORD_VERSION] + datasets + new_datasets)
+
+            existing_resources = _parse_photoshop_resources(b''.join(
+                bytes(segment.payload[len(_PHOTOSHOP_HEADER):]) for segment in photoshop_segments))
+            resources = [resource for resource in existing_resources if resource[0] != _IPTC_RESOURCE_ID]
+            resources.append((_IPTC_RESOURCE_ID, b'', iptc_data))
+            photoshop_data = _photoshop_segments_data(_serialize_photoshop_resources(resources))
+
+        # Metadata segments are inserted after JFIF and Exif segments
+        parts = [b'\xff\xd8']
+        insert_index = 1
+        for segment in segments:
+            if exif_data is not None and segment.is_exif():
+                continue
+            if photoshop_data is not None and segment.is_photoshop():
+                continue
+            parts.append(segment.data)
+            if segment.marker in (0xE0, _APP1) and insert_index == len(parts) - 1:
+                insert_index = len(parts)
+        new_segments = [data for data in (exif_data, photoshop_data) if data is not None]
+        parts[insert_index:insert_index] = new_segments
+        parts.append(tail)
+
+        return io.BytesIO(b''.join(parts))
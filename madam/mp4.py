@@ -0,0 +1,460 @@
+import io
+import shutil
+import struct
+
+from madam.core import MetadataProcessor, UnsupportedFormatError
+from madam.ffmpeg import FFmpegMetadataProcessor
+from madam.mime import MimeType
+
+
+_BOX_HEADER = struct.Struct('>L4s')
+_LARGE_SIZE = struct.Struct('>Q')
+_FREE_BOX_TYPES = frozenset([b'free', b'skip'])
+_FRAGMENT_BOX_TYPES = frozenset([b'moof', b'mfra', b'sidx'])
+_SAMPLE_TABLE_PATH = (b'trak', b'mdia', b'minf', b'stbl')
+
+# Type indicators of the data atom
+_UTF8 = 1
+_IMPLICIT = 0
+_SIGNED_INTEGER = 21
+
+# Item atoms of FFmpeg metadata keys, see libavformat/movenc.c
+_TEXT_ATOMS = {
+    'album': b'\xa9alb',
+    'album_artist': b'aART',
+    'artist': b'\xa9ART',
+    'comment': b'\xa9cmt',
+    'composer': b'\xa9wrt',
+    'copyright': b'cprt',
+    'date': b'\xa9day',
+    'description': b'desc',
+    'encoder': b'\xa9too',
+    'episode_id': b'tven',
+    'genre': b'\xa9gen',
+    'grouping': b'\xa9grp',
+    'lyrics': b'\xa9lyr',
+    'network': b'tvnn',
+    'show': b'tvsh',
+    'sort_album': b'soal',
+    'sort_album_artist': b'soaa',
+    'sort_artist': b'soar',
+    'sort_composer': b'soco',
+    'sort_name': b'sonm',
+    'synopsis': b'ldes',
+    'title': b'\xa9nam',
+}
+# Item atoms with integer values and their size in bytes
+_INTEGER_ATOMS = {
+    'compilation': (b'cpil', 1),
+    'episode_sort': (b'tves', 4),
+    'gapless_playback': (b'pgap', 1),
+    'hd_video': (b'hdvd', 1),
+    'media_type': (b'stik', 1),
+    'rating': (b'rtng', 1),
+    'season_number': (b'tvsn', 4),
+}
+# Item atoms with a number and a total count
+_NUMBER_ATOMS = {
+    'disc': (b'disk', b''),
+    'track': (b'trkn', b'\x00\x00'),
+}
+
+
+def _box(box_type, payload):
+    """
+    Returns a box with the specified type and payload.
+    """
+    size = _BOX_HEADER.size + len(payload)
+    if size > 0xFFFFFFFF:
+        return _BOX_HEADER.pack(1, box_type) + _LARGE_SIZE.pack(size + _LARGE_SIZE.size) + payload
+    return _BOX_HEADER.pack(size, box_type) + payload
+
+
+def _boxes(data, start, end):
+    """
+    Yields the type, start, payload start, and end of all boxes in the
+    specified range.
+    """
+    position = start
+    while position + _BOX_HEADER.size <= end:
+        size, box_type = _BOX_HEADER.unpack_from(data, position)
+        payload_start = position + _BOX_HEADER.size
+        if size == 1:
+            if payload_start + _LARGE_SIZE.size > end:
+                break
+            size = _LARGE_SIZE.unpack_from(data, payload_start)[0]
+            payload_start += _LARGE_SIZE.size
+        elif size == 0:
+            size = end - position
+        if size < payload_start - position or position + size > end:
+            raise UnsupportedFormatError('Invalid %r box at offset %d.' % (bytes(box_type), position))
+        yield bytes(box_type), position, payload_start, position + size
+        position += size
+
+
+def _find_box(data, start, end, box_type):
+    for child_type, child_start, payload_start, child_end in _boxes(data, start, end):
+        if child_type == box_type:
+            return child_start, payload_start, child_end
+    return None
+
+
+def _meta_children_start(data, payload_start, end):
+    """
+    Returns the offset of the first child of a meta box.
+
+    ISO base media files store a version and flags in front of the children,
+    whereas QuickTime files do not.
+    """
+    if payload_start + 8 <= end and data[payload_start + 4:payload_start + 8] == b'hdlr':
+        return payload_start
+    return payload_start + 4
+
+
+class _ItemList:
+    """
+    Represents the items of an iTunes-style metadata item list (``ilst``).
+
+    Items are stored as raw atoms, so items that are not modified are
+    written back unchanged.
+    """
+    def __init__(self, items=None):
+        self.items = items or []
+
+    @staticmethod
+    def parse(data, start, end):
+        return _ItemList([(item_type, bytes(data[item_start:item_end]))
+                          for item_type, item_start, _, item_end in _boxes(data, start, end)])
+
+    @staticmethod
+    def _value(item):
+        """
+        Returns the type indicator and value of the first data atom of an item.
+        """
+        data_box = _find_box(item, _BOX_HEADER.size, len(item), b'data')
+        if data_box is None:
+            return None, None
+        _, payload_start, end = data_box
+        type_indicator = struct.unpack_from('>L', item, payload_start)[0] & 0xFFFFFF
+        return type_indicator, item[payload_start + 8:end]
+
+    def get(self, ffmetadata_key):
+        if ffmetadata_key in _TEXT_ATOMS:
+            atom_type = _TEXT_ATOMS[ffmetadata_key]
+        elif ffmetadata_key in _INTEGER_ATOMS:
+            atom_type = _INTEGER_ATOMS[ffmetadata_key][0]
+        else:
+            atom_type = _NUMBER_ATOMS[ffmetadata_key][0]
+        for item_type, item in self.items:
+            if item_type != atom_type:
+                continue
+            type_indicator, value = _ItemList._value(item)
+            if value is None:
+                continue
+            if ffmetadata_key in _TEXT_ATOMS:
+                if type_indicator == _UTF8:
+                    return value.decode('utf-8', errors='replace')
+            elif ffmetadata_key in _INTEGER_ATOMS:
+                if value:
+                    return str(int.from_bytes(value, 'big', signed=True))
+            elif len(value) >= 6:
+                number, total = struct.unpack_from('>HH', value, 2)
+                return '%d/%d' % (number, total) if total else str(number)
+        return None
+
+    def set(self, ffmetadata_key, value):
+        if ffmetadata_key in _TEXT_ATOMS:
+            atom_type = _TEXT_ATOMS[ffmetadata_key]
+            type_indicator, payload = _UTF8, value.encode('utf-8')
+        elif ffmetadata_key in _INTEGER_ATOMS:
+            atom_type, size = _INTEGER_ATOMS[ffmetadata_key]
+            try:
+                type_indicator, payload = _SIGNED_INTEGER, int(value).to_bytes(size, 'big', signed=True)
+            except OverflowError:
+                raise ValueError('Invalid value for metadata key %r: %r' % (ffmetadata_key, value))
+        else:
+            atom_type, suffix = _NUMBER_ATOMS[ffmetadata_key]
+            number, _, total = value.partition('/')
+            type_indicator = _IMPLICIT
+            payload = struct.pack('>HHH', 0, int(number), int(total or 0)) + suffix
+        item = _box(atom_type, _box(b'data', struct.pack('>LL', type_indicator, 0) + payload))
+        self.items = [(item_type, existing_item) for item_type, existing_item in self.items
+                      if item_type != atom_type]
+        self.items.append((atom_type, item))
+
+    def serialize(self):
+        return _box(b'ilst', b''.join(item for _, item in self.items))
+
+
+def _metadata_handler():
+    return _box(b'hdlr', struct.pack('>LL4s4sLLB', 0, 0, b'mdir', b'appl', 0, 0, 0))
+
+
+def _patch_chunk_offsets(moov, start, end, threshold, delta):
+    """
+    Shifts all chunk offsets in the sample tables of a movie box that are
+    greater than or equal to the threshold.
+
+    :param moov: Movie box
+    :type moov: bytearray
+    """
+    for box_type, box_start, payload_start, box_end in _boxes(moov, start, end):
+        if box_type in _SAMPLE_TABLE_PATH:
+            _patch_chunk_offsets(moov, payload_start, box_end, threshold, delta)
+        elif box_type in (b'stco', b'co64'):
+            entry_format = 'L' if box_type == b'stco' else 'Q'
+            entry_count = struct.unpack_from('>L', moov, payload_start + 4)[0]
+            entries_format = '>%d%s' % (entry_count, entry_format)
+            offsets = struct.unpack_from(entries_format, moov, payload_start + 8)
+            offsets = [offset + delta if offset >= threshold else offset for offset in offsets]
+            try:
+                struct.pack_into(entries_format, moov, payload_start + 8, *offsets)
+            except struct.error:
+                raise UnsupportedFormatError('Chunk offsets exceed the range of the %r box.' % box_type)
+
+
+def _file_boxes(file, start, end):
+    """
+    Yields the type, start, payload start, and end of all top-level boxes in
+    the specified range of a file.
+
+    Only the box headers are read.
+    """
+    position = start
+    while position + _BOX_HEADER.size <= end:
+        file.seek(position)
+        size, box_type = _BOX_HEADER.unpack(file.read(_BOX_HEADER.size))
+        payload_start = position + _BOX_HEADER.size
+        if size == 1:
+            if payload_start + _LARGE_SIZE.size > end:
+                break
+            size = _LARGE_SIZE.unpack(file.read(_LARGE_SIZE.size))[0]
+            payload_start += _LARGE_SIZE.size
+        elif size == 0:
+            size = end - position
+        if size < payload_start - position or position + size > end:
+            raise UnsupportedFormatError('Invalid %r box at offset %d.' % (box_type, position))
+        yield box_type, position, payload_start, position + size
+        position += size
+
+
+def _copy_range(source, destination, start, end, buffer_size=64*1024):
+    """
+    Copies the specified range of a file to another file.
+    """
+    source.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        buffer = source.read(min(buffer_size, remaining))
+        if not buffer:
+            raise UnsupportedFormatError('Unexpected end of file.')
+        destination.write(buffer)
+        remaining -= len(buffer)
+
+
+class _Movie:
+    """
+    Represents the movie box (``moov``) of an ISO base media file.
+
+    Only the movie box is read into memory. The other boxes, e.g. the media
+    data, are copied from the file when the movie is spliced.
+    """
+    def __init__(self, file):
+        self.file = file
+        file.seek(0, io.SEEK_END)
+        self.top_level_boxes = list(_file_boxes(file, 0, file.tell()))
+        if not self.top_level_boxes or self.top_level_boxes[0][0] not in (b'ftyp', b'moov', b'wide', b'free'):
+            raise UnsupportedFormatError('Unknown file format.')
+        for box_index, (box_type, box_start, payload_start, box_end) in enumerate(self.top_level_boxes):
+            if box_type == b'moov':
+                self.index = box_index
+                self.start, self.end = box_start, box_end
+                break
+        else:
+            raise UnsupportedFormatError('Missing movie box.')
+        file.seek(self.start)
+        self.data = memoryview(file.read(self.end - self.start))
+        # Offsets of the movie box payload in data
+        self.payload_start = payload_start - box_start
+        self.payload_end = len(self.data)
+
+    def has_video_track(self):
+        data = self.data
+        for box_type, _, payload_start, box_end in _boxes(data, self.payload_start, self.payload_end):
+            if box_type != b'trak':
+                continue
+            mdia = _find_box(data, payload_start, box_end, b'mdia')
+            if mdia is None:
+                continue
+            hdlr = _find_box(data, mdia[1], mdia[2], b'hdlr')
+            if hdlr is not None and data[hdlr[1] + 8:hdlr[1] + 12] == b'vide':
+                return True
+        return False
+
+    def item_list(self):
+        """
+        Returns the metadata item list, or None if the movie has no metadata.
+        """
+        data = self.data
+        udta = _find_box(data, self.payload_start, self.payload_end, b'udta')
+        if udta is None:
+            return None
+        meta = _find_box(data, udta[1], udta[2], b'meta')
+        if meta is None:
+            return None
+        ilst = _find_box(data, _meta_children_start(data, meta[1], meta[2]), meta[2], b'ilst')
+        if ilst is None:
+            return None
+        return _ItemList.parse(data, ilst[1], ilst[2])
+
+    def without_user_data(self):
+        """
+        Returns the payload of the movie box without user data.
+        """
+        return b''.join(self.data[box_start:box_end]
+                        for box_type, box_start, _, box_end in _boxes(self.data, self.payload_start, self.payload_end)
+                        if box_type != b'udta')
+
+    def with_item_list(self, item_list):
+        """
+        Returns the payload of the movie box with the specified metadata item
+        list.
+        """
+        data = self.data
+        ilst = item_list.serialize()
+        moov_parts = []
+        udta_found = False
+        for box_type, box_start, payload_start, box_end in _boxes(data, self.payload_start, self.payload_end):
+            if box_type != b'udta':
+                moov_parts.append(data[box_start:box_end])
+                continue
+            udta_found = True
+            udta_parts = []
+            meta_found = False
+            for child_type, child_start, child_payload_start, child_end in _boxes(data, payload_start, box_end):
+                if child_type != b'meta':
+                    udta_parts.append(data[child_start:child_end])
+                    continue
+                meta_found = True
+                children_start = _meta_children_start(data, child_payload_start, child_end)
+                meta_parts = [data[child_payload_start:children_start]]
+                ilst_found = False
+                for item_type, item_start, _, item_end in _boxes(data, children_start, child_end):
+                    if item_type == b'ilst':
+                        ilst_found = True
+                        meta_parts.append(ilst)
+                    else:
+                        meta_parts.append(data[item_start:item_end])
+                if not ilst_found:
+                    meta_parts.append(ilst)
+                udta_parts.append(_box(b'meta', b''.join(meta_parts)))
+            if not meta_found:
+                udta_parts.append(_box(b'meta', b'\x00\x00\x00\x00' + _metadata_handler() + ilst))
+            moov_parts.append(_box(b'udta', b''.join(udta_parts)))
+        if not udta_found:
+            moov_parts.append(_box(b'udta', _box(b'meta', b'\x00\x00\x00\x00' + _metadata_handler() + ilst)))
+        return b''.join(moov_parts)
+
+    def splice(self, moov_payload):
+        """
+        Returns the file data with a new movie box payload.
+
+        If the size of the movie box changes, a free box that follows the
+        movie box absorbs the difference. Otherwise, the chunk offsets of
+        media data that follows the movie box are shifted.
+        """
+        moov = bytearray(_box(b'moov', moov_payload))
+        delta = len(moov) - (self.end - self.start)
+        tail_start = self.end
+        following_boxes = self.top_level_boxes[self.index + 1:]
+
+        if delta and following_boxes and following_boxes[0][0] in _FREE_BOX_TYPES:
+            _, free_start, _, free_end = following_boxes[0]
+            free_size = free_end - free_start
+            if free_size - delta == 0 or _BOX_HEADER.size <= free_size - delta <= 0xFFFFFFFF:
+                tail_start = free_end
+                if free_size != delta:
+                    moov += _box(b'free', bytes(free_size - delta - _BOX_HEADER.size))
+                delta = 0
+
+        if delta and any(box[0] in _FRAGMENT_BOX_TYPES for box in following_boxes):
+            raise UnsupportedFormatError('Fragmented files cannot be resized.')
+        if delta and following_boxes:
+            _patch_chunk_offsets(moov, _BOX_HEADER.size, len(moov), self.end, delta)
+
+        result = io.BytesIO()
+        _copy_range(self.file, result, 0, self.start)
+        result.write(moov)
+        self.file.seek(tail_start)
+        shutil.copyfileobj(self.file, result)
+        result.seek(0)
+        return result
+
+
+class MP4MetadataProcessor(MetadataProcessor):
+    """
+    Represents a metadata processor that reads and writes the iTunes-style
+    metadata items of MP4 and QuickTime files natively.
+
+    The processor uses the same metadata keys as
+    :class:`~madam.ffmpeg.FFmpegMetadataProcessor`. Only the movie box is
+    rewritten when metadata changes. Media data stays in place, and chunk
+    offsets are patched if the movie box precedes the media data.
+    """
+    metadata_keys = FFmpegMetadataProcessor.metadata_keys_by_mime_type[MimeType('video/quicktime')]
+
+    def __init__(self):
+        """
+        Initializes a new `MP4MetadataProcessor`.
+        """
+        super().__init__()
+
+    @property
+    def formats(self):
+        return 'ffmetadata',
+
+    @staticmethod
+    def __parse(file):
+        movie = _Movie(file)
+        if not movie.has_video_track():
+            raise UnsupportedFormatError('Unsupported metadata source.')
+        return movie
+
+    def read(self, file):
+        movie = MP4MetadataProcessor.__parse(file)
+
+        metadata = {}
+        item_list = movie.item_list()
+        if item_list is not None:
+            for metadata_key, ffmetadata_key in self.metadata_keys.items():
+                value = item_list.get(ffmetadata_key)
+                if value is not None:
+                    metadata[metadata_key] = value
+
+        return {'ffmetadata': metadata}
+
+    def strip(self, file):
+        movie = MP4MetadataProcessor.__parse(file)
+
+        return movie.splice(movie.without_user_data())
+
+    def combine(self, file, metadata_by_type):
+        movie = MP4MetadataProcessor.__parse(file)
+
+        # Validate provided metadata
+        if not metadata_by_type:
+            raise ValueError('No metadata provided')
+        if 'ffmetadata' not in metadata_by_type:
+            raise UnsupportedFormatError('Invalid metadata to be combined with essence: %r' %
+                                         (metadata_by_type.keys(),))
+        if not metadata_by_type['ffmetadata']:
+            raise ValueError('No metadata provided')
+
+        item_list = movie.item_list() or _ItemList()
+        for metadata_key, value in metadata_by_type['ffmetadata'].items():
+            ffmetadata_key = self.metadata_keys.get(metadata_key)
+            if ffmetadata_key is None:
+                raise ValueError('Unsupported metadata key: %r' % metadata_key)
+            item_list.set(ffmetadata_key, '%s' % value)
+
+        return movie.splice(movie.with_item_list(item_list))
@@ -0,0 +1,717 @@
+import struct
+
+
+def _read_at(file, offset, size):
+    file.seek(offset)
+    return file.read(size)
+
+
+def _file_size(file):
+    return file.seek(0, 2)
+
+
+def _format_duration(duration):
+    return '%.6f' % duration
+
+
+class _BitReader:
+    """
+    Reads single bits and Exp-Golomb codes from a byte string.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def read(self, bit_count):
+        value = 0
+        for _ in range(bit_count):
+            byte_index, bit_index = divmod(self.position, 8)
+            if byte_index >= len(self.data):
+                raise ValueError('Unexpected end of data')
+            value = value << 1 | self.data[byte_index] >> (7 - bit_index) & 1
+            self.position += 1
+        return value
+
+    def read_exp_golomb(self):
+        leading_zero_bits = 0
+        while not self.read(1):
+            leading_zero_bits += 1
+            if leading_zero_bits > 31:
+                raise ValueError('Invalid Exp-Golomb code')
+        return (1 << leading_zero_bits) - 1 + self.read(leading_zero_bits)
+
+
+# H.264 profiles whose sequence parameter set contains the chroma format and bit depth
+_H264_HIGH_PROFILES = frozenset([44, 83, 86, 100, 110, 118, 122, 128, 134, 135, 138, 139, 144, 244])
+_CHROMA_FORMATS = {0: 'yuv420p', 1: 'yuv420p', 2: 'yuv422p', 3: 'yuv444p'}
+
+
+def _pixel_format(chroma_format, bit_depth):
+    pixel_format = _CHROMA_FORMATS[chroma_format]
+    if bit_depth > 8:
+        pixel_format += '%dle' % bit_depth
+    return pixel_format
+
+
+def _h264_pixel_format(avc_configuration):
+    """
+    Returns the pixel format of an H.264 stream as reported by FFmpeg from
+    the first sequence parameter set of an AVC decoder configuration record.
+    """
+    if len(avc_configuration) < 8 or avc_configuration[0] != 1 or not avc_configuration[5] & 0x1F:
+        return None
+    sps_size = struct.unpack_from('>H', avc_configuration, 6)[0]
+    sps = avc_configuration[9:8 + sps_size].replace(b'\x00\x00\x03', b'\x00\x00')
+    try:
+        reader = _BitReader(sps)
+        profile = reader.read(8)
+        reader.read(16)
+        reader.read_exp_golomb()
+        if profile not in _H264_HIGH_PROFILES:
+            return _pixel_format(1, 8)
+        chroma_format = reader.read_exp_golomb()
+        if chroma_format == 3:
+            reader.read(1)
+        bit_depth = reader.read_exp_golomb() + 8
+        return _pixel_format(chroma_format, bit_depth)
+    except (KeyError, ValueError):
+        return None
+
+
+def _vp9_pixel_format(codec_private):
+    """
+    Returns the pixel format of a VP9 stream from the codec features of a
+    Matroska track.
+    """
+    features = {}
+    position = 0
+    while position + 2 <= len(codec_private):
+        feature_id, size = codec_private[position], codec_private[position + 1]
+        features[feature_id] = codec_private[position + 2:position + 2 + size]
+        position += 2 + size
+    if 3 not in features or 4 not in features:
+        return None
+    bit_depth = features[3][0]
+    chroma_format = {0: 1, 1: 1, 2: 2, 3: 3}.get(features[4][0])
+    if chroma_format is None:
+        return None
+    return _pixel_format(chroma_format, bit_depth)
+
+
+def _probe_wav(file):
+    header = _read_at(file, 0, 12)
+    if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        return None
+
+    file_size = _file_size(file)
+    fmt = None
+    data_size = None
+    offset = 12
+    while offset + 8 <= file_size and (fmt is None or data_size is None):
+        chunk_id, chunk_size = struct.unpack('<4sL', _read_at(file, offset, 8))
+        if chunk_id == b'fmt ':
+            fmt = _read_at(file, offset + 8, min(chunk_size, 40))
+        elif chunk_id == b'data':
+            data_size = min(chunk_size, file_size - offset - 8)
+        offset += 8 + chunk_size + chunk_size % 2
+    if fmt is None or len(fmt) < 16 or data_size is None:
+        return None
+
+    format_tag, channels, sample_rate, _, block_align, bits = struct.unpack_from('<HHLLHH', fmt)
+    if format_tag == 0xFFFE and len(fmt) >= 26:
+        format_tag = struct.unpack_from('<H', fmt, 24)[0]
+    if format_tag == 1:
+        codec = {8: 'pcm_u8', 16: 'pcm_s16le', 24: 'pcm_s24le', 32: 'pcm_s32le'}.get(bits)
+    elif format_tag == 3:
+        codec = {32: 'pcm_f32le', 64: 'pcm_f64le'}.get(bits)
+    elif format_tag in (6, 7):
+        codec, bits = 'pcm_alaw' if format_tag == 6 else 'pcm_mulaw', 8
+    else:
+        codec = None
+    if codec is None or not sample_rate or not block_align:
+        return None
+
+    return dict(
+        format=dict(format_name='wav', duration=_format_duration(data_size//block_align/sample_rate)),
+        streams=[dict(codec_type='audio', codec_name=codec, bit_rate='%d' % (sample_rate*channels*bits))],
+    )
+
+
+_MPEG_AUDIO_BITRATES = {
+    (3, 3): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (3, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (3, 1): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 3): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 1): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MPEG_AUDIO_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+_MPEG_AUDIO_CODECS = {1: 'mp3', 2: 'mp2', 3: 'mp1'}
+_MPEG_AUDIO_SYNC_SEARCH_SIZE = 65536
+
+
+def _probe_mp3(file):
+    header = _read_at(file, 0, 10)
+    audio_start = 0
+    if header[:3] == b'ID3' and len(header) == 10:
+        size = header[6] << 21 | header[7] << 14 | header[8] << 7 | header[9]
+        audio_start = 10 + size + (10 if header[5] & 0x10 else 0)
+
+    data = _read_at(file, audio_start, _MPEG_AUDIO_SYNC_SEARCH_SIZE)
+    # Untagged files must start with a frame, tagged files may contain junk before the first frame
+    position = 0 if data[:1] == b'\xff' or audio_start else -1
+    while 0 <= position <= len(data) - 4:
+        version = data[position + 1] >> 3 & 3
+        layer = data[position + 1] >> 1 & 3
+        bitrate_index = data[position + 2] >> 4
+        sample_rate_index = data[position + 2] >> 2 & 3
+        if data[position] == 0xFF and data[position + 1] & 0xE0 == 0xE0 and version != 1 and layer and \
+                0 < bitrate_index < 15 and sample_rate_index != 3:
+            break
+        if not audio_start:
+            return None
+        position = data.find(b'\xff', position + 1)
+    else:
+        return None
+
+    bitrate = _MPEG_AUDIO_BITRATES[(3 if version == 3 else 2, layer)][bitrate_index]*1000
+    sample_rate = _MPEG_AUDIO_SAMPLE_RATES[version][sample_rate_index]
+    samples_per_frame = 384 if layer == 3 else 1152 if layer == 2 or version == 3 else 576
+    mono = data[position + 3] >> 6 == 3
+
+    # Look for a Xing/Info or VBRI header in the first frame
+    if layer == 1:
+        side_info_size = (17 if mono else 32) if version == 3 else (9 if mono else 17)
+    else:
+        side_info_size = 0
+    xing_offset = position + 4 + side_info_size
+    frame_count = None
+    byte_count = None
+    is_cbr = True
+    if layer == 1 and data[xing_offset:xing_offset + 4] in (b'Xing', b'Info'):
+        is_cbr = data[xing_offset:xing_offset + 4] == b'Info'
+        flags = struct.unpack_from('>L', data, xing_offset + 4)[0]
+        field_offset = xing_offset + 8
+        if flags & 1:
+            frame_count = struct.unpack_from('>L', data, field_offset)[0]
+            field_offset += 4
+        if flags & 2:
+            byte_count = struct.unpack_from('>L', data, field_offset)[0]
+    elif data[position + 36:position + 40] == b'VBRI':
+        byte_count, frame_count = struct.unpack_from('>LL', data, position + 46)
+        is_cbr = False
+
+    if frame_count:
+        duration = frame_count*samples_per_frame/sample_rate
+        if byte_count and not is_cbr:
+            bitrate = byte_count*8*sample_rate//(frame_count*samples_per_frame)
+    else:
+        audio_end = _file_size(file)
+        if _read_at(file, audio_end - 128, 3) == b'TAG':
+            audio_end -= 128
+        duration = (audio_end - audio_start - position)*8/bitrate
+
+    return dict(
+        format=dict(format_name='mp3', duration=_format_duration(duration)),
+        streams=[dict(codec_type='audio', codec_name=_MPEG_AUDIO_CODECS[layer], bit_rate='%d' % bitrate)],
+    )
+
+
+_OGG_PAGE_HEADER = struct.Struct('<4sBBqLLLB')
+_OGG_MAX_PAGE_SIZE = _OGG_PAGE_HEADER.size + 255 + 255*255
+_OGG_TAIL_SEARCH_SIZE = 1 << 20
+
+
+def _ogg_page(data, offset):
+    """
+    Returns the header type, granule position, serial number, and first
+    packet data of the Ogg page at the specified offset.
+    """
+    if offset + _OGG_PAGE_HEADER.size > len(data):
+        return None
+    capture_pattern, version, header_type, granule_position, serial, _, _, segment_count = \
+        _OGG_PAGE_HEADER.unpack_from(data, offset)
+    if capture_pattern != b'OggS' or version != 0:
+        return None
+    lacing_values = data[offset + _OGG_PAGE_HEADER.size:offset + _OGG_PAGE_HEADER.size + segment_count]
+    data_offset = offset + _OGG_PAGE_HEADER.size + segment_count
+    packet_size = 0
+    for lacing_value in lacing_values:
+        packet_size += lacing_value
+        if lacing_value < 255:
+            break
+    return header_type, granule_position, serial, data[data_offset:data_offset + packet_size], \
+        data_offset + sum(lacing_values)
+
+
+def _ogg_stream(packet):
+    """
+    Returns the probe information of an Ogg logical stream and a function
+    that converts granule positions to seconds.
+    """
+    if packet[:8] == b'OpusHead' and len(packet) >= 19:
+        pre_skip = struct.unpack_from('<H', packet, 10)[0]
+        return dict(codec_type='audio', codec_name='opus'), lambda granule: (granule - pre_skip)/48000
+    if packet[:7] == b'\x01vorbis' and len(packet) >= 30:
+        sample_rate, _, nominal_bitrate = struct.unpack_from('<Lll', packet, 12)
+        stream = dict(codec_type='audio', codec_name='vorbis')
+        if nominal_bitrate > 0:
+            stream['bit_rate'] = '%d' % nominal_bitrate
+        return stream, lambda granule: granule/sample_rate
+    if packet[:7] == b'\x80theora' and len(packet) >= 42:
+        width = int.from_bytes(packet[14:17], 'big')
+        height = int.from_bytes(packet[17:20], 'big')
+        frame_rate_numerator, frame_rate_denominator = struct.unpack_from('>LL', packet, 22)
+        granule_shift = (packet[40] & 0x03) << 3 | packet[41] >> 5
+        pixel_format = {0: 1, 2: 2, 3: 3}.get(packet[41] >> 3 & 0x03)
+        if pixel_format is None or not frame_rate_numerator:
+            return None, None
+        stream = dict(codec_type='video', codec_name='theora', width=width, height=height,
+                      pix_fmt=_pixel_format(pixel_format, 8))
+
+        def granule_to_seconds(granule):
+            frames = (granule >> granule_shift) + (granule & (1 << granule_shift) - 1)
+            return frames*frame_rate_denominator/frame_rate_numerator
+        return stream, granule_to_seconds
+    return None, None
+
+
+def _probe_ogg(file):
+    data = _read_at(file, 0, _OGG_MAX_PAGE_SIZE*2)
+    streams = []
+    granule_converters = {}
+    offset = 0
+    while True:
+        page = _ogg_page(data, offset)
+        if page is None:
+            return None
+        header_type, _, serial, packet, offset = page
+        if not header_type & 0x02:
+            break
+        stream, granule_to_seconds = _ogg_stream(packet)
+        if stream is None:
+            return None
+        streams.append(stream)
+        granule_converters[serial] = granule_to_seconds
+    if not streams:
+        return None
+
+    # Find the last granule position of each stream
+    file_size = _file_size(file)
+    durations = {}
+    search_end = file_size
+    while len(durations) < len(granule_converters) and search_end > 0 and \
+            file_size - search_end < _OGG_TAIL_SEARCH_SIZE:
+        search_start = max(0, search_end - _OGG_MAX_PAGE_SIZE)
+        tail = _read_at(file, search_start, file_size - search_start)
+        offset = tail.rfind(b'OggS', 0, search_end - search_start)
+        while offset >= 0:
+            page = _ogg_page(tail, offset)
+            if page is not None:
+                _, granule_position, serial, _, _ = page
+                if serial in granule_converters and serial not in durations and granule_position != -1:
+                    durations[serial] = granule_converters[serial](granule_position)
+            offset = tail.rfind(b'OggS', 0, offset)
+        search_end = search_start
+    if len(durations) < len(granule_converters):
+        return None
+
+    return dict(
+        format=dict(format_name='ogg', duration=_format_duration(max(durations.values()))),
+        streams=streams,
+    )
+
+
+_ISOBMFF_BOX_HEADER = struct.Struct('>L4s')
+_ISOBMFF_CONTAINERS = frozenset([b'trak', b'mdia', b'minf', b'stbl'])
+_ISOBMFF_HANDLER_TYPES = {b'vide': 'video', b'soun': 'audio', b'sbtl': 'subtitle', b'text': 'subtitle',
+                          b'subt': 'subtitle'}
+_ISOBMFF_CODECS = {b'avc1': 'h264', b'avc3': 'h264', b'tx3g': 'mov_text', b'ac-3': 'ac3', b'Opus': 'opus',
+                   b'fLaC': 'flac', b'.mp3': 'mp3'}
+_MPEG4_OBJECT_TYPES = {0x40: 'aac', 0x66: 'aac', 0x67: 'aac', 0x68: 'aac', 0x69: 'mp3', 0x6B: 'mp3'}
+
+
+def _isobmff_boxes(data, start=0, end=None):
+    end = len(data) if end is None else end
+    position = start
+    while position + _ISOBMFF_BOX_HEADER.size <= end:
+        size, box_type = _ISOBMFF_BOX_HEADER.unpack_from(data, position)
+        header_size = _ISOBMFF_BOX_HEADER.size
+        if size == 1:
+            size = struct.unpack_from('>Q', data, position + header_size)[0]
+            header_size += 8
+        elif size == 0:
+            size = end - position
+        if size < header_size:
+            raise ValueError('Invalid box size')
+        yield box_type, data[position + header_size:position + size]
+        position += size
+
+
+def _isobmff_children(data):
+    return dict(_isobmff_boxes(data))
+
+
+def _mpeg4_descriptor(data, offset):
+    """
+    Returns the tag, payload offset, and payload size of an MPEG-4
+    descriptor.
+    """
+    tag = data[offset]
+    size = 0
+    offset += 1
+    for _ in range(4):
+        size = size << 7 | data[offset] & 0x7F
+        offset += 1
+        if not data[offset - 1] & 0x80:
+            break
+    return tag, offset, size
+
+
+def _esds_codec_and_bitrate(esds):
+    """
+    Returns the codec name and average bitrate of an elementary stream
+    descriptor box.
+    """
+    tag, offset, _ = _mpeg4_descriptor(esds, 4)
+    if tag != 0x03:
+        return None, 0
+    flags = esds[offset + 2]
+    offset += 3
+    if flags & 0x80:
+        offset += 2
+    if flags & 0x40:
+        offset += 1 + esds[offset]
+    if flags & 0x20:
+        offset += 2
+    tag, offset, _ = _mpeg4_descriptor(esds, offset)
+    if tag != 0x04:
+        return None, 0
+    object_type = esds[offset]
+    average_bitrate = struct.unpack_from('>L', esds, offset + 9)[0]
+    return _MPEG4_OBJECT_TYPES.get(object_type), average_bitrate
+
+
+def _isobmff_stream(trak):
+    mdia = _isobmff_children(_isobmff_children(trak)[b'mdia'])
+    mdhd = mdia[b'mdhd']
+    if mdhd[0] == 1:
+        timescale, duration = struct.unpack_from('>LQ', mdhd, 20)
+    else:
+        timescale, duration = struct.unpack_from('>LL', mdhd, 12)
+    codec_type = _ISOBMFF_HANDLER_TYPES.get(mdia[b'hdlr'][8:12])
+    if codec_type is None:
+        return {}
+    stbl = _isobmff_children(_isobmff_children(mdia[b'minf'])[b'stbl'])
+
+    stsd = stbl[b'stsd']
+    entry_size, entry_type = _ISOBMFF_BOX_HEADER.unpack_from(stsd, 8)
+    entry = stsd[24:8 + entry_size]
+    stream = dict(codec_type=codec_type)
+    codec = _ISOBMFF_CODECS.get(entry_type)
+    bitrate = 0
+    if codec_type == 'video':
+        width, height = struct.unpack_from('>HH', entry, 16)
+        stream.update(width=width, height=height)
+        entry_children = _isobmff_children(entry[70:])
+        if codec == 'h264':
+            stream['pix_fmt'] = _h264_pixel_format(entry_children.get(b'avcC', b''))
+            if stream['pix_fmt'] is None:
+                return None
+    elif codec_type == 'audio':
+        sound_version = struct.unpack_from('>H', entry, 0)[0]
+        entry_children = _isobmff_children(entry[{0: 20, 1: 36, 2: 56}.get(sound_version, 20):])
+        if b'wave' in entry_children:
+            entry_children = _isobmff_children(entry_children[b'wave'])
+        if entry_type == b'mp4a' and b'esds' in entry_children:
+            codec, bitrate = _esds_codec_and_bitrate(entry_children[b'esds'])
+    if codec is None:
+        return None
+    stream['codec_name'] = codec
+
+    if not bitrate and timescale and duration:
+        stsz = stbl.get(b'stsz', b'')
+        if len(stsz) >= 12:
+            sample_size, sample_count = struct.unpack_from('>LL', stsz, 4)
+            if sample_size:
+                stream_size = sample_size*sample_count
+            else:
+                stream_size = sum(struct.unpack_from('>%dL' % sample_count, stsz, 12))
+            bitrate = stream_size*8*timescale//duration
+    if bitrate:
+        stream['bit_rate'] = '%d' % bitrate
+    return stream
+
+
+def _probe_isobmff(file):
+    file_size = _file_size(file)
+    moov = None
+    offset = 0
+    first_box = True
+    while offset + 8 <= file_size:
+        size, box_type = _ISOBMFF_BOX_HEADER.unpack(_read_at(file, offset, 8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', file.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - offset
+        if first_box and box_type not in (b'ftyp', b'moov', b'wide', b'free', b'mdat'):
+            return None
+        first_box = False
+        if size < header_size:
+            return None
+        if box_type == b'moov':
+            moov = _read_at(file, offset + header_size, size - header_size)
+            break
+        offset += size
+    if moov is None:
+        return None
+
+    streams = []
+    duration = None
+    for box_type, payload in _isobmff_boxes(moov):
+        if box_type == b'mvhd':
+            if payload[0] == 1:
+                timescale, mvhd_duration = struct.unpack_from('>LQ', payload, 20)
+            else:
+                timescale, mvhd_duration = struct.unpack_from('>LL', payload, 12)
+            if timescale:
+                duration = mvhd_duration/timescale
+        elif box_type == b'trak':
+            stream = _isobmff_stream(payload)
+            if stream is None:
+                return None
+            if stream:
+                streams.append(stream)
+
+    probe_data = dict(format=dict(format_name='mov,mp4,m4a,3gp,3g2,mj2'), streams=streams)
+    if duration is not None:
+        probe_data['format']['duration'] = _format_duration(duration)
+    return probe_data
+
+
+_EBML_HEADER = 0x1A45DFA3
+_EBML_DOC_TYPE = 0x4282
+_MATROSKA_SEGMENT = 0x18538067
+_MATROSKA_SEEK_HEAD = 0x114D9B74
+_MATROSKA_SEEK = 0x4DBB
+_MATROSKA_SEEK_ID = 0x53AB
+_MATROSKA_SEEK_POSITION = 0x53AC
+_MATROSKA_INFO = 0x1549A966
+_MATROSKA_TIMESTAMP_SCALE = 0x2AD7B1
+_MATROSKA_DURATION = 0x4489
+_MATROSKA_TRACKS = 0x1654AE6B
+_MATROSKA_TRACK_ENTRY = 0xAE
+_MATROSKA_TRACK_TYPE = 0x83
+_MATROSKA_CODEC_ID = 0x86
+_MATROSKA_CODEC_PRIVATE = 0x63A2
+_MATROSKA_VIDEO = 0xE0
+_MATROSKA_PIXEL_WIDTH = 0xB0
+_MATROSKA_PIXEL_HEIGHT = 0xBA
+_MATROSKA_AUDIO = 0xE1
+_MATROSKA_BIT_DEPTH = 0x6264
+_MATROSKA_CLUSTER = 0x1F43B675
+_MATROSKA_TRACK_TYPES = {1: 'video', 2: 'audio', 0x11: 'subtitle'}
+_MATROSKA_CODECS = {
+    'A_AAC': 'aac',
+    'A_AC3': 'ac3',
+    'A_FLAC': 'flac',
+    'A_MPEG/L2': 'mp2',
+    'A_MPEG/L3': 'mp3',
+    'A_OPUS': 'opus',
+    'A_VORBIS': 'vorbis',
+    'D_WEBVTT/SUBTITLES': 'webvtt',
+    'S_TEXT/ASS': 'ass',
+    'S_TEXT/UTF8': 'subrip',
+    'S_TEXT/WEBVTT': 'webvtt',
+    'V_AV1': 'av1',
+    'V_MPEG4/ISO/AVC': 'h264',
+    'V_MPEGH/ISO/HEVC': 'hevc',
+    'V_THEORA': 'theora',
+    'V_VP8': 'vp8',
+    'V_VP9': 'vp9',
+}
+
+
+def _ebml_vint(data, offset, keep_marker=False):
+    """
+    Returns the value and the end offset of an EBML variable-size integer.
+    A value of None represents an unknown size.
+    """
+    first_byte = data[offset]
+    length = 1
+    while length <= 8 and not first_byte & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8 or offset + length > len(data):
+        raise ValueError('Invalid EBML variable-size integer')
+    value = int.from_bytes(data[offset:offset + length], 'big')
+    if not keep_marker:
+        value &= (1 << (7*length)) - 1
+        if value == (1 << (7*length)) - 1:
+            value = None
+    return value, offset + length
+
+
+def _ebml_elements(data):
+    offset = 0
+    while offset < len(data):
+        element_id, offset = _ebml_vint(data, offset, keep_marker=True)
+        size, offset = _ebml_vint(data, offset)
+        if size is None:
+            size = len(data) - offset
+        yield element_id, data[offset:offset + size]
+        offset += size
+
+
+def _ebml_uint(data):
+    return int.from_bytes(data, 'big')
+
+
+def _ebml_float(data):
+    return struct.unpack('>f' if len(data) == 4 else '>d', data)[0]
+
+
+def _matroska_stream(track_entry):
+    elements = dict(_ebml_elements(track_entry))
+    codec_type = _MATROSKA_TRACK_TYPES.get(_ebml_uint(elements.get(_MATROSKA_TRACK_TYPE, b'')))
+    if codec_type is None:
+        return {}
+    codec_id = elements.get(_MATROSKA_CODEC_ID, b'').decode('ascii', errors='replace')
+    codec = _MATROSKA_CODECS.get(codec_id)
+    if codec is None and codec_id.startswith('A_AAC'):
+        codec = 'aac'
+    elif codec is None and codec_id == 'A_PCM/INT/LIT':
+        audio = dict(_ebml_elements(elements.get(_MATROSKA_AUDIO, b'')))
+        bit_depth = _ebml_uint(audio.get(_MATROSKA_BIT_DEPTH, b''))
+        codec = {8: 'pcm_u8', 16: 'pcm_s16le', 24: 'pcm_s24le', 32: 'pcm_s32le'}.get(bit_depth)
+    if codec is None:
+        return None
+    stream = dict(codec_type=codec_type, codec_name=codec)
+
+    if codec_type == 'video':
+        video = dict(_ebml_elements(elements.get(_MATROSKA_VIDEO, b'')))
+        stream.update(width=_ebml_uint(video.get(_MATROSKA_PIXEL_WIDTH, b'')),
+                      height=_ebml_uint(video.get(_MATROSKA_PIXEL_HEIGHT, b'')))
+        codec_private = elements.get(_MATROSKA_CODEC_PRIVATE, b'')
+        if codec in ('vp8', 'theora'):
+            stream['pix_fmt'] = _pixel_format(1, 8)
+        elif codec == 'vp9':
+            stream['pix_fmt'] = _vp9_pixel_format(codec_private)
+        elif codec == 'h264':
+            stream['pix_fmt'] = _h264_pixel_format(codec_private)
+        else:
+            stream['pix_fmt'] = None
+        if stream['pix_fmt'] is None:
+            return None
+    return stream
+
+
+def _probe_matroska(file):
+    header = _read_at(file, 0, 4096)
+    if header[:4] != b'\x1a\x45\xdf\xa3':
+        return None
+    header_size, offset = _ebml_vint(header, 4)
+    ebml_header = dict(_ebml_elements(header[offset:offset + header_size]))
+    if ebml_header.get(_EBML_DOC_TYPE) not in (b'matroska', b'webm'):
+        return None
+    offset += header_size
+
+    file_size = _file_size(file)
+    segment_header = _read_at(file, offset, 12)
+    segment_id, position = _ebml_vint(segment_header, 0, keep_marker=True)
+    if segment_id != _MATROSKA_SEGMENT:
+        return None
+    segment_size, position = _ebml_vint(segment_header, position)
+    segment_start = offset + position
+    segment_end = file_size if segment_size is None else min(file_size, segment_start + segment_size)
+
+    # Read the top-level elements of the segment until the first cluster
+    elements = {}
+    offset = segment_start
+    while offset < segment_end and not (_MATROSKA_INFO in elements and _MATROSKA_TRACKS in elements):
+        element_header = _read_at(file, offset, 12)
+        element_id, position = _ebml_vint(element_header, 0, keep_marker=True)
+        element_size, position = _ebml_vint(element_header, position)
+        if element_id == _MATROSKA_CLUSTER or element_size is None:
+            break
+        if element_id in (_MATROSKA_SEEK_HEAD, _MATROSKA_INFO, _MATROSKA_TRACKS) and element_id not in elements:
+            elements[element_id] = _read_at(file, offset + position, element_size)
+        offset += position + element_size
+
+    # Locate missing elements using the seek head
+    for seek_element_id, seek in _ebml_elements(elements.get(_MATROSKA_SEEK_HEAD, b'')):
+        if seek_element_id != _MATROSKA_SEEK:
+            continue
+        seek = dict(_ebml_elements(seek))
+        element_id = _ebml_uint(seek.get(_MATROSKA_SEEK_ID, b''))
+        if element_id in (_MATROSKA_INFO, _MATROSKA_TRACKS) and element_id not in elements:
+            offset = segment_start + _ebml_uint(seek.get(_MATROSKA_SEEK_POSITION, b''))
+            element_header = _read_at(file, offset, 12)
+            found_id, position = _ebml_vint(element_header, 0, keep_marker=True)
+            element_size, position = _ebml_vint(element_header, position)
+            if found_id == element_id and element_size is not None:
+                elements[element_id] = _read_at(file, offset + position, element_size)
+    if _MATROSKA_INFO not in elements or _MATROSKA_TRACKS not in elements:
+        return None
+
+    info = dict(_ebml_elements(elements[_MATROSKA_INFO]))
+    streams = []
+    for element_id, track_entry in _ebml_elements(elements[_MATROSKA_TRACKS]):
+        if element_id != _MATROSKA_TRACK_ENTRY:
+            continue
+        stream = _matroska_stream(track_entry)
+        if stream is None:
+            return None
+        if stream:
+            streams.append(stream)
+
+    probe_data = dict(format=dict(format_name='matroska,webm'), streams=streams)
+    if _MATROSKA_DURATION in info:
+        timestamp_scale = _ebml_uint(info.get(_MATROSKA_TIMESTAMP_SCALE, b'')) or 1000000
+        duration = _ebml_float(info[_MATROSKA_DURATION])*timestamp_scale/1e9
+        probe_data['format']['duration'] = _format_duration(duration)
+    return probe_data
+
+
+_PROBES = (
+    (b'RIFF', _probe_wav),
+    (b'OggS', _probe_ogg),
+    (b'\x1a\x45\xdf\xa3', _probe_matroska),
+    (b'', _probe_isobmff),
+    (b'', _probe_mp3),
+)
+
+
+def probe(file):
+    """
+    Returns information on the container format and the streams of the
+    specified file by parsing its headers.
+
+    The result has the same structure as the JSON output of ffprobe with
+    the ``-show_format`` and ``-show_streams`` options, but only contains
+    the format name, the duration, and the codec, size, bitrate and pixel
+    format of each stream.
+
+    Supported formats are WAV, MP3, Ogg, ISO base media files (MP4,
+    QuickTime), and Matroska. None is returned if the format is not
+    supported or if the file contains streams whose properties cannot be
+    determined from the headers.
+
+    :param file: file-like object to be parsed
+    :type file: file-like object
+    :return: Probe information, or None
+    :rtype: dict or None
+    """
+    try:
+        signature = _read_at(file, 0, 4)
+        for prefix, probe_format in _PROBES:
+            if signature.startswith(prefix):
+                probe_data = probe_format(file)
+                if probe_data is not None:
+                    return probe_data
+        return None
+    except (IndexError, KeyError, ValueError, ZeroDivisionError, struct.error):
+        return None
+    finally:
+        file.seek(0)
@@ -0,0 +1,601 @@
+import functools
+import io
+import re
+import struct
+
+from madam.core import MetadataProcessor, UnsupportedFormatError
+from madam.ffmpeg import FFmpegMetadataProcessor
+from madam.mime import MimeType
+
+
+def _decode_syncsafe(data):
+    return (data[0] & 0x7F) << 21 | (data[1] & 0x7F) << 14 | (data[2] & 0x7F) << 7 | (data[3] & 0x7F)
+
+
+def _encode_syncsafe(value):
+    if value >= 1 << 28:
+        raise ValueError('Value too large for ID3v2 tag: %d' % value)
+    return bytes([value >> 21 & 0x7F, value >> 14 & 0x7F, value >> 7 & 0x7F, value & 0x7F])
+
+
+_ID3_HEADER = struct.Struct('>3sBBB4s')
+_ID3_FRAME_HEADER = struct.Struct('>4s4sH')
+_ID3_FRAME_ID_PATTERN = re.compile(r'^[A-Z][A-Z0-9]{3}$')
+_ID3_ENCODINGS = {0: 'latin-1', 1: 'utf-16', 2: 'utf-16-be', 3: 'utf-8'}
+_ID3V1_SIZE = 128
+
+# Frame IDs of FFmpeg metadata keys, see libavformat/id3v2.c
+_ID3_FRAME_IDS = {
+    'album': 'TALB',
+    'album-sort': 'TSOA',
+    'album_artist': 'TPE2',
+    'artist': 'TPE1',
+    'artist-sort': 'TSOP',
+    'compilation': 'TCMP',
+    'composer': 'TCOM',
+    'copyright': 'TCOP',
+    'creation_time': 'TDEN',
+    'date': 'TDRC',
+    'disc': 'TPOS',
+    'encoded_by': 'TENC',
+    'encoder': 'TSSE',
+    'genre': 'TCON',
+    'grouping': 'TIT1',
+    'language': 'TLAN',
+    'lyrics': 'USLT',
+    'performer': 'TPE3',
+    'publisher': 'TPUB',
+    'title': 'TIT2',
+    'title-sort': 'TSOT',
+    'track': 'TRCK',
+}
+
+# ID3v2.4 frames that replace ID3v2.3 frames
+_ID3V23_FRAME_IDS = {
+    'TDOR': 'TORY',
+    'TDRC': 'TYER',
+}
+_ID3V24_FRAME_IDS = {v: k for k, v in _ID3V23_FRAME_IDS.items()}
+
+
+class _ID3Tag:
+    """
+    Represents an ID3v2 tag at the beginning of an MP3 file.
+
+    Frames are kept as raw data, so frames that are not modified are
+    written back unchanged.
+    """
+    def __init__(self, version=4):
+        self.version = version
+        self.frames = []
+
+    @staticmethod
+    def parse(data):
+        """
+        Parses the ID3v2 tag at the beginning of the specified data.
+
+        :param data: MP3 data
+        :type data: memoryview
+        :return: Tuple of the parsed tag, or None, and the offset of the audio data
+        """
+        if len(data) < _ID3_HEADER.size or data[:3] != b'ID3':
+            return None, 0
+        _, version, _, flags, size_data = _ID3_HEADER.unpack_from(data)
+        tag_end = _ID3_HEADER.size + _decode_syncsafe(size_data)
+        if flags & 0x10:
+            tag_end += _ID3_HEADER.size
+        if tag_end > len(data):
+            raise UnsupportedFormatError('Truncated ID3v2 tag.')
+
+        tag = _ID3Tag(version)
+        if version not in (3, 4):
+            # ID3v2.2 frames are not supported and will be discarded
+            return tag, tag_end
+
+        body = bytes(data[_ID3_HEADER.size:_ID3_HEADER.size + _decode_syncsafe(size_data)])
+        if flags & 0x80 and version == 3:
+            body = body.replace(b'\xff\x00', b'\xff')
+        position = 0
+        if flags & 0x40:
+            if version == 3:
+                position = 4 + struct.unpack_from('>L', body)[0]
+            else:
+                position = _decode_syncsafe(body[:4])
+
+        while position + _ID3_FRAME_HEADER.size <= len(body):
+            frame_id, size_data, frame_flags = _ID3_FRAME_HEADER.unpack_from(body, position)
+            if not _ID3_FRAME_ID_PATTERN.match(frame_id.decode('latin-1')):
+                break
+            size = _decode_syncsafe(size_data) if version == 4 else struct.unpack('>L', size_data)[0]
+            position += _ID3_FRAME_HEADER.size
+            tag.frames.append((frame_id.decode('latin-1'), frame_flags, body[position:position + size]))
+            position += size
+        return tag, tag_end
+
+    def _frame_content(self, frame_flags, frame_data):
+        """
+        Returns the content of a frame without its format-specific extensions,
+        or None if the frame cannot be decoded.
+        """
+        if self.version == 4:
+            if frame_flags & 0x000C:
+                return None
+            if frame_flags & 0x0002:
+                frame_data = frame_data.replace(b'\xff\x00', b'\xff')
+            if frame_flags & 0x0001:
+                frame_data = frame_data[4:]
+        else:
+            if frame_flags & 0x00C0:
+                return None
+            if frame_flags & 0x0020:
+                frame_data = frame_data[1:]
+        return frame_data
+
+    @staticmethod
+    def _decode_text(data):
+        if not data or data[0] not in _ID3_ENCODINGS:
+            return []
+        text = data[1:].decode(_ID3_ENCODINGS[data[0]], errors='replace')
+        values = [value.lstrip('\ufeff') for value in text.split('\x00')]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def _frame_key(self, frame_id, content):
+        if frame_id == 'TXXX':
+            values = _ID3Tag._decode_text(content)
+            if not values:
+                return None, None
+            return 'TXXX:' + values[0], ';'.join(values[1:])
+        if frame_id == 'USLT':
+            values = _ID3Tag._decode_text(content[:1] + content[4:])
+            return frame_id, values[-1] if len(values) > 1 else ''
+        if frame_id.startswith('T'):
+            if self.version == 3:
+                frame_id = _ID3V24_FRAME_IDS.get(frame_id, frame_id)
+            return frame_id, ';'.join(_ID3Tag._decode_text(content))
+        return None, None
+
+    def items(self):
+        """
+        Returns the frame keys and values of all decodable text frames.
+        """
+        for frame_id, frame_flags, frame_data in self.frames:
+            content = self._frame_content(frame_flags, frame_data)
+            if content is None:
+                continue
+            frame_key, value = self._frame_key(frame_id, content)
+            if frame_key is not None:
+                yield frame_key, value
+
+    def remove(self, frame_keys):
+        """
+        Removes all frames with the specified frame keys.
+        """
+        frames = []
+        for frame in self.frames:
+            frame_id, frame_flags, frame_data = frame
+            content = self._frame_content(frame_flags, frame_data)
+            if content is not None and self._frame_key(frame_id, content)[0] in frame_keys:
+                continue
+            frames.append(frame)
+        self.frames = frames
+
+    def add(self, frame_key, value):
+        """
+        Adds a text frame with the specified frame key.
+        """
+        if self.version == 4:
+            encoding, encoded_value = 3, value.encode('utf-8')
+        else:
+            encoding, encoded_value = 1, value.encode('utf-16')
+        if frame_key.startswith('TXXX:'):
+            description = frame_key[5:]
+            frame_id = 'TXXX'
+            encoded_description = description.encode('utf-8' if self.version == 4 else 'utf-16')
+            terminator = b'\x00' if self.version == 4 else b'\x00\x00'
+            content = bytes([encoding]) + encoded_description + terminator + encoded_value
+        elif frame_key == 'USLT':
+            frame_id = frame_key
+            terminator = b'\x00' if self.version == 4 else b'\xff\xfe\x00\x00'
+            content = bytes([encoding]) + b'XXX' + terminator + encoded_value
+        else:
+            frame_id = frame_key if self.version == 4 else _ID3V23_FRAME_IDS.get(frame_key, frame_key)
+            content = bytes([encoding]) + encoded_value
+        self.frames.append((frame_id, 0, content))
+
+    def serialize(self):
+        """
+        Returns the binary representation of the tag.
+
+        :rtype: bytes
+        """
+        parts = []
+        for frame_id, frame_flags, frame_data in self.frames:
+            if self.version == 4:
+                size_data = _encode_syncsafe(len(frame_data))
+            else:
+                size_data = struct.pack('>L', len(frame_data))
+            parts.append(_ID3_FRAME_HEADER.pack(frame_id.encode('latin-1'), size_data, frame_flags))
+            parts.append(frame_data)
+        body = b''.join(parts)
+        return _ID3_HEADER.pack(b'ID3', self.version, 0, 0, _encode_syncsafe(len(body))) + body
+
+
+def _is_mpeg_audio_frame(data, offset):
+    if offset + 4 > len(data):
+        return False
+    header = data[offset:offset + 4]
+    return (header[0] == 0xFF and header[1] & 0xE0 == 0xE0 and header[1] & 0x06 != 0 and
+            header[2] & 0xF0 != 0xF0 and header[2] & 0x0C != 0x0C)
+
+
+_OGG_PAGE_HEADER = struct.Struct('<4sBBqLLLB')
+_OGG_CONTINUED_PACKET = 0x01
+_OGG_FIRST_PAGE = 0x02
+_OGG_CRC_POLYNOMIAL = 0x104C11DB7
+
+
+def _ogg_crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 24
+        for _ in range(8):
+            crc = (crc << 1) ^ _OGG_CRC_POLYNOMIAL if crc & 0x80000000 else crc << 1
+        table.append(crc)
+    return table
+
+
+_OGG_CRC_TABLE = _ogg_crc_table()
+
+
+def _ogg_crc(data):
+    crc = 0
+    for byte in data:
+        crc = (crc << 8 & 0xFFFFFFFF) ^ _OGG_CRC_TABLE[crc >> 24 ^ byte]
+    return crc
+
+
+def _gf2_multiply(a, b):
+    """
+    Multiplies two polynomials over GF(2) modulo the Ogg CRC polynomial.
+    """
+    product = 0
+    while b:
+        if b & 1:
+            product ^= a
+        b >>= 1
+        a <<= 1
+        if a & 0x100000000:
+            a ^= _OGG_CRC_POLYNOMIAL
+    return product
+
+
+@functools.lru_cache(maxsize=256)
+def _crc_shift(byte_count):
+    """
+    Returns x^(8*byte_count) modulo the Ogg CRC polynomial.
+    """
+    result = 1
+    power = 1 << 8
+    while byte_count:
+        if byte_count & 1:
+            result = _gf2_multiply(result, power)
+        power = _gf2_multiply(power, power)
+        byte_count >>= 1
+    return result
+
+
+class _OggPage:
+    __slots__ = 'offset', 'size', 'header_type', 'granule_position', 'serial', 'sequence', 'crc', 'lacing_values'
+
+    def __init__(self, data, offset):
+        if offset + _OGG_PAGE_HEADER.size > len(data):
+            raise UnsupportedFormatError('Truncated Ogg page.')
+        capture_pattern, version, self.header_type, self.granule_position, self.serial, self.sequence, \
+            self.crc, segment_count = _OGG_PAGE_HEADER.unpack_from(data, offset)
+        if capture_pattern != b'OggS' or version != 0:
+            raise UnsupportedFormatError('Invalid Ogg page at offset %d.' % offset)
+        self.offset = offset
+        header_size = _OGG_PAGE_HEADER.size + segment_count
+        self.lacing_values = bytes(data[offset + _OGG_PAGE_HEADER.size:offset + header_size])
+        self.size = header_size + sum(self.lacing_values)
+        if offset + self.size > len(data):
+            raise UnsupportedFormatError('Truncated Ogg page.')
+
+    @property
+    def data_offset(self):
+        return self.offset + _OGG_PAGE_HEADER.size + len(self.lacing_values)
+
+    def renumbered(self, data, sequence):
+        """
+        Returns the page header with a new sequence number.
+
+        As the Ogg CRC is linear, the checksum is updated from the changed
+        bytes alone instead of being recomputed over the entire page.
+        """
+        sequence_delta = struct.pack('<L', self.sequence ^ sequence)
+        crc = self.crc ^ _gf2_multiply(_ogg_crc(sequence_delta), _crc_shift(self.size - 22))
+        return bytes(data[self.offset:self.offset + 18]) + struct.pack('<LL', sequence, crc) + \
+            bytes(data[self.offset + 26:self.offset + _OGG_PAGE_HEADER.size])
+
+
+def _ogg_pages(serial, packets, first_sequence):
+    """
+    Returns the header pages that contain the specified packets.
+    """
+    lacing_values = []
+    for packet in packets:
+        lacing_values.extend([255]*(len(packet)//255) + [len(packet) % 255])
+    data = b''.join(packets)
+
+    pages = []
+    data_offset = 0
+    continued = False
+    for page_index, segment_offset in enumerate(range(0, len(lacing_values), 255)):
+        page_lacing_values = bytes(lacing_values[segment_offset:segment_offset + 255])
+        page_data = data[data_offset:data_offset + sum(page_lacing_values)]
+        data_offset += len(page_data)
+        header = _OGG_PAGE_HEADER.pack(b'OggS', 0, _OGG_CONTINUED_PACKET if continued else 0, 0, serial,
+                                       first_sequence + page_index, 0, len(page_lacing_values))
+        page = header + page_lacing_values + page_data
+        crc = _ogg_crc(page)
+        pages.append(page[:22] + struct.pack('<L', crc) + page[26:])
+        continued = page_lacing_values[-1] == 255
+    return pages
+
+
+class _VorbisComments:
+    """
+    Represents the comment header packet of an Ogg Vorbis or Ogg Opus
+    stream.
+    """
+    def __init__(self, prefix, vendor, comments, trailing_data):
+        self.prefix = prefix
+        self.vendor = vendor
+        self.comments = comments
+        self.trailing_data = trailing_data
+
+    @staticmethod
+    def parse(prefix, packet):
+        try:
+            position = len(prefix)
+            vendor_length = struct.unpack_from('<L', packet, position)[0]
+            position += 4
+            vendor = packet[position:position + vendor_length]
+            position += vendor_length
+            comment_count = struct.unpack_from('<L', packet, position)[0]
+            position += 4
+            comments = []
+            for _ in range(comment_count):
+                comment_length = struct.unpack_from('<L', packet, position)[0]
+                position += 4
+                comment = packet[position:position + comment_length].decode('utf-8', errors='replace')
+                position += comment_length
+                field, separator, value = comment.partition('=')
+                if separator:
+                    comments.append((field.upper(), value))
+        except struct.error:
+            raise UnsupportedFormatError('Invalid Vorbis comment header.')
+        return _VorbisComments(prefix, vendor, comments, packet[position:])
+
+    def serialize(self):
+        parts = [self.prefix, struct.pack('<L', len(self.vendor)), self.vendor,
+                 struct.pack('<L', len(self.comments))]
+        for field, value in self.comments:
+            comment = ('%s=%s' % (field, value)).encode('utf-8')
+            parts.append(struct.pack('<L', len(comment)))
+            parts.append(comment)
+        parts.append(self.trailing_data)
+        return b''.join(parts)
+
+
+# Vorbis comment fields of FFmpeg metadata keys, see libavformat/vorbiscomment.c
+_VORBIS_COMMENT_FIELDS = {
+    'album_artist': 'ALBUMARTIST',
+    'comment': 'DESCRIPTION',
+    'disc': 'DISCNUMBER',
+    'track': 'TRACKNUMBER',
+}
+
+# Identification header prefix, comment header prefix, and number of header packets following the identification
+_OGG_CODECS = (
+    (b'OpusHead', b'OpusTags', 1),
+    (b'\x01vorbis', b'\x03vorbis', 2),
+)
+
+
+class _OggStream:
+    """
+    Represents the header pages of a logical Ogg Opus or Ogg Vorbis stream.
+    """
+    def __init__(self, data):
+        first_page = _OggPage(data, 0)
+        if not first_page.header_type & _OGG_FIRST_PAGE or first_page.lacing_values[-1:] == b'\xff':
+            raise UnsupportedFormatError('Invalid first Ogg page.')
+        identification = data[first_page.data_offset:first_page.offset + first_page.size]
+        for identification_prefix, comment_prefix, header_packet_count in _OGG_CODECS:
+            if identification[:len(identification_prefix)] == identification_prefix:
+                break
+        else:
+            raise UnsupportedFormatError('Unsupported Ogg codec.')
+        self.serial = first_page.serial
+
+        # Collect the comment header packet and the packets that follow it
+        packets = []
+        packet_parts = []
+        offset = first_page.size
+        self.header_page_count = 0
+        while len(packets) < header_packet_count:
+            page = _OggPage(data, offset)
+            if page.serial != self.serial or page.header_type & _OGG_FIRST_PAGE:
+                raise UnsupportedFormatError('Multiplexed Ogg streams are not supported.')
+            self.header_page_count += 1
+            segment_offset = page.data_offset
+            for lacing_value in page.lacing_values:
+                packet_parts.append(data[segment_offset:segment_offset + lacing_value])
+                segment_offset += lacing_value
+                if lacing_value < 255:
+                    packets.append(b''.join(packet_parts))
+                    packet_parts = []
+            offset += page.size
+        if packet_parts or len(packets) != header_packet_count:
+            raise UnsupportedFormatError('Header packets do not end on a page boundary.')
+        if packets[0][:len(comment_prefix)] != comment_prefix:
+            raise UnsupportedFormatError('Missing comment header.')
+
+        self.first_page_size = first_page.size
+        self.header_end = offset
+        self.comments = _VorbisComments.parse(comment_prefix, packets[0])
+        self.other_header_packets = packets[1:]
+
+    def serialize(self, data):
+        """
+        Returns the parts of the stream data with the current comments.
+        """
+        packets = [self.comments.serialize()] + self.other_header_packets
+        pages = _ogg_pages(self.serial, packets, 1)
+        parts = [data[:self.first_page_size]]
+        parts.extend(pages)
+
+        sequence_delta = len(pages) - self.header_page_count
+        if not sequence_delta:
+            parts.append(data[self.header_end:])
+            return parts
+
+        # Renumber the following pages of the stream
+        offset = self.header_end
+        copy_offset = offset
+        while offset < len(data):
+            page = _OggPage(data, offset)
+            if page.serial == self.serial:
+                parts.append(data[copy_offset:page.offset])
+                parts.append(page.renumbered(data, page.sequence + sequence_delta))
+                copy_offset = page.offset + _OGG_PAGE_HEADER.size
+            offset += page.size
+        parts.append(data[copy_offset:])
+        return parts
+
+
+class AudioTagMetadataProcessor(MetadataProcessor):
+    """
+    Represents a metadata processor that reads and writes ID3v2 tags of MP3
+    files and Vorbis comments of Ogg Opus and Ogg Vorbis files natively.
+
+    The processor uses the same metadata keys as
+    :class:`~madam.ffmpeg.FFmpegMetadataProcessor`. Tags are modified by
+    splicing the tag data into the original data, so no external programs
+    are run.
+    """
+    metadata_keys_by_mime_type = {
+        mime_type: FFmpegMetadataProcessor.metadata_keys_by_mime_type[mime_type]
+        for mime_type in (MimeType('audio/mpeg'), MimeType('audio/ogg'))
+    }
+
+    def __init__(self):
+        """
+        Initializes a new `AudioTagMetadataProcessor`.
+        """
+        super().__init__()
+        self.__tag_keys_by_mime_type = {
+            MimeType('audio/mpeg'): {
+                metadata_key: AudioTagMetadataProcessor.__id3_frame_key(ffmetadata_key)
+                for metadata_key, ffmetadata_key
+                in self.metadata_keys_by_mime_type[MimeType('audio/mpeg')].items()
+            },
+            MimeType('audio/ogg'): {
+                metadata_key: _VORBIS_COMMENT_FIELDS.get(ffmetadata_key, ffmetadata_key.upper())
+                for metadata_key, ffmetadata_key
+                in self.metadata_keys_by_mime_type[MimeType('audio/ogg')].items()
+            },
+        }
+
+    @staticmethod
+    def __id3_frame_key(ffmetadata_key):
+        frame_id = _ID3_FRAME_IDS.get(ffmetadata_key, ffmetadata_key)
+        if _ID3_FRAME_ID_PATTERN.match(frame_id) and frame_id != 'TXXX':
+            return frame_id
+        return 'TXXX:' + ffmetadata_key
+
+    @property
+    def formats(self):
+        return 'ffmetadata',
+
+    @staticmethod
+    def __parse(file):
+        data = memoryview(file.read())
+        if data[:4] == b'OggS':
+            return MimeType('audio/ogg'), data, _OggStream(data)
+        tag, audio_offset = _ID3Tag.parse(data)
+        if not _is_mpeg_audio_frame(data, audio_offset):
+            raise UnsupportedFormatError('Unsupported file format.')
+        return MimeType('audio/mpeg'), data, (tag, audio_offset)
+
+    def read(self, file):
+        mime_type, data, container = AudioTagMetadataProcessor.__parse(file)
+        if mime_type == MimeType('audio/ogg'):
+            items = container.comments.comments
+        else:
+            tag, _ = container
+            items = tag.items() if tag else []
+
+        metadata_keys = {tag_key: metadata_key
+                         for metadata_key, tag_key in self.__tag_keys_by_mime_type[mime_type].items()}
+        metadata = {}
+        for tag_key, value in items:
+            metadata_key = metadata_keys.get(tag_key)
+            if metadata_key is None:
+                continue
+            if metadata_key in metadata:
+                metadata[metadata_key] += ';' + value
+            else:
+                metadata[metadata_key] = value
+
+        return {'ffmetadata': metadata}
+
+    def strip(self, file):
+        mime_type, data, container = AudioTagMetadataProcessor.__parse(file)
+        if mime_type == MimeType('audio/ogg'):
+            container.comments.comments = []
+            return io.BytesIO(b''.join(container.serialize(data)))
+
+        _, audio_offset = container
+        audio_end = len(data)
+        if audio_end - audio_offset >= _ID3V1_SIZE and data[audio_end - _ID3V1_SIZE:][:3] == b'TAG':
+            audio_end -= _ID3V1_SIZE
+        return io.BytesIO(data[audio_offset:audio_end])
+
+    def combine(self, file, metadata_by_type):
+        mime_type, data, container = AudioTagMetadataProcessor.__parse(file)
+
+        # Validate provided metadata
+        if not metadata_by_type:
+            raise ValueError('No metadata provided')
+        if 'ffmetadata' not in metadata_by_type:
+            raise UnsupportedFormatError('Invalid metadata to be combined with essence: %r' %
+                                         (metadata_by_type.keys(),))
+        if not metadata_by_type['ffmetadata']:
+            raise ValueError('No metadata provided')
+
+        tag_keys = self.__tag_keys_by_mime_type[mime_type]
+        tag_items = []
+        for metadata_key, value in metadata_by_type['ffmetadata'].items():
+            tag_key = tag_keys.get(metadata_key)
+            if tag_key is None:
+                raise ValueError('Unsupported metadata key: %r' % metadata_key)
+            tag_items.append((tag_key, '%s' % value))
+        updated_tag_keys = {tag_key for tag_key, _ in tag_items}
+
+        if mime_type == MimeType('audio/ogg'):
+            comments = container.comments
+            comments.comments = [comment for comment in comments.comments if comment[0] not in updated_tag_keys]
+            comments.comments.extend(tag_items)
+            return io.BytesIO(b''.join(container.serialize(data)))
+
+        tag, audio_offset = container
+        if tag is None or tag.version not in (3, 4):
+            tag = _ID3Tag()
+        tag.remove(updated_tag_keys)
+        for tag_key, value in tag_items:
+            tag.add(tag_key, value)
+        return io.BytesIO(b''.join((tag.serialize(), data[audio_offset:])))
@@ -1 +1,2 @@
 from madam.ffmpeg import FFmpegProcessor
+from madam.mp4 import MP4MetadataProcessor
@@ -1,4 +1,5 @@
 import json
+import struct
 import subprocess
 
 import pytest
@@ -44,6 +45,14 @@ class TestFFmpegProcessor:
         video_info = json.loads(result.stdout.decode('utf-8'))
         assert video_info.get('streams', [{}])[0].get('codec_name') == 'mp3'
 
+    def test_converted_essence_has_xing_header_with_frame_count(self, converted_asset):
+        essence_data = converted_asset.essence.read()
+        header_offset = max(essence_data.find(b'Xing'), essence_data.find(b'Info'))
+        assert header_offset >= 0
+        flags, frame_count = struct.unpack_from('>LL', essence_data, header_offset + 4)
+        assert flags & 0x1
+        assert frame_count > 0
+
     def test_converted_essence_stream_has_same_duration_as_source(self, converted_asset):
         assert converted_asset.duration == pytest.approx(DEFAULT_DURATION, rel=0.5)
 
@@ -173,3 +182,136 @@ class TestFFmpegMetadataProcessor:
 
         with pytest.raises(ValueError):
             processor.combine(mp3_audio_asset.essence, metadata)
+
+
+class TestAudioTagMetadataProcessor:
+    @pytest.fixture(name='processor')
+    def audio_tag_metadata_processor(self):
+        return madam.audio.AudioTagMetadataProcessor()
+
+    def test_supports_ffmetadata(self, processor):
+        assert 'ffmetadata' in processor.formats
+
+    def test_read_returns_correct_metadata_dict_for_mp3_with_id3(self, processor):
+        with open('tests/resources/64kbits_with_id3v2-4.mp3', 'rb') as file:
+            metadata = processor.read(file)
+
+        assert metadata['ffmetadata']['artist'] == 'Frédéric Chopin'
+        assert len(metadata) == 1
+
+    def test_read_returns_correct_metadata_dict_for_opus_with_comments(self, processor):
+        with open('tests/resources/sine-440hz-audio-with-comments.opus', 'rb') as file:
+            metadata = processor.read(file)
+
+        assert metadata['ffmetadata']['artist'] == 'Frédéric Chopin'
+        assert len(metadata) == 1
+
+    def test_read_raises_error_when_file_format_is_unsupported(self, processor, unknown_asset):
+        junk_data = unknown_asset.essence
+
+        with pytest.raises(UnsupportedFormatError):
+            processor.read(junk_data)
+
+    def test_read_raises_error_when_file_format_is_unsupported_by_metadata_processor(self, processor,
+                                                                                     nut_audio_asset):
+        with pytest.raises(UnsupportedFormatError):
+            processor.read(nut_audio_asset.essence)
+
+    def test_read_returns_empty_dict_when_mp3_contains_no_metadata(self, processor, mp3_audio_asset):
+        data_without_id3 = mp3_audio_asset.essence
+
+        metadata = processor.read(data_without_id3)
+
+        assert not metadata['ffmetadata']
+
+    def test_strip_returns_mp3_without_metadata(self, processor):
+        with open('tests/resources/64kbits_with_id3v2-4.mp3', 'rb') as file:
+            stripped_essence = processor.strip(file)
+
+        assert not processor.read(stripped_essence)['ffmetadata']
+
+    def test_strip_returns_opus_without_metadata(self, processor, tmpdir):
+        with open('tests/resources/sine-440hz-audio-with-comments.opus', 'rb') as file:
+            stripped_essence = processor.strip(file)
+
+        essence_file = tmpdir.join('essence_without_metadata')
+        essence_file.write(stripped_essence.read(), 'wb')
+        ogg = OggOpus(str(essence_file))
+        assert not ogg.tags
+
+    def test_strip_raises_error_when_file_format_is_unsupported(self, processor, unknown_asset):
+        junk_data = unknown_asset.essence
+
+        with pytest.raises(UnsupportedFormatError):
+            processor.strip(junk_data)
+
+    def test_combine_returns_mp3_with_metadata(self, processor, mp3_audio_asset, tmpdir):
+        essence = mp3_audio_asset.essence
+        metadata = dict(ffmetadata=dict(artist='Frédéric Chopin'))
+
+        essence_with_metadata = processor.combine(essence, metadata)
+
+        essence_file = tmpdir.join('essence_with_metadata')
+        essence_file.write(essence_with_metadata.read(), 'wb')
+        mp3 = EasyMP3(str(essence_file))
+        for key, actual in metadata['ffmetadata'].items():
+            assert actual in mp3.tags.get(key)
+
+    def test_combine_returns_opus_with_metadata(self, processor, opus_audio_asset, tmpdir):
+        essence = opus_audio_asset.essence
+        metadata = dict(ffmetadata=dict(artist='Frédéric Chopin'))
+
+        essence_with_metadata = processor.combine(essence, metadata)
+
+        essence_file = tmpdir.join('essence_with_metadata')
+        essence_file.write(essence_with_metadata.read(), 'wb')
+        ogg = OggOpus(str(essence_file))
+        for key, actual in metadata['ffmetadata'].items():
+            assert actual in ogg.tags.get(key)
+
+    def test_combine_renumbers_ogg_pages_when_comments_span_multiple_pages(self, processor, opus_audio_asset,
+                                                                            tmpdir):
+        essence = opus_audio_asset.essence
+        metadata = dict(ffmetadata=dict(comment='Lorem ipsum ' * 10000))
+
+        essence_with_metadata = processor.combine(essence, metadata)
+
+        essence_file = tmpdir.join('essence_with_metadata')
+        essence_file.write(essence_with_metadata.read(), 'wb')
+        ogg = OggOpus(str(essence_file))
+        assert ogg.tags['description'] == [metadata['ffmetadata']['comment']]
+        assert ogg.info.length == pytest.approx(DEFAULT_DURATION, rel=0.5)
+
+    def test_combine_preserves_existing_metadata(self, processor):
+        with open('tests/resources/64kbits_with_id3v2-4.mp3', 'rb') as file:
+            essence_with_metadata = processor.combine(file, dict(ffmetadata=dict(title='Nocturne')))
+
+        metadata = processor.read(essence_with_metadata)
+        assert metadata['ffmetadata']['artist'] == 'Frédéric Chopin'
+        assert metadata['ffmetadata']['title'] == 'Nocturne'
+
+    def test_combine_fails_without_metadata_keys(self, processor, mp3_audio_asset):
+        essence = mp3_audio_asset.essence
+        metadata = dict(ffmetadata={})
+
+        with pytest.raises(ValueError):
+            processor.combine(essence, metadata)
+
+    def test_combine_raises_error_when_essence_format_is_unsupported(self, processor, unknown_asset):
+        junk_data = unknown_asset.essence
+        metadata = dict(ffmetadata=dict(artist='Frédéric Chopin'))
+
+        with pytest.raises(UnsupportedFormatError):
+            processor.combine(junk_data, metadata)
+
+    def test_combine_raises_error_when_metadata_format_is_unsupported(self, processor, mp3_audio_asset):
+        ffmetadata = {'123abc': 'Test artist'}
+
+        with pytest.raises(UnsupportedFormatError):
+            processor.combine(mp3_audio_asset.essence, ffmetadata)
+
+    def test_combine_raises_error_when_metadata_contains_unsupported_keys(self, processor, mp3_audio_asset):
+        metadata = dict(ffmetadata=dict(foo='bar'))
+
+        with pytest.raises(ValueError):
+            processor.combine(mp3_audio_asset.essence, metadata)
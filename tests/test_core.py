@@ -1,12 +1,21 @@
 import unittest.mock
 
+import datetime
 import io
+import json
+import multiprocessing
 import os
+import pickle
+import tarfile
+import threading
+from fractions import Fraction
+
 import pytest
 
-from madam.core import Asset
-from madam.core import InMemoryStorage, ShelveStorage
-from madam.core import Pipeline
+from madam.core import Asset, AssetStorage, CatalogSnapshot, MetadataCache
+from madam.core import DeduplicatingStorage, InMemoryStorage, LogStorage, ShelveStorage
+from madam.core import OperatorError, OperatorQueue, Pipeline, Priority
+from madam.core import _content_defined_chunks, _GEAR_TABLE
 
 
 @pytest.fixture
@@ -20,14 +29,29 @@ def shelve_storage(tmpdir):
     return ShelveStorage(storage_path)
 
 
-@pytest.mark.usefixtures('asset', 'in_memory_storage', 'shelve_storage')
+@pytest.fixture
+def log_storage(tmpdir):
+    storage_path = str(tmpdir.join('storage.log'))
+    return LogStorage(storage_path)
+
+
+@pytest.fixture
+def deduplicating_storage():
+    return DeduplicatingStorage()
+
+
+@pytest.mark.usefixtures('asset', 'in_memory_storage', 'shelve_storage', 'log_storage', 'deduplicating_storage')
 class TestStorages:
-    @pytest.fixture(params=['in_memory_storage', 'shelve_storage'])
-    def storage(self, request, in_memory_storage, shelve_storage):
+    @pytest.fixture(params=['in_memory_storage', 'shelve_storage', 'log_storage', 'deduplicating_storage'])
+    def storage(self, request, in_memory_storage, shelve_storage, log_storage, deduplicating_storage):
         if request.param == 'in_memory_storage':
             return in_memory_storage
         elif request.param == 'shelve_storage':
             return shelve_storage
+        elif request.param == 'log_storage':
+            return log_storage
+        elif request.param == 'deduplicating_storage':
+            return deduplicating_storage
 
     def test_contains_is_false_when_storage_is_empty(self, storage, asset):
         asset_key = str(hash(asset))
@@ -149,6 +173,124 @@ class TestStorages:
 
         assert len(list(storage)) == 1
 
+    def test_get_returns_equal_asset_when_essence_was_compressed(self, storage):
+        asset = Asset(io.BytesIO(b'BM' + bytes(8192)), mime_type='image/bmp', width=64)
+        storage['bmp'] = asset, {'foo'}
+
+        stored_asset, tags = storage['bmp']
+
+        assert stored_asset == asset
+        assert tags == {'foo'}
+
+    def test_statistics_contain_compressed_essences(self, storage):
+        if isinstance(storage, DeduplicatingStorage):
+            pytest.skip('Deduplicating storage does not compress essences')
+        storage['bmp'] = Asset(io.BytesIO(b'BM' + bytes(8192)), mime_type='image/bmp'), None
+        storage['jpeg'] = Asset(io.BytesIO(b'\xff\xd8' + bytes(8192)), mime_type='image/jpeg'), None
+
+        statistics = storage.statistics()
+
+        assert statistics['asset_count'] == 2
+        assert statistics['compressed_asset_count'] == 1
+        assert statistics['essence_size'] == 2*8194
+        assert statistics['stored_essence_size'] < 8194 + 1024
+
+    def test_statistics_do_not_contain_compressed_essences_when_compression_is_disabled(self, storage):
+        storage.compression = False
+        storage['bmp'] = Asset(io.BytesIO(b'BM' + bytes(8192)), mime_type='image/bmp'), None
+
+        statistics = storage.statistics()
+
+        assert statistics['compressed_asset_count'] == 0
+        assert statistics['stored_essence_size'] == statistics['essence_size']
+
+    def test_added_index_is_updated_when_assets_are_stored_and_removed(self, storage, asset):
+        storage['existing'] = asset, {'foo'}
+        index = unittest.mock.MagicMock()
+
+        storage.add_index(index)
+        storage['new'] = asset, None
+        del storage['existing']
+
+        index.add.assert_any_call('existing', asset, {'foo'})
+        index.add.assert_any_call('new', asset, frozenset())
+        index.remove.assert_any_call('existing')
+
+    @pytest.mark.parametrize('workers', [1, 4])
+    def test_imported_archive_contains_exported_assets(self, storage, tmpdir, workers):
+        assets = {'%d' % index: Asset(io.BytesIO(b'%d' % index), mime_type='text/plain', index=index)
+                  for index in range(600)}
+        for asset_key, asset in assets.items():
+            storage[asset_key] = asset, {'tag%d' % (asset.index % 3)}
+        archive = io.BytesIO()
+
+        exported_count = storage.export_archive(archive)
+        archive.seek(0)
+        target_storage = InMemoryStorage()
+        imported_count = target_storage.import_archive(archive, workers=workers, batch_size=50)
+
+        assert exported_count == imported_count == len(assets)
+        assert set(target_storage) == set(assets)
+        for asset_key, asset in assets.items():
+            assert target_storage[asset_key] == (asset, {'tag%d' % (asset.index % 3)})
+
+    def test_import_archive_stores_assets_in_storage(self, storage, asset):
+        source_storage = InMemoryStorage()
+        source_storage['key'] = asset, {'foo'}
+        archive = io.BytesIO()
+        source_storage.export_archive(archive)
+        archive.seek(0)
+
+        storage.import_archive(archive, workers=2)
+
+        assert storage['key'] == (asset, {'foo'})
+
+    def test_archive_preserves_metadata_types(self, storage):
+        metadata = dict(mime_type='image/jpeg',
+                        exif=dict(datetime_original=datetime.datetime(2017, 6, 1, 12, 30, 15, 250,
+                                                                      tzinfo=datetime.timezone.utc),
+                                  exposure_time=Fraction(1, 250), gps_time=datetime.time(12, 30, 15),
+                                  gps_date=datetime.date(2017, 6, 1), subject_area=(1, 2, 3)),
+                        maker_note=b'\x00\xff')
+        asset = Asset(io.BytesIO(b'essence'), **metadata)
+        source_storage = InMemoryStorage()
+        source_storage['key'] = asset, {'foo', ('bar', 2)}
+        archive = io.BytesIO()
+        source_storage.export_archive(archive)
+        archive.seek(0)
+
+        storage.import_archive(archive)
+
+        assert storage['key'] == (asset, {'foo', ('bar', 2)})
+
+    def test_archive_manifest_is_json(self, storage, asset):
+        storage['key'] = asset, {'foo'}
+        archive = io.BytesIO()
+
+        storage.export_archive(archive)
+
+        archive.seek(0)
+        with tarfile.open(fileobj=archive) as tar:
+            manifest = json.loads(tar.extractfile('00000000.manifest').read().decode('utf-8'))
+        assert manifest['key'] == 'key'
+
+    def test_import_archive_rejects_manifest_that_is_not_json(self, storage, asset):
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w') as tar:
+            for name, data in (('00000000.manifest', pickle.dumps(('key', {}, frozenset()))),
+                               ('00000000.essence', b'essence')):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        archive.seek(0)
+
+        with pytest.raises(ValueError):
+            storage.import_archive(archive)
+
+    def test_import_archive_raises_error_for_invalid_number_of_workers(self, storage):
+        with pytest.raises(ValueError):
+            storage.import_archive(io.BytesIO(), workers=0)
+
     def test_filter_returns_empty_list_when_storage_is_empty(self, storage):
         filtered_asset_keys = storage.filter()
         assert not filtered_asset_keys
@@ -164,6 +306,36 @@ class TestStorages:
         assert list(asset_keys_with_1s_duration)[0] == asset_key
 
 
+class _DictStorage(AssetStorage):
+    def __init__(self):
+        super().__init__()
+        self.store = {}
+
+    def __getitem__(self, asset_key):
+        return self.store[asset_key]
+
+    def __setitem__(self, asset_key, asset_and_tags):
+        self.store[asset_key] = asset_and_tags
+
+    def __delitem__(self, asset_key):
+        del self.store[asset_key]
+
+    def __iter__(self):
+        return iter(list(self.store))
+
+    def __len__(self):
+        return len(self.store)
+
+
+def test_statistics_work_for_storages_without_stored_representations():
+    storage = _DictStorage()
+    storage['bmp'] = Asset(io.BytesIO(b'BM' + bytes(8192)), mime_type='image/bmp'), None
+
+    statistics = storage.statistics()
+
+    assert statistics == dict(asset_count=1, compressed_asset_count=0, essence_size=8194, stored_essence_size=8194)
+
+
 @pytest.mark.usefixtures('asset', 'shelve_storage')
 class TestShelveStorage:
     @pytest.fixture
@@ -181,6 +353,415 @@ class TestShelveStorage:
         assert os.path.exists(storage.path)
 
 
+@pytest.mark.usefixtures('log_storage')
+class TestLogStorage:
+    def test_raises_error_when_storage_path_is_not_a_directory(self, tmpdir):
+        file_path = tmpdir.join('file')
+        file_path.write('')
+
+        with pytest.raises(ValueError):
+            LogStorage(str(file_path))
+
+    def test_reopened_storage_contains_stored_assets(self, tmpdir, log_storage):
+        log_storage['a'] = Asset(io.BytesIO(b'a'), mime_type='text/plain'), {'foo'}
+        log_storage['b'] = Asset(io.BytesIO(b'b')), None
+        log_storage['a'] = Asset(io.BytesIO(b'A')), {'bar'}
+        del log_storage['b']
+        log_storage.close()
+
+        reopened_storage = LogStorage(log_storage.path)
+
+        assert set(reopened_storage) == {'a'}
+        asset, tags = reopened_storage['a']
+        assert asset.essence.read() == b'A'
+        assert tags == {'bar'}
+
+    def test_index_is_rebuilt_from_segments_without_hint_files(self, log_storage):
+        log_storage['a'] = Asset(io.BytesIO(b'a')), None
+
+        reopened_storage = LogStorage(log_storage.path)
+
+        assert reopened_storage['a'][0].essence.read() == b'a'
+
+    def test_reopening_does_not_add_segments(self, tmpdir):
+        storage_path = str(tmpdir.join('storage.log'))
+        storage = LogStorage(storage_path)
+        storage['a'] = Asset(io.BytesIO(b'a')), None
+        storage.close()
+        file_names = sorted(os.listdir(storage_path))
+
+        for _ in range(10):
+            LogStorage(storage_path).close()
+
+        assert sorted(os.listdir(storage_path)) == file_names
+        storage = LogStorage(storage_path)
+        storage['b'] = Asset(io.BytesIO(b'b')), None
+        storage.close()
+        assert sorted(os.listdir(storage_path)) == file_names
+        assert set(LogStorage(storage_path)) == {'a', 'b'}
+
+    def test_sealed_segments_have_hint_files(self, tmpdir):
+        storage = LogStorage(str(tmpdir.join('storage.log')), max_segment_size=1)
+
+        storage['a'] = Asset(io.BytesIO(b'a')), None
+
+        assert os.path.exists(os.path.join(storage.path, '00000000.hint'))
+
+    def test_compact_reclaims_overwritten_and_deleted_assets(self, tmpdir):
+        storage = LogStorage(str(tmpdir.join('storage.log')), max_segment_size=1024)
+        for index in range(20):
+            storage['a'] = Asset(io.BytesIO(b'a' * 100)), {index}
+            storage['b%d' % index] = Asset(io.BytesIO(b'b' * 100)), None
+            del storage['b%d' % index]
+        storage['c'] = Asset(io.BytesIO(b'c')), None
+        size_before = sum(entry.stat().st_size for entry in os.scandir(storage.path))
+
+        reclaimed_size = storage.compact()
+
+        size_after = sum(entry.stat().st_size for entry in os.scandir(storage.path))
+        assert reclaimed_size > 0
+        assert size_after < size_before
+        assert set(storage) == {'a', 'c'}
+        assert storage['a'][1] == {19}
+        storage.close()
+        assert set(LogStorage(storage.path)) == {'a', 'c'}
+
+    def test_background_compaction_reclaims_space(self, tmpdir):
+        storage = LogStorage(str(tmpdir.join('storage.log')), max_segment_size=1024,
+                             background_compaction=True)
+        for index in range(50):
+            storage['a'] = Asset(io.BytesIO(b'a' * 100)), None
+        storage.close()
+
+        segment_count = len([name for name in os.listdir(storage.path) if name.endswith('.log')])
+        assert segment_count < 5
+        assert set(LogStorage(storage.path)) == {'a'}
+
+    def test_writes_do_not_interfere_with_background_compaction(self, tmpdir):
+        storage = LogStorage(str(tmpdir.join('storage.log')), max_segment_size=1024,
+                             compaction_threshold=0.1, background_compaction=True)
+
+        for index in range(100):
+            storage['a%d' % (index % 3)] = Asset(io.BytesIO(b'a' * 100)), None
+        storage.close()
+
+        assert set(LogStorage(storage.path)) == {'a0', 'a1', 'a2'}
+
+    def test_background_compaction_keeps_latest_records(self, tmpdir):
+        storage = LogStorage(str(tmpdir.join('storage.log')), max_segment_size=1024,
+                             compaction_threshold=0.1, background_compaction=True)
+
+        for index in range(100):
+            storage['a%d' % (index % 3)] = Asset(io.BytesIO(b'%03d' % index * 30)), None
+        storage.close()
+
+        reopened_storage = LogStorage(storage.path)
+        assert [reopened_storage['a%d' % key_index][0].essence.read()[:3] for key_index in range(3)] == \
+            [b'099', b'097', b'098']
+
+    def test_background_compaction_continues_after_error(self, tmpdir):
+        storage = LogStorage(str(tmpdir.join('storage.log')), max_segment_size=1024,
+                             background_compaction=True)
+        compact = storage._compact
+        calls = []
+
+        def fail_once():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                raise OSError('Compaction failed')
+            return compact()
+
+        storage._compact = fail_once
+        for index in range(50):
+            storage['a'] = Asset(io.BytesIO(b'a' * 100)), None
+        storage.close()
+
+        segment_count = len([name for name in os.listdir(storage.path) if name.endswith('.log')])
+        assert len(calls) > 1
+        assert segment_count < 5
+
+
+@pytest.mark.usefixtures('deduplicating_storage')
+class TestDeduplicatingStorage:
+    @pytest.fixture
+    def essence_data(self):
+        return os.urandom(512*1024)
+
+    def test_raises_error_when_average_chunk_size_is_not_a_power_of_two(self):
+        with pytest.raises(ValueError):
+            DeduplicatingStorage(average_chunk_size=5000)
+
+    def test_raises_error_when_chunk_sizes_are_not_ordered(self):
+        with pytest.raises(ValueError):
+            DeduplicatingStorage(min_chunk_size=8192, average_chunk_size=4096)
+
+    def test_derived_essences_share_chunks(self, deduplicating_storage, essence_data):
+        original = Asset(io.BytesIO(b'ID3 tag' + essence_data), mime_type='audio/mpeg')
+        retagged = Asset(io.BytesIO(b'Another ID3 tag' + essence_data), mime_type='audio/mpeg')
+        trimmed = Asset(io.BytesIO(essence_data[100000:400000]), mime_type='audio/mpeg')
+
+        deduplicating_storage['original'] = original, None
+        deduplicating_storage['retagged'] = retagged, None
+        deduplicating_storage['trimmed'] = trimmed, None
+
+        statistics = deduplicating_storage.statistics()
+        assert statistics['essence_size'] == len(original.essence.read()) + len(retagged.essence.read()) + 300000
+        assert statistics['stored_essence_size'] < 1.2*len(essence_data)
+        assert deduplicating_storage['retagged'][0] == retagged
+        assert deduplicating_storage['trimmed'][0] == trimmed
+
+    def test_unused_chunks_are_removed(self, deduplicating_storage, essence_data):
+        deduplicating_storage['a'] = Asset(io.BytesIO(essence_data)), None
+        deduplicating_storage['b'] = Asset(io.BytesIO(essence_data[1000:])), None
+        deduplicating_storage['b'] = Asset(io.BytesIO(b'small')), None
+
+        del deduplicating_storage['a']
+
+        assert deduplicating_storage.statistics()['chunk_count'] == 1
+        assert deduplicating_storage['b'][0].essence.read() == b'small'
+
+    def test_assets_persist_in_backend(self, tmpdir, essence_data):
+        backend_path = str(tmpdir.join('chunks'))
+        storage = DeduplicatingStorage(LogStorage(backend_path))
+        asset = Asset(io.BytesIO(essence_data), mime_type='audio/mpeg', duration=Fraction(3, 2))
+        storage['a'] = asset, {'foo'}
+        storage['b'] = Asset(io.BytesIO(essence_data[1000:]), mime_type='audio/mpeg'), None
+        chunk_count = storage.statistics()['chunk_count']
+        storage.backend.close()
+
+        reopened_storage = DeduplicatingStorage(LogStorage(backend_path))
+
+        assert set(reopened_storage) == {'a', 'b'}
+        assert reopened_storage['a'] == (asset, {'foo'})
+        assert reopened_storage.statistics()['chunk_count'] == chunk_count
+
+    def test_new_chunks_are_written_to_backend_in_batches(self, in_memory_storage, essence_data):
+        storage = DeduplicatingStorage(in_memory_storage, min_chunk_size=64, average_chunk_size=256,
+                                       max_chunk_size=1024)
+
+        with unittest.mock.patch.object(in_memory_storage, '_store_items',
+                                        wraps=in_memory_storage._store_items) as store_items:
+            storage['a'] = Asset(io.BytesIO(essence_data)), None
+
+        assert 1 < store_items.call_count < storage.statistics()['chunk_count']
+        assert storage['a'][0].essence.read() == essence_data
+
+    def test_chunk_boundaries_match_gear_fingerprints(self, essence_data):
+        gear = _GEAR_TABLE
+        data = essence_data[:100000] + bytes(20000) + essence_data[:50000]
+
+        chunk_sizes = [len(chunk) for chunk in _content_defined_chunks(data, 40, 256, 1024)]
+
+        expected_chunk_sizes = []
+        start = 0
+        while start < len(data):
+            end = min(len(data), start + 1024)
+            boundary = end
+            fingerprint = 0
+            for position in range(start + 40, end):
+                fingerprint = ((fingerprint << 1) + gear[data[position]]) & 0xFFFFFFFF
+                mask = 0xFF800000 if position < start + 256 else 0xFE000000
+                if not fingerprint & mask:
+                    boundary = position + 1
+                    break
+            expected_chunk_sizes.append(boundary - start)
+            start = boundary
+        assert chunk_sizes == expected_chunk_sizes
+
+    def test_removes_chunks_without_asset_from_backend(self, in_memory_storage):
+        in_memory_storage['chunk:' + 64*'0'] = Asset(io.BytesIO(b'orphan')), None
+
+        storage = DeduplicatingStorage(in_memory_storage)
+
+        assert storage.statistics()['chunk_count'] == 0
+        assert not list(in_memory_storage)
+
+
+def _read_snapshot_in_worker(snapshot, results):
+    results.put((len(snapshot), snapshot.metadata('b')['mime_type'], sorted(snapshot.filter_by_tags('foo'))))
+
+
+class TestCatalogSnapshot:
+    @pytest.fixture
+    def snapshot(self, in_memory_storage, tmpdir):
+        in_memory_storage['b'] = Asset(io.BytesIO(b'b'), mime_type='image/png', width=3), {'foo', 'bar'}
+        in_memory_storage['a'] = Asset(io.BytesIO(b'a'), mime_type='audio/mpeg'), {'foo'}
+        in_memory_storage['c'] = Asset(io.BytesIO(b'c'), mime_type='video/mp4', video=dict(codec='h264')), None
+        snapshot = CatalogSnapshot.create(in_memory_storage, str(tmpdir.join('catalog')))
+        yield snapshot
+        snapshot.close()
+
+    def test_raises_error_when_file_is_not_a_snapshot(self, tmpdir):
+        path = tmpdir.join('invalid')
+        path.write_binary(b'invalid data with some length')
+
+        with pytest.raises(ValueError):
+            CatalogSnapshot(str(path))
+
+    def test_contains_all_keys_in_sorted_order(self, snapshot):
+        assert len(snapshot) == 3
+        assert list(snapshot) == ['a', 'b', 'c']
+        assert 'b' in snapshot
+        assert 'd' not in snapshot
+
+    def test_metadata_returns_asset_metadata(self, snapshot):
+        assert snapshot.metadata('b') == {'mime_type': 'image/png', 'width': 3}
+        assert snapshot.metadata('c')['video']['codec'] == 'h264'
+
+    def test_metadata_raises_error_for_unknown_key(self, snapshot):
+        with pytest.raises(KeyError):
+            snapshot.metadata('d')
+
+    def test_tags_returns_asset_tags(self, snapshot):
+        assert snapshot.tags('b') == {'foo', 'bar'}
+        assert snapshot.tags('c') == frozenset()
+
+    def test_tags_only_reads_tags_of_asset(self, in_memory_storage, tmpdir):
+        in_memory_storage['a'] = Asset(io.BytesIO(b'a')), {'foo', 'bar'}
+        in_memory_storage['b'] = Asset(io.BytesIO(b'b')), {'tag %d' % index for index in range(100)}
+        snapshot = CatalogSnapshot.create(in_memory_storage, str(tmpdir.join('catalog')))
+
+        with unittest.mock.patch('madam.core.pickle.loads', wraps=pickle.loads) as loads:
+            tags = snapshot.tags('a')
+        snapshot.close()
+
+        assert tags == {'foo', 'bar'}
+        assert loads.call_count == 2
+
+    def test_filter_by_tags_returns_keys_with_all_tags(self, snapshot):
+        assert snapshot.filter_by_tags('foo') == {'a', 'b'}
+        assert snapshot.filter_by_tags('foo', 'bar') == {'b'}
+        assert snapshot.filter_by_tags('unknown') == set()
+        assert snapshot.filter_by_tags() == {'a', 'b', 'c'}
+
+    def test_snapshot_can_be_read_by_forked_workers(self, snapshot):
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        workers = [context.Process(target=_read_snapshot_in_worker, args=(snapshot, results)) for _ in range(4)]
+
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        assert [results.get() for _ in workers] == [(3, 'image/png', ['a', 'b'])]*4
+
+
+class TestMetadataCache:
+    @pytest.fixture
+    def cache(self, tmpdir):
+        return MetadataCache(str(tmpdir.join('cache.sqlite')), max_size=1024)
+
+    def test_digest_depends_on_file_contents(self):
+        assert MetadataCache.digest(io.BytesIO(b'a')) == MetadataCache.digest(io.BytesIO(b'a'))
+        assert MetadataCache.digest(io.BytesIO(b'a')) != MetadataCache.digest(io.BytesIO(b'b'))
+
+    def test_get_returns_none_for_unknown_entry(self, cache):
+        assert cache.get(b'digest', '1.0') is None
+
+    def test_get_returns_stored_metadata_and_metadata_processors(self, cache):
+        cache.put(b'digest', '1.0', {'mime_type': 'image/png', 'width': 3}, ['madam.jpeg.JPEGMetadataProcessor'])
+
+        assert cache.get(b'digest', '1.0') == ({'mime_type': 'image/png', 'width': 3},
+                                                ('madam.jpeg.JPEGMetadataProcessor',))
+
+    def test_get_returns_metadata_values_of_stored_types(self, cache):
+        metadata = {'exif': {'aperture': Fraction(1, 8), 'creation_datetime': datetime.datetime(2017, 1, 2, 3, 4, 5)},
+                    'iptc': {'keywords': ('a', 'b')}}
+        cache.put(b'digest', '1.0', metadata)
+
+        assert cache.get(b'digest', '1.0') == (metadata, ())
+
+    def test_get_returns_none_for_entry_of_other_version(self, cache):
+        cache.put(b'digest', '1.0', {'mime_type': 'image/png'})
+
+        assert cache.get(b'digest', '1.0') == ({'mime_type': 'image/png'}, ())
+        assert cache.get(b'digest', '2.0') is None
+
+    def test_entries_are_shared_between_instances(self, cache):
+        cache.put(b'digest', '1.0', {'mime_type': 'image/png'})
+
+        other_cache = MetadataCache(cache.path)
+
+        assert other_cache.get(b'digest', '1.0') == ({'mime_type': 'image/png'}, ())
+
+    def test_put_evicts_least_recently_used_entries(self, cache):
+        metadata = {'comment': 'a'*250}
+        for digest in (b'a', b'b', b'c'):
+            cache.put(digest, '1.0', metadata)
+        cache.get(b'a', '1.0')
+
+        cache.put(b'd', '1.0', metadata)
+
+        assert cache.get(b'b', '1.0') is None
+        assert cache.get(b'a', '1.0') is not None
+        assert len(cache) == 3
+        assert cache.size <= cache.max_size
+
+    def test_put_does_not_store_entries_larger_than_cache(self, cache):
+        cache.put(b'digest', '1.0', {'comment': 'a'*cache.max_size})
+
+        assert cache.get(b'digest', '1.0') is None
+
+    def test_put_does_not_store_entries_with_unsupported_metadata_values(self, cache):
+        cache.put(b'digest', '1.0', {'comment': object()})
+
+        assert cache.get(b'digest', '1.0') is None
+
+    def test_clear_removes_all_entries(self, cache):
+        cache.put(b'digest', '1.0', {})
+
+        cache.clear()
+
+        assert len(cache) == 0
+
+
+def _write_assets_to_shelve_storage(storage_path, worker_index, asset_count):
+    storage = ShelveStorage(storage_path)
+    for asset_index in range(asset_count):
+        asset = Asset(io.BytesIO(b'%d-%d' % (worker_index, asset_index)))
+        storage['%d-%d' % (worker_index, asset_index)] = asset, {'worker%d' % worker_index}
+
+
+@pytest.mark.usefixtures('shelve_storage')
+class TestShelveStorageConcurrency:
+    def test_concurrent_writes_from_many_processes_keep_all_assets(self, shelve_storage):
+        worker_count = 8
+        asset_count = 25
+        workers = [multiprocessing.Process(target=_write_assets_to_shelve_storage,
+                                           args=(shelve_storage.path, worker_index, asset_count))
+                   for worker_index in range(worker_count)]
+
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        assert all(worker.exitcode == 0 for worker in workers)
+        assert len(shelve_storage) == worker_count * asset_count
+        for worker_index in range(worker_count):
+            for asset_index in range(asset_count):
+                asset, tags = shelve_storage['%d-%d' % (worker_index, asset_index)]
+                assert asset.essence.read() == b'%d-%d' % (worker_index, asset_index)
+                assert tags == {'worker%d' % worker_index}
+
+    def test_concurrent_reads_and_writes_do_not_fail(self, shelve_storage):
+        writer = multiprocessing.Process(target=_write_assets_to_shelve_storage,
+                                         args=(shelve_storage.path, 0, 50))
+        writer.start()
+        while writer.is_alive():
+            for asset_key in shelve_storage:
+                assert asset_key in shelve_storage
+        writer.join()
+
+        assert writer.exitcode == 0
+        assert len(shelve_storage) == 50
+
+    def test_reading_from_storage_without_file_returns_empty_storage(self, shelve_storage):
+        assert len(shelve_storage) == 0
+        assert 'missing' not in shelve_storage
+
+
 @pytest.fixture
 def asset():
     return Asset(io.BytesIO(b'TestEssence'))
@@ -267,3 +848,99 @@ class TestPipeline:
         [processed_asset for processed_asset in pipeline.process(asset)]
 
         operator.assert_called_once_with(asset)
+
+
+class TestOperatorQueue:
+    @pytest.fixture
+    def queue(self):
+        queue = OperatorQueue(workers=1)
+        yield queue
+        queue.shutdown(cancel_jobs=True)
+
+    @pytest.fixture
+    def blocked_queue(self, queue):
+        """
+        Queue whose only worker is busy until the returned event is set.
+        """
+        event = threading.Event()
+        started = threading.Event()
+
+        def block(asset):
+            started.set()
+            event.wait()
+            return asset
+
+        queue.submit(block, None)
+        started.wait()
+        yield queue, event
+        event.set()
+
+    def test_submit_returns_future_with_processed_asset(self, queue, asset):
+        future = queue.submit(lambda asset: Asset(io.BytesIO(b'processed'), **asset.metadata), asset)
+
+        assert future.result(timeout=5).essence.read() == b'processed'
+
+    def test_future_contains_error_of_failed_operator(self, queue, asset):
+        def fail(asset):
+            raise OperatorError('failed')
+
+        future = queue.submit(fail, asset)
+
+        with pytest.raises(OperatorError):
+            future.result(timeout=5)
+
+    def test_jobs_are_started_in_order_of_priority_and_deadline(self, blocked_queue):
+        queue, event = blocked_queue
+        started_jobs = []
+        futures = [
+            queue.submit(started_jobs.append, 'batch', priority=Priority.BATCH),
+            queue.submit(started_jobs.append, 'normal', priority=Priority.NORMAL),
+            queue.submit(started_jobs.append, 'interactive', priority=Priority.INTERACTIVE),
+            queue.submit(started_jobs.append, 'urgent', priority=Priority.NORMAL, deadline=60),
+        ]
+        assert queue.queue_depth == 4
+
+        event.set()
+        for future in futures:
+            future.result(timeout=5)
+
+        assert started_jobs == ['interactive', 'urgent', 'normal', 'batch']
+
+    def test_cancelled_job_is_not_run(self, blocked_queue):
+        queue, event = blocked_queue
+        started_jobs = []
+        cancelled_future = queue.submit(started_jobs.append, 'cancelled')
+        future = queue.submit(started_jobs.append, 'other')
+
+        assert cancelled_future.cancel()
+        event.set()
+        future.result(timeout=5)
+
+        assert started_jobs == ['other']
+
+    def test_job_fails_when_deadline_is_exceeded_before_start(self, blocked_queue):
+        queue, event = blocked_queue
+        started_jobs = []
+        future = queue.submit(started_jobs.append, 'expired', deadline=0)
+
+        event.set()
+
+        with pytest.raises(OperatorError):
+            future.result(timeout=5)
+        assert started_jobs == []
+
+    def test_reserved_worker_runs_interactive_jobs_while_other_workers_are_busy(self):
+        event = threading.Event()
+        with OperatorQueue(workers=2, reserved_workers=1) as queue:
+            batch_future = queue.submit(lambda asset: event.wait(), None, priority=Priority.BATCH)
+            interactive_future = queue.submit(lambda asset: asset, 'thumbnail', priority=Priority.INTERACTIVE)
+
+            assert interactive_future.result(timeout=5) == 'thumbnail'
+            assert not batch_future.done()
+            event.set()
+
+    def test_submit_fails_after_shutdown(self, queue):
+        queue.shutdown()
+
+        with pytest.raises(RuntimeError):
+            queue.submit(lambda asset: asset, None)
@@ -0,0 +1,170 @@
+import io
+
+import pytest
+
+from madam.core import Asset, InMemoryStorage
+from madam.index import FullTextIndex, GeoIndex
+
+
+def _asset(**metadata):
+    return Asset(io.BytesIO(b''), **metadata)
+
+
+class TestFullTextIndex:
+    @pytest.fixture
+    def index(self):
+        return FullTextIndex()
+
+    @pytest.fixture
+    def storage(self, index):
+        storage = InMemoryStorage()
+        storage['red_car'] = _asset(iptc=dict(caption='A red car in Berlin', keywords=('car', 'red'))), None
+        storage['blue_car'] = _asset(iptc=dict(headline='Blue car'), exif=dict(artist='Jane Doe')), None
+        storage['song'] = _asset(ffmetadata=dict(title='Red Red Wine', artist='UB40')), None
+        storage.add_index(index)
+        return storage
+
+    def test_index_contains_assets_stored_before_it_was_added(self, storage, index):
+        assert len(index) == 3
+
+    def test_search_finds_terms_in_nested_metadata(self, storage, index):
+        assert set(index.search('car')) == {'red_car', 'blue_car'}
+
+    def test_search_is_case_insensitive(self, storage, index):
+        assert index.search('BERLIN') == ['red_car']
+
+    def test_search_requires_all_terms(self, storage, index):
+        assert index.search('red car') == ['red_car']
+
+    def test_search_supports_prefix_queries(self, storage, index):
+        assert set(index.search('ber* car')) == {'red_car'}
+        assert set(index.search('b*')) == {'red_car', 'blue_car'}
+
+    def test_search_supports_phrase_queries(self, storage, index):
+        assert index.search('"red wine"') == ['song']
+        assert index.search('"car red"') == []
+
+    def test_search_matches_all_tokens_of_compound_terms(self, storage, index):
+        assert index.search('red-wine') == ['song']
+        assert index.search('red-berlin') == []
+
+    def test_phrases_do_not_span_separate_values(self, storage, index):
+        assert index.search('"berlin car"') == []
+
+    def test_search_ranks_assets_by_term_frequency(self, storage, index):
+        assert index.search('red')[0] == 'song'
+
+    def test_search_ignores_fields_that_are_not_configured(self):
+        storage = InMemoryStorage()
+        index = FullTextIndex(fields={'title'})
+        storage.add_index(index)
+        storage['asset'] = _asset(iptc=dict(caption='Hidden'), ffmetadata=dict(title='Visible')), None
+
+        assert index.search('hidden') == []
+        assert index.search('visible') == ['asset']
+
+    def test_index_is_updated_when_asset_is_stored(self, storage, index):
+        storage['new'] = _asset(iptc=dict(caption='Berlin at night')), None
+
+        assert set(index.search('berlin')) == {'red_car', 'new'}
+
+    def test_index_is_updated_when_asset_is_overwritten(self, storage, index):
+        storage['red_car'] = _asset(iptc=dict(caption='A green bike')), None
+
+        assert index.search('berlin') == []
+        assert index.search('bike') == ['red_car']
+
+    def test_index_is_updated_when_asset_is_removed(self, storage, index):
+        del storage['song']
+
+        assert index.search('wine') == []
+        assert index.search('w*') == []
+        assert len(index) == 2
+
+    def test_search_respects_limit(self, storage, index):
+        assert len(index.search('car', limit=1)) == 1
+
+    def test_search_returns_empty_list_for_empty_query(self, storage, index):
+        assert index.search('') == []
+
+
+def _asset_at(latitude, longitude):
+    return _asset(exif={
+        'gps.latitude': (abs(int(latitude)), (abs(latitude) % 1)*60, 0.0),
+        'gps.latitude_ref': 'north' if latitude >= 0 else 'south',
+        'gps.longitude': (abs(int(longitude)), (abs(longitude) % 1)*60, 0.0),
+        'gps.longitude_ref': 'east' if longitude >= 0 else 'west',
+    })
+
+
+class TestGeoIndex:
+    @pytest.fixture
+    def index(self):
+        return GeoIndex()
+
+    @pytest.fixture
+    def storage(self, index):
+        storage = InMemoryStorage()
+        storage['brandenburg_gate'] = _asset_at(52.516275, 13.377704), None
+        storage['reichstag'] = _asset_at(52.518620, 13.376187), None
+        storage['alexanderplatz'] = _asset_at(52.521918, 13.413215), None
+        storage['statue_of_liberty'] = _asset_at(40.689247, -74.044502), None
+        storage['fiji'] = _asset_at(-17.713371, 178.065033), None
+        storage['without_location'] = _asset(exif={'artist': 'Jane Doe'}), None
+        storage.add_index(index)
+        return storage
+
+    def test_raises_error_for_invalid_cell_size(self):
+        with pytest.raises(ValueError):
+            GeoIndex(cell_size=0)
+
+    def test_location_converts_exif_gps_metadata_to_decimal_degrees(self):
+        location = GeoIndex.location(_asset_at(-33.5, -70.25))
+
+        assert location == pytest.approx((-33.5, -70.25))
+
+    def test_location_is_none_for_asset_without_gps_metadata(self):
+        assert GeoIndex.location(_asset()) is None
+
+    def test_index_ignores_assets_without_location(self, storage, index):
+        assert len(index) == 5
+
+    def test_within_bounds_returns_assets_in_bounding_box(self, storage, index):
+        keys = index.within_bounds(52.5, 13.3, 52.53, 13.4)
+
+        assert keys == {'brandenburg_gate', 'reichstag'}
+
+    def test_within_bounds_supports_boxes_across_antimeridian(self, storage, index):
+        keys = index.within_bounds(-20.0, 170.0, -10.0, -170.0)
+
+        assert keys == {'fiji'}
+
+    def test_within_bounds_supports_large_boxes(self, storage, index):
+        keys = index.within_bounds(-90.0, -180.0, 90.0, 180.0)
+
+        assert len(keys) == 5
+
+    def test_within_radius_returns_assets_ordered_by_distance(self, storage, index):
+        keys = index.within_radius(52.516275, 13.377704, 2000)
+
+        assert keys == ['brandenburg_gate', 'reichstag']
+
+    def test_within_radius_includes_assets_at_larger_distance(self, storage, index):
+        keys = index.within_radius(52.516275, 13.377704, 5000)
+
+        assert keys == ['brandenburg_gate', 'reichstag', 'alexanderplatz']
+
+    def test_within_radius_supports_radius_across_antimeridian(self, storage, index):
+        keys = index.within_radius(-17.7, -179.9, 300000)
+
+        assert keys == ['fiji']
+
+    def test_index_is_updated_when_asset_is_removed(self, storage, index):
+        del storage['reichstag']
+
+        assert index.within_radius(52.516275, 13.377704, 2000) == ['brandenburg_gate']
+
+    def test_index_is_updated_when_asset_is_moved(self, storage, index):
+        storage['reichstag'] = _asset_at(40.69, -74.04), None
+
+        assert index.within_bounds(40.0, -75.0, 41.0, -74.0) == {'statue_of_liberty', 'reichstag'}
@@ -0,0 +1,158 @@
+import io
+
+import pytest
+
+from assets import jpeg_image_asset, jpeg_data_with_exif, png_image_asset_rgb, png_image_asset_gray, png_image_asset
+from madam.core import UnsupportedFormatError
+from madam.jpeg import JPEGMetadataProcessor, _ExifData, _IPTC_RESOURCE_ID, _photoshop_segments_data, \
+    _serialize_iptc, _serialize_photoshop_resources
+
+
+class TestJPEGMetadataProcessor:
+    @pytest.fixture(name='processor')
+    def jpeg_metadata_processor(self):
+        return JPEGMetadataProcessor()
+
+    def test_supports_exif(self, processor):
+        assert 'exif' in processor.formats
+
+    def test_supports_iptc(self, processor):
+        assert 'iptc' in processor.formats
+
+    def test_read_returns_exif_from_camera_file(self, processor, jpeg_data_with_exif):
+        jpeg_data_with_exif.seek(0)
+
+        metadata = processor.read(jpeg_data_with_exif)
+
+        assert 'exif' in metadata
+
+    def test_read_returns_empty_dict_when_jpeg_contains_no_metadata(self, processor, jpeg_image_asset):
+        metadata = processor.read(jpeg_image_asset.essence)
+
+        assert metadata == {}
+
+    def test_read_fails_for_unsupported_format(self, processor, png_image_asset):
+        non_jpeg_essence = png_image_asset.essence
+
+        with pytest.raises(UnsupportedFormatError):
+            processor.read(non_jpeg_essence)
+
+    def test_read_fails_for_truncated_data(self, processor, jpeg_image_asset):
+        truncated_essence = io.BytesIO(jpeg_image_asset.essence.read()[:10])
+
+        with pytest.raises(UnsupportedFormatError):
+            processor.read(truncated_essence)
+
+    def test_read_returns_combined_metadata(self, processor, jpeg_image_asset):
+        metadata = {metadata_format: jpeg_image_asset.metadata[metadata_format]
+                    for metadata_format in processor.formats}
+
+        essence_with_metadata = processor.combine(jpeg_image_asset.essence, metadata)
+        read_metadata = processor.read(essence_with_metadata)
+
+        assert set(read_metadata['exif']) == set(metadata['exif'])
+        for key, value in metadata['exif'].items():
+            if isinstance(value, (int, float)):
+                assert read_metadata['exif'][key] == pytest.approx(value, rel=1e-3)
+            else:
+                assert read_metadata['exif'][key] == value
+        assert read_metadata['iptc'] == metadata['iptc']
+
+    def test_combine_preserves_big_endian_exif_data(self, processor, jpeg_data_with_exif):
+        jpeg_data_with_exif.seek(0)
+        essence_data = jpeg_data_with_exif.read()
+        original_metadata = processor.read(io.BytesIO(essence_data))
+
+        essence_with_metadata = processor.combine(io.BytesIO(essence_data), {'exif': {'artist': 'Test artist'}})
+        read_metadata = processor.read(essence_with_metadata)
+
+        assert read_metadata['exif']['artist'] == 'Test artist'
+        for key, value in original_metadata['exif'].items():
+            if key != 'artist':
+                assert read_metadata['exif'][key] == value
+
+    def test_combine_keeps_maker_note_at_original_offset(self, processor, jpeg_data_with_exif):
+        def maker_note(essence_data):
+            tiff_data = essence_data[essence_data.index(b'Exif\x00\x00') + 6:]
+            return tiff_data, _ExifData.parse(memoryview(tiff_data)).ifds['Photo'][0x927c]
+        jpeg_data_with_exif.seek(0)
+        essence_data = jpeg_data_with_exif.read()
+
+        essence_with_metadata = processor.combine(io.BytesIO(essence_data), {'exif': {'artist': 'Test artist'}})
+
+        _, original_maker_note = maker_note(essence_data)
+        tiff_data, combined_maker_note = maker_note(essence_with_metadata.read())
+        assert combined_maker_note.offset == original_maker_note.offset
+        assert tiff_data[combined_maker_note.offset:][:len(original_maker_note.raw_value)] == \
+            original_maker_note.raw_value
+
+    def test_combine_preserves_exif_entries_with_unknown_types(self, processor, jpeg_image_asset):
+        exif = _ExifData()
+        exif.ifds['Image'][0xc000] = (99, 1, b'\x01\x02\x03\x04', None)
+        essence_data = jpeg_image_asset.essence.read()
+        essence_data = essence_data[:2] + b'\xff\xe1' + (len(exif.serialize()) + 8).to_bytes(2, 'big') + \
+            b'Exif\x00\x00' + exif.serialize() + essence_data[2:]
+
+        essence_with_metadata = processor.combine(io.BytesIO(essence_data), {'exif': {'artist': 'Test artist'}})
+
+        combined_data = essence_with_metadata.read()
+        tiff_data = combined_data[combined_data.index(b'Exif\x00\x00') + 6:]
+        assert _ExifData.parse(memoryview(tiff_data)).ifds['Image'][0xc000][:3] == (99, 1, b'\x01\x02\x03\x04')
+        assert processor.read(io.BytesIO(combined_data))['exif'] == {'artist': 'Test artist'}
+
+    def test_combine_ignores_unknown_metadata_keys(self, processor, jpeg_image_asset):
+        essence_with_metadata = processor.combine(jpeg_image_asset.essence,
+                                                  {'exif': {'artist': 'Test artist', 'foo': 'bar'}})
+
+        read_metadata = processor.read(essence_with_metadata)
+        assert read_metadata == {'exif': {'artist': 'Test artist'}}
+
+    def test_combine_splits_large_iptc_data_into_several_segments(self, processor, jpeg_image_asset):
+        keywords = tuple('keyword %05d' % index for index in range(10000))
+
+        essence_with_metadata = processor.combine(jpeg_image_asset.essence, {'iptc': {'keywords': keywords}})
+
+        essence_data = essence_with_metadata.read()
+        assert essence_data.count(b'Photoshop 3.0\x00') > 1
+        assert processor.read(io.BytesIO(essence_data))['iptc']['keywords'] == keywords
+
+    def test_combine_converts_kept_iptc_text_to_declared_character_set(self, processor, jpeg_image_asset):
+        iptc_data = _serialize_iptc([(1, 90, b'\x1b-A'), (2, 120, 'Caf\xe9'.encode('latin-1'))])
+        essence_data = jpeg_image_asset.essence.read()
+        essence_data = essence_data[:2] + _photoshop_segments_data(
+            _serialize_photoshop_resources([(_IPTC_RESOURCE_ID, b'', iptc_data)])) + essence_data[2:]
+
+        essence_with_metadata = processor.combine(io.BytesIO(essence_data), {'iptc': {'headline': 'Test headline'}})
+
+        read_metadata = processor.read(essence_with_metadata)
+        assert read_metadata['iptc'] == {'caption': 'Caf\xe9', 'headline': 'Test headline'}
+
+    def test_combine_fails_for_unsupported_metadata_format(self, processor, jpeg_image_asset):
+        with pytest.raises(UnsupportedFormatError):
+            processor.combine(jpeg_image_asset.essence, {'foo': {'bar': 'baz'}})
+
+    def test_combine_fails_for_unsupported_essence_format(self, processor, png_image_asset):
+        with pytest.raises(UnsupportedFormatError):
+            processor.combine(png_image_asset.essence, {'exif': {'artist': 'Test artist'}})
+
+    def test_strip_removes_all_metadata(self, processor, jpeg_image_asset):
+        metadata = {metadata_format: jpeg_image_asset.metadata[metadata_format]
+                    for metadata_format in processor.formats}
+        essence_with_metadata = processor.combine(jpeg_image_asset.essence, metadata)
+
+        essence = processor.strip(essence_with_metadata)
+
+        assert processor.read(essence) == {}
+
+    def test_strip_preserves_image_data(self, processor, jpeg_image_asset):
+        original_essence_data = jpeg_image_asset.essence.read()
+        essence_with_metadata = processor.combine(io.BytesIO(original_essence_data),
+                                                  {'exif': {'artist': 'Test artist'}})
+
+        essence = processor.strip(essence_with_metadata)
+
+        assert essence.read() == original_essence_data
+
+    def test_strip_fails_for_unsupported_format(self, processor, png_image_asset):
+        with pytest.raises(UnsupportedFormatError):
+            processor.strip(png_image_asset.essence)
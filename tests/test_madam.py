@@ -6,7 +6,7 @@ import pyexiv2
 import pytest
 
 from madam import Madam
-from madam.core import Asset, UnsupportedFormatError
+from madam.core import Asset, MetadataCache, UnsupportedFormatError
 from assets import DEFAULT_WIDTH, DEFAULT_HEIGHT, DEFAULT_DURATION
 from assets import asset, unknown_asset
 from assets import image_asset, jpeg_image_asset, png_image_asset_rgb, png_image_asset_gray, png_image_asset, \
@@ -97,6 +97,36 @@ def test_read_returns_asset_whose_essence_is_filled(read_asset):
     assert read_asset.essence.read()
 
 
+def test_read_returns_cached_asset_without_processing_file_again(asset, tmpdir):
+    manager = Madam(cache=MetadataCache(str(tmpdir.join('cache.sqlite'))))
+    read_asset = manager.read(asset.essence)
+
+    with patch.object(manager, '_read') as read_method:
+        cached_asset = manager.read(asset.essence)
+
+    read_method.assert_not_called()
+    assert cached_asset == read_asset
+
+
+def test_read_strips_metadata_from_essence_of_cached_asset(jpeg_data_with_exif, tmpdir):
+    manager = Madam(cache=MetadataCache(str(tmpdir.join('cache.sqlite'))))
+    read_asset = manager.read(jpeg_data_with_exif)
+
+    cached_asset = manager.read(jpeg_data_with_exif)
+
+    assert cached_asset.metadata == read_asset.metadata
+    assert cached_asset.essence.read() == read_asset.essence.read()
+
+
+def test_read_stores_additional_metadata_for_cached_asset(asset, tmpdir):
+    manager = Madam(cache=MetadataCache(str(tmpdir.join('cache.sqlite'))))
+    manager.read(asset.essence)
+
+    cached_asset = manager.read(asset.essence, additional_metadata=dict(creation_date='2016-03-01'))
+
+    assert cached_asset.creation_date == '2016-03-01'
+
+
 def test_read_returns_image_asset_with_correct_color_mode(madam, image_asset):
     asset = image_asset
 
@@ -217,8 +247,10 @@ def test_config_contains_list_of_all_processors_by_default(madam):
 
 def test_config_contains_list_of_all_metadata_processors_by_default(madam):
     assert madam.config['metadata_processors'] == [
-        'madam.exiv2.Exiv2MetadataProcessor',
+        'madam.jpeg.JPEGMetadataProcessor',
         'madam.vector.SVGMetadataProcessor',
+        'madam.tagging.AudioTagMetadataProcessor',
+        'madam.mp4.MP4MetadataProcessor',
         'madam.ffmpeg.FFmpegMetadataProcessor',
     ]
 
@@ -228,3 +260,10 @@ def test_config_does_not_contain_metadata_processor_when_it_is_not_installed():
         manager = Madam()
 
     assert 'madam.exiv2.Exiv2MetadataProcessor' not in manager.config['metadata_processors']
+
+
+def test_config_does_not_contain_jpeg_metadata_processor_when_it_is_not_installed():
+    with patch.dict(sys.modules, {'madam.jpeg': None}):
+        manager = Madam()
+
+    assert 'madam.jpeg.JPEGMetadataProcessor' not in manager.config['metadata_processors']
@@ -0,0 +1,110 @@
+import io
+import json
+import subprocess
+import wave
+
+import pytest
+
+from madam.future import subprocess_run
+from madam.probe import probe
+from assets import DEFAULT_WIDTH, DEFAULT_HEIGHT, DEFAULT_DURATION
+from assets import audio_asset, mp3_audio_asset, opus_audio_asset, wav_audio_asset
+from assets import video_asset, avi_video_asset, mp2_video_asset, mp4_video_asset, mkv_video_asset
+from assets import unknown_asset
+
+
+def _ffprobe(essence):
+    command = 'ffprobe -loglevel error -print_format json -show_format -show_streams -i pipe:'.split()
+    result = subprocess_run(command, input=essence.read(), stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, check=True)
+    essence.seek(0)
+    return json.loads(result.stdout.decode('utf-8'))
+
+
+def test_probe_returns_wav_information():
+    essence = io.BytesIO()
+    with wave.open(essence, 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(44100)
+        wav.writeframes(bytes(44100*4))
+    essence.seek(0)
+
+    probe_data = probe(essence)
+
+    assert probe_data['format']['format_name'] == 'wav'
+    assert float(probe_data['format']['duration']) == pytest.approx(1.0)
+    assert probe_data['streams'] == [dict(codec_type='audio', codec_name='pcm_s16le', bit_rate='1411200')]
+
+
+def test_probe_returns_mp3_information():
+    with open('tests/resources/64kbits_with_id3v2-4.mp3', 'rb') as file:
+        probe_data = probe(file)
+
+    assert probe_data['format']['format_name'] == 'mp3'
+    assert probe_data['streams'][0]['codec_name'] == 'mp3'
+
+
+def test_probe_returns_opus_information():
+    with open('tests/resources/sine-440hz-audio-with-comments.opus', 'rb') as file:
+        probe_data = probe(file)
+
+    assert probe_data['format']['format_name'] == 'ogg'
+    assert float(probe_data['format']['duration']) == pytest.approx(1.0, rel=0.1)
+    assert probe_data['streams'][0]['codec_name'] == 'opus'
+
+
+def test_probe_rewinds_file():
+    with open('tests/resources/64kbits_with_id3v2-4.mp3', 'rb') as file:
+        probe(file)
+
+        assert file.tell() == 0
+
+
+@pytest.mark.parametrize('data', [b'', b'abc123', b'RIFF\x00\x00\x00\x00WAVE', b'OggS', b'\xff\xfb'])
+def test_probe_returns_none_for_unsupported_data(data):
+    assert probe(io.BytesIO(data)) is None
+
+
+def test_probe_returns_none_for_unknown_asset(unknown_asset):
+    assert probe(unknown_asset.essence) is None
+
+
+def test_probe_matches_ffprobe_for_audio(audio_asset):
+    probe_data = probe(audio_asset.essence)
+    if probe_data is None:
+        pytest.skip('Format is not supported natively')
+
+    ffprobe_data = _ffprobe(audio_asset.essence)
+    assert probe_data['format']['format_name'] == ffprobe_data['format']['format_name']
+    assert float(probe_data['format']['duration']) == \
+        pytest.approx(float(ffprobe_data['format']['duration']), rel=0.05)
+    for stream, ffprobe_stream in zip(probe_data['streams'], ffprobe_data['streams']):
+        assert stream['codec_type'] == ffprobe_stream['codec_type']
+        assert stream['codec_name'] == ffprobe_stream['codec_name']
+
+
+def test_probe_matches_ffprobe_for_video(video_asset):
+    probe_data = probe(video_asset.essence)
+    if probe_data is None:
+        pytest.skip('Format is not supported natively')
+
+    ffprobe_data = _ffprobe(video_asset.essence)
+    assert probe_data['format']['format_name'] == ffprobe_data['format']['format_name']
+    assert float(probe_data['format']['duration']) == \
+        pytest.approx(float(ffprobe_data['format']['duration']), rel=0.05)
+    assert len(probe_data['streams']) == len(ffprobe_data['streams'])
+    for stream, ffprobe_stream in zip(probe_data['streams'], ffprobe_data['streams']):
+        assert stream['codec_type'] == ffprobe_stream['codec_type']
+        assert stream['codec_name'] == ffprobe_stream['codec_name']
+        if stream['codec_type'] == 'video':
+            assert (stream['width'], stream['height']) == (DEFAULT_WIDTH, DEFAULT_HEIGHT)
+            assert stream['pix_fmt'] == ffprobe_stream['pix_fmt']
+
+
+def test_probe_parses_mp4_and_matroska_natively(mp4_video_asset, mkv_video_asset):
+    for asset in (mp4_video_asset, mkv_video_asset):
+        probe_data = probe(asset.essence)
+
+        assert probe_data is not None
+        assert float(probe_data['format']['duration']) == pytest.approx(DEFAULT_DURATION, rel=0.1)
@@ -1,13 +1,21 @@
+import io
 import json
+import os
+import struct
 import subprocess
+import threading
+import time
 from collections import defaultdict
+from unittest.mock import patch
 
 import PIL.Image
 import pytest
+from mutagen.mp4 import MP4
 
+import madam.ffmpeg
 import madam.video
 from madam.core import OperatorError, UnsupportedFormatError
-from madam.future import subprocess_run
+from madam.future import CalledProcessError, subprocess_run
 from assets import DEFAULT_WIDTH, DEFAULT_HEIGHT, DEFAULT_DURATION
 from assets import image_asset, jpeg_image_asset, png_image_asset_rgb, png_image_asset_gray, png_image_asset, \
     gif_image_asset, bmp_image_asset, tiff_image_asset_rgb, tiff_image_asset_gray_8bit, tiff_image_asset_gray_16bit, \
@@ -17,6 +25,157 @@ from assets import video_asset_with_subtitle, video_asset, avi_video_asset, mp2_
 from assets import unknown_asset
 
 
+@pytest.mark.parametrize('header, seekable', [
+    (b'\x00\x00\x00\x20ftypisom', True),
+    (b'\x00\x00\x00\x08wide\x00\x00\x00\x00', True),
+    (b'\x00\x00\x10\x00mdat\x00\x00\x00\x00', True),
+    (b'\x00\x00\x00\x01mdat\x00\x00\x00\x00', True),
+    (b'\x00\x00\x10\x00moov\x00\x00\x00\x6c', True),
+    (b'\x00\x00\x00\x10free\x00\x00\x00\x00', True),
+    (b'RIFF\x00\x10\x00\x00AVI ', True),
+    (b'RIFF\x00\x10\x00\x00WAVE', False),
+    (b'\x1aE\xdf\xa3\x01\x00\x00\x00\x00\x00\x00\x1f', False),
+    (b'OggS\x00\x02\x00\x00\x00\x00\x00\x00', False),
+])
+def test_requires_seekable_input_detects_containers_with_index(header, seekable):
+    file = io.BytesIO(header + bytes(100))
+
+    assert madam.ffmpeg._requires_seekable_input(file) == seekable
+    assert file.tell() == 0
+
+
+class TestJobScheduler:
+    @pytest.fixture(name='scheduler')
+    def job_scheduler(self):
+        return madam.ffmpeg.JobScheduler(cpu_budget=4)
+
+    def test_job_receives_half_of_budget_when_no_other_jobs_run(self, scheduler):
+        with scheduler.job() as threads:
+            assert threads == 2
+            assert scheduler.utilization == 0.5
+            assert scheduler.running_job_count == 1
+
+        assert scheduler.utilization == 0.0
+
+    def test_job_receives_whole_budget_when_allowed(self):
+        scheduler = madam.ffmpeg.JobScheduler(cpu_budget=4, max_job_threads=4)
+
+        with scheduler.job() as threads:
+            assert threads == 4
+
+    def test_job_receives_at_most_maximum_threads(self, scheduler):
+        with scheduler.job(max_threads=1) as threads:
+            assert threads == 1
+            assert scheduler.utilization == 0.25
+
+    def test_job_waits_while_budget_is_allotted(self, scheduler):
+        started = threading.Event()
+
+        def run_job():
+            with scheduler.job():
+                started.set()
+
+        with scheduler.jobs(2):
+            worker = threading.Thread(target=run_job)
+            worker.start()
+
+            assert not started.wait(0.1)
+            assert scheduler.queue_depth == 1
+        worker.join()
+
+        assert started.is_set()
+        assert scheduler.queue_depth == 0
+
+    def test_job_starts_while_earlier_job_runs(self, scheduler):
+        started = threading.Event()
+        allotted_threads = []
+
+        def run_job():
+            with scheduler.job() as threads:
+                allotted_threads.append(threads)
+                started.set()
+
+        with scheduler.job():
+            worker = threading.Thread(target=run_job)
+            worker.start()
+
+            assert started.wait(1.0)
+        worker.join()
+
+        assert allotted_threads == [2]
+
+    def test_raises_error_for_invalid_maximum_job_threads(self):
+        with pytest.raises(ValueError):
+            madam.ffmpeg.JobScheduler(cpu_budget=4, max_job_threads=0)
+
+    def test_concurrent_jobs_do_not_exceed_budget(self, scheduler):
+        allotted_threads = []
+        lock = threading.Lock()
+
+        def run_job():
+            with scheduler.job() as threads:
+                with lock:
+                    allotted_threads.append(threads)
+                    assert scheduler.utilization <= 1.0
+
+        workers = [threading.Thread(target=run_job) for _ in range(16)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        assert len(allotted_threads) == 16
+        assert all(1 <= threads <= 4 for threads in allotted_threads)
+
+    def test_jobs_are_allotted_threads_at_once(self, scheduler):
+        with scheduler.jobs(2) as threads:
+            assert threads == [2, 2]
+            assert scheduler.utilization == 1.0
+            assert scheduler.running_job_count == 2
+
+        assert scheduler.utilization == 0.0
+        assert scheduler.running_job_count == 0
+
+    def test_jobs_receive_at_least_one_thread(self, scheduler):
+        with scheduler.jobs(6) as threads:
+            assert threads == [1]*6
+
+    def test_jobs_raise_error_for_invalid_count(self, scheduler):
+        with pytest.raises(ValueError):
+            with scheduler.jobs(0):
+                pass
+
+    def test_raises_error_for_invalid_budget(self):
+        with pytest.raises(ValueError):
+            madam.ffmpeg.JobScheduler(cpu_budget=-1)
+
+
+class TestFFmpegContext:
+    @pytest.fixture(name='run_process')
+    def patched_run_process(self):
+        with patch.object(madam.ffmpeg._FFmpegContext, '_FFmpegContext__run_process',
+                          return_value=(b'', None)) as run_process:
+            yield run_process
+
+    def test_run_limits_threads_of_all_inputs_and_the_output(self, run_process):
+        with madam.ffmpeg._FFmpegContext(io.BytesIO(b'data'), io.BytesIO(), output_format='matroska') as ctx:
+            ctx.run(['ffmpeg', '-f', 'concat', '-i', 'list.txt', '-ss', '1', '-i', ctx.input_path,
+                     '-map', '0:v', '-y', ctx.output_path], threads=3)
+
+        command = run_process.call_args[0][0]
+        assert command == ['ffmpeg', '-f', 'concat', '-threads', '3', '-i', 'list.txt',
+                           '-ss', '1', '-threads', '3', '-i', ctx.input_path,
+                           '-map', '0:v', '-y', '-threads', '3', ctx.output_path]
+
+    def test_run_is_scheduled_as_job_when_threads_are_not_specified(self, run_process):
+        with patch.object(madam.ffmpeg, 'scheduler', madam.ffmpeg.JobScheduler(cpu_budget=2, max_job_threads=2)):
+            with madam.ffmpeg._FFmpegContext(io.BytesIO(b'data'), io.BytesIO(), output_format='matroska') as ctx:
+                ctx.run(['ffmpeg', '-i', ctx.input_path, '-y', ctx.output_path])
+
+        command = run_process.call_args[0][0]
+        assert command == ['ffmpeg', '-threads', '2', '-i', ctx.input_path, '-y', '-threads', '2', ctx.output_path]
+
+
 class TestFFmpegProcessor:
     @pytest.fixture(name='processor', scope='class')
     def ffmpeg_processor(self):
@@ -72,6 +231,48 @@ class TestFFmpegProcessor:
         assert first_stream.get('width') == 12
         assert first_stream.get('height') == 34
 
+    def test_resize_returns_image_essence_with_correct_dimensions(self, processor, jpeg_image_asset):
+        resize_operator = processor.resize(width=12, height=6)
+
+        resized_asset = resize_operator(jpeg_image_asset)
+
+        image = PIL.Image.open(resized_asset.essence)
+        assert image.format == 'JPEG'
+        assert image.size == (12, 6)
+
+    def test_convert_returns_complete_essence_for_streamed_formats(self, processor, video_asset):
+        convert_operator = processor.convert(mime_type='video/ogg', video=dict(codec='libtheora'),
+                                             audio=dict(codec='libvorbis'))
+
+        converted_asset = convert_operator(video_asset)
+
+        assert converted_asset.duration == pytest.approx(DEFAULT_DURATION, rel=0.2)
+
+    def test_convert_reports_progress(self, processor, video_asset):
+        reported_progress = []
+        convert_operator = processor.convert(mime_type='video/x-matroska', progress_callback=reported_progress.append)
+
+        convert_operator(video_asset)
+
+        assert reported_progress
+        assert reported_progress[-1].finished
+        assert reported_progress[-1].seconds == pytest.approx(DEFAULT_DURATION, abs=0.1)
+
+    def test_convert_raises_error_when_timeout_is_exceeded(self, processor, video_asset):
+        convert_operator = processor.convert(mime_type='video/x-matroska', video=dict(codec='libx264'),
+                                             timeout=0)
+
+        with pytest.raises(OperatorError):
+            convert_operator(video_asset)
+
+    def test_resize_raises_error_when_cancelled(self, processor, video_asset):
+        cancel_event = threading.Event()
+        cancel_event.set()
+        resize_operator = processor.resize(width=12, height=34, cancel_event=cancel_event)
+
+        with pytest.raises(OperatorError):
+            resize_operator(video_asset)
+
     def test_resize_raises_error_for_unknown_formats(self, processor, unknown_asset):
         resize_operator = processor.resize(width=12, height=34)
 
@@ -196,6 +397,109 @@ class TestFFmpegProcessor:
         assert audio_streams[0]['codec_name'] == 'mp3'
         assert len(subtitle_streams) == 0
 
+    def test_plan_conversion_copies_streams_supported_by_container(self, processor, mp4_video_asset):
+        plan = processor.plan_conversion(mp4_video_asset, 'video/x-matroska')
+
+        assert plan == dict(video='copy', audio='copy', subtitle='transcode')
+
+    def test_plan_conversion_transcodes_or_drops_streams_with_options(self, processor, mp4_video_asset):
+        plan = processor.plan_conversion(mp4_video_asset, 'video/quicktime',
+                                         video=dict(codec='libx264'), audio=dict(bitrate=64), subtitle=dict(codec=None))
+
+        assert plan == dict(video='transcode', audio='transcode', subtitle='drop')
+
+    def test_convert_copies_compatible_streams(self, processor, mkv_video_asset):
+        conversion_operator = processor.convert(mime_type='video/quicktime', subtitle=dict(codec=None))
+
+        converted_asset = conversion_operator(mkv_video_asset)
+
+        streams_by_type = self.__probe_streams_by_type(converted_asset)
+        assert streams_by_type['video'][0]['codec_name'] == 'vp9'
+        assert converted_asset.duration == pytest.approx(DEFAULT_DURATION, rel=0.2)
+
+    def test_convert_reports_conversion_plan(self, processor, mkv_video_asset):
+        conversion_operator = processor.convert(mime_type='video/quicktime', audio=dict(codec='aac'),
+                                                subtitle=dict(codec=None))
+
+        converted_asset = conversion_operator(mkv_video_asset)
+
+        assert converted_asset.conversion_plan == dict(video='copy', audio='transcode', subtitle='drop', segments=1)
+
+    @pytest.fixture(scope='class')
+    def segmentable_video_asset(self, processor, tmpdir_factory):
+        command = ('ffmpeg -loglevel error '
+                   '-f lavfi -i color=color=red:size=%dx%d:duration=2.0:rate=15 '
+                   '-f lavfi -i sine=frequency=440:duration=2.0 '
+                   '-c:v h264 -g 5 -c:a libopus '
+                   '-f matroska' % (DEFAULT_WIDTH, DEFAULT_HEIGHT)).split()
+        tmpfile = tmpdir_factory.mktemp('segmentable_video_asset').join('h264-opus.mkv')
+        command.append(str(tmpfile))
+        subprocess_run(command, check=True, stderr=subprocess.PIPE)
+        with tmpfile.open('rb') as file:
+            return processor.read(file)
+
+    def test_convert_with_segments_returns_complete_essence(self, processor, segmentable_video_asset):
+        conversion_operator = processor.convert(mime_type='video/x-matroska',
+                                                video=dict(codec='libx264'),
+                                                audio=dict(codec='libopus'),
+                                                segments=3)
+
+        converted_asset = conversion_operator(segmentable_video_asset)
+
+        streams_by_type = self.__probe_streams_by_type(converted_asset)
+        video_streams = streams_by_type.get('video', [])
+        audio_streams = streams_by_type.get('audio', [])
+        assert len(video_streams) == 1
+        assert video_streams[0]['codec_name'] == 'h264'
+        assert len(audio_streams) == 1
+        assert converted_asset.duration == pytest.approx(segmentable_video_asset.duration, rel=0.1)
+        assert converted_asset.conversion_plan == dict(video='transcode', audio='transcode', segments=3)
+
+    def test_convert_with_segments_retries_failed_segment(self, processor, segmentable_video_asset):
+        run = madam.ffmpeg._FFmpegContext.run
+        failed_commands = []
+
+        def fail_first_segment_once(context, command, **kwargs):
+            if command[-1].endswith('segment0000.mkv') and not failed_commands:
+                failed_commands.append(command)
+                raise CalledProcessError(1, command, stderr=b'')
+            return run(context, command, **kwargs)
+
+        conversion_operator = processor.convert(mime_type='video/x-matroska', video=dict(codec='libx264'),
+                                                segments=2)
+
+        with patch.object(madam.ffmpeg._FFmpegContext, 'run', autospec=True, side_effect=fail_first_segment_once):
+            converted_asset = conversion_operator(segmentable_video_asset)
+
+        assert failed_commands
+        assert converted_asset.duration == pytest.approx(segmentable_video_asset.duration, rel=0.1)
+
+    def test_convert_with_segments_encodes_segments_concurrently(self, processor, segmentable_video_asset):
+        run_process = madam.ffmpeg._FFmpegContext._FFmpegContext__run_process
+        segment_intervals = []
+        lock = threading.Lock()
+
+        def record_segment_interval(context, command, *args):
+            if not os.path.basename(command[-1]).startswith('segment'):
+                return run_process(context, command, *args)
+            start = time.monotonic()
+            time.sleep(0.2)
+            result = run_process(context, command, *args)
+            with lock:
+                segment_intervals.append((start, time.monotonic()))
+            return result
+
+        conversion_operator = processor.convert(mime_type='video/x-matroska', video=dict(codec='libx264'),
+                                                segments=3)
+
+        with patch.object(madam.ffmpeg, 'scheduler', madam.ffmpeg.JobScheduler(cpu_budget=4)), \
+                patch.object(madam.ffmpeg._FFmpegContext, '_FFmpegContext__run_process', autospec=True,
+                             side_effect=record_segment_interval):
+            conversion_operator(segmentable_video_asset)
+
+        assert len(segment_intervals) == 3
+        assert max(start for start, _ in segment_intervals) < min(end for _, end in segment_intervals)
+
     def test_trim_fails_for_image_assets(self, processor, image_asset):
         trim_operator = processor.trim(from_seconds=0, to_seconds=0.1)
 
@@ -243,6 +547,75 @@ class TestFFmpegProcessor:
         video_info = json.loads(result.stdout.decode('utf-8'))
         assert bool(video_info.get('format'))
 
+    def test_trim_with_smart_render_cuts_at_exact_frames(self, processor, segmentable_video_asset):
+        trim_operator = processor.trim(from_seconds=0.2, to_seconds=1.4, smart_render=True)
+
+        trimmed_asset = trim_operator(segmentable_video_asset)
+
+        command = ('ffprobe -print_format json -loglevel error -select_streams v:0 '
+                   '-count_packets -show_entries stream=nb_read_packets -i pipe:').split()
+        result = subprocess_run(command, input=trimmed_asset.essence.read(), stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, check=True)
+        video_info = json.loads(result.stdout.decode('utf-8'))
+        assert int(video_info['streams'][0]['nb_read_packets']) == 18
+        assert trimmed_asset.duration == pytest.approx(1.2)
+
+    def test_trim_with_smart_render_copies_complete_groups_of_pictures(self, processor, segmentable_video_asset):
+        run = madam.ffmpeg._FFmpegContext.run
+        commands = []
+
+        def record_command(context, command, **kwargs):
+            commands.append(command)
+            return run(context, command, **kwargs)
+
+        trim_operator = processor.trim(from_seconds=0.2, to_seconds=1.4, smart_render=True)
+
+        with patch.object(madam.ffmpeg._FFmpegContext, 'run', autospec=True, side_effect=record_command):
+            trim_operator(segmentable_video_asset)
+
+        part_commands = [command for command in commands if 'concat' not in command]
+        assert len(part_commands) == 3
+        assert [command[command.index('-c:v') + 1] == 'copy' for command in part_commands] == [False, True, False]
+
+    @pytest.fixture(scope='class')
+    def yuv444p_video_asset(self, processor, tmpdir_factory):
+        command = ('ffmpeg -loglevel error '
+                   '-f lavfi -i testsrc=size=%dx%d:duration=2.0:rate=15 '
+                   '-c:v libx264 -pix_fmt yuv444p -g 5 '
+                   '-f matroska' % (DEFAULT_WIDTH, DEFAULT_HEIGHT)).split()
+        tmpfile = tmpdir_factory.mktemp('yuv444p_video_asset').join('h264-yuv444p.mkv')
+        command.append(str(tmpfile))
+        subprocess_run(command, check=True, stderr=subprocess.PIPE)
+        with tmpfile.open('rb') as file:
+            return processor.read(file)
+
+    def test_trim_with_smart_render_keeps_pixel_format_and_profile(self, processor, yuv444p_video_asset):
+        trim_operator = processor.trim(from_seconds=0.2, to_seconds=1.4, smart_render=True)
+
+        trimmed_asset = trim_operator(yuv444p_video_asset)
+
+        video_stream = self.__probe_streams_by_type(trimmed_asset)['video'][0]
+        assert video_stream['pix_fmt'] == 'yuv444p'
+        assert video_stream['profile'] == 'High 4:4:4 Predictive'
+        assert trimmed_asset.duration == pytest.approx(1.2)
+
+    def test_trim_with_smart_render_copies_vp9_video(self, processor, mkv_video_asset):
+        run = madam.ffmpeg._FFmpegContext.run
+        commands = []
+
+        def record_command(context, command, **kwargs):
+            commands.append(command)
+            return run(context, command, **kwargs)
+
+        trim_operator = processor.trim(from_seconds=0.2, to_seconds=1.4, smart_render=True)
+
+        with patch.object(madam.ffmpeg._FFmpegContext, 'run', autospec=True, side_effect=record_command):
+            trimmed_asset = trim_operator(mkv_video_asset)
+
+        assert len(commands) == 1
+        assert commands[0][commands[0].index('-codec') + 1] == 'copy'
+        assert self.__probe_streams_by_type(trimmed_asset)['video'][0]['codec_name'] == 'vp9'
+
     def test_extract_frame_asset_receives_correct_mime_type(self, processor, video_asset, image_asset):
         image_mime_type = image_asset.mime_type
         extract_frame_operator = processor.extract_frame(mime_type=image_mime_type)
@@ -277,6 +650,121 @@ class TestFFmpegProcessor:
         with pytest.raises(UnsupportedFormatError):
             extract_frame_operator(video_asset)
 
+    def test_extract_frame_returns_frame_after_first_keyframe(self, processor, video_asset):
+        extract_frame_operator = processor.extract_frame(mime_type='image/png', seconds=DEFAULT_DURATION/2)
+
+        frame_asset = extract_frame_operator(video_asset)
+
+        image = PIL.Image.open(frame_asset.essence)
+        assert image.size == (DEFAULT_WIDTH, DEFAULT_HEIGHT)
+
+    def test_extract_frames_returns_image_asset_for_each_offset(self, processor, video_asset):
+        offsets = [DEFAULT_DURATION/2, 0, DEFAULT_DURATION/4]
+        extract_frames_operator = processor.extract_frames(mime_type='image/png', seconds=offsets)
+
+        frame_assets = extract_frames_operator(video_asset)
+
+        assert len(frame_assets) == len(offsets)
+        for frame_asset in frame_assets:
+            assert frame_asset.mime_type == 'image/png'
+            image = PIL.Image.open(frame_asset.essence)
+            assert image.size == (DEFAULT_WIDTH, DEFAULT_HEIGHT)
+
+    def test_extract_frames_returns_frames_at_interval(self, processor, video_asset):
+        extract_frames_operator = processor.extract_frames(mime_type='image/jpeg', interval=DEFAULT_DURATION/4)
+
+        frame_assets = extract_frames_operator(video_asset)
+
+        assert len(frame_assets) == 4
+
+    def test_extract_frames_raises_error_without_offsets_or_interval(self, processor, video_asset):
+        extract_frames_operator = processor.extract_frames(mime_type='image/png')
+
+        with pytest.raises(ValueError):
+            extract_frames_operator(video_asset)
+
+    def test_extract_frames_returns_sprite_sheet_and_webvtt_track(self, processor, video_asset):
+        extract_frames_operator = processor.extract_frames(mime_type='image/png', interval=DEFAULT_DURATION/4,
+                                                           sprite=dict(columns=2, width=8, height=4, url='s.png'))
+
+        assets = extract_frames_operator(video_asset)
+
+        *frame_assets, sprite_asset, webvtt_asset = assets
+        assert len(frame_assets) == 4
+        image = PIL.Image.open(sprite_asset.essence)
+        assert image.size == (sprite_asset.width, sprite_asset.height) == (16, 8)
+        assert webvtt_asset.mime_type == 'text/vtt'
+        webvtt = webvtt_asset.essence.read().decode('utf-8')
+        assert webvtt.startswith('WEBVTT')
+        assert 's.png#xywh=8,4,8,4' in webvtt
+
+    def test_encode_ladder_returns_playlists_and_segments_for_each_rendition(self, processor, video_asset):
+        ladder_operator = processor.encode_ladder(renditions=[dict(height=8, bitrate=50), dict(height=16, bitrate=100)],
+                                                  segment_duration=0.1)
+
+        assets = ladder_operator(video_asset)
+
+        assert list(assets)[:2] == ['master.m3u8', 'stream0.m3u8']
+        master_playlist = assets['master.m3u8'].essence.read().decode('utf-8')
+        assert 'stream0.m3u8' in master_playlist
+        assert 'stream1.m3u8' in master_playlist
+        for index, height in enumerate([8, 16]):
+            segment_names = [name for name in assets if name.startswith('stream%d_' % index)]
+            assert segment_names
+            assert all(assets[name].mime_type == 'video/mp2t' for name in segment_names)
+            assert all(assets[name].height == height for name in segment_names)
+
+    def test_encode_ladder_aligns_segments_of_all_renditions(self, processor, video_asset):
+        ladder_operator = processor.encode_ladder(renditions=[dict(height=8, bitrate=50), dict(height=16, bitrate=100)],
+                                                  segment_duration=0.1)
+
+        assets = ladder_operator(video_asset)
+
+        segment_durations = [[asset.duration for name, asset in sorted(assets.items())
+                              if name.startswith('stream%d_' % index)] for index in range(2)]
+        assert segment_durations[0] == pytest.approx(segment_durations[1])
+
+    def test_encode_ladder_raises_error_for_invalid_renditions(self, processor, video_asset):
+        ladder_operator = processor.encode_ladder(renditions=[dict(height=8)])
+
+        with pytest.raises(ValueError):
+            ladder_operator(video_asset)
+
+    def test_keyframes_returns_sorted_keyframe_times(self, processor, video_asset):
+        keyframes = processor.keyframes(video_asset)
+
+        assert keyframes
+        assert keyframes[0] == pytest.approx(0.0, abs=0.05)
+        assert list(keyframes) == sorted(keyframes)
+        assert all(0 <= seconds <= DEFAULT_DURATION for seconds in keyframes)
+
+    def test_keyframes_are_cached(self, processor, video_asset):
+        keyframes = processor.keyframes(video_asset)
+
+        with patch('madam.ffmpeg._run_ffprobe') as run_ffprobe:
+            cached_keyframes = processor.keyframes(video_asset)
+
+        run_ffprobe.assert_not_called()
+        assert cached_keyframes == keyframes
+
+    def test_keyframes_are_cached_by_essence(self, processor):
+        probe_data = [
+            {'packets': [{'pts_time': '0.0', 'flags': 'K_'}, {'pts_time': '1.0', 'flags': '__'}]},
+            {'packets': [{'pts_time': '0.0', 'flags': 'K_'}, {'pts_time': '1.0', 'flags': 'K_'}]},
+        ]
+        asset = madam.core.Asset(io.BytesIO(b'essence'), mime_type='video/x-matroska')
+        retagged_asset = madam.core.Asset(io.BytesIO(b'essence'), mime_type='video/x-matroska', title='Retagged')
+        other_asset = madam.core.Asset(io.BytesIO(b'other essence'), mime_type='video/x-matroska')
+
+        with patch('madam.ffmpeg._run_ffprobe', side_effect=probe_data) as run_ffprobe:
+            keyframes = processor.keyframes(asset)
+            retagged_keyframes = processor.keyframes(retagged_asset)
+            other_keyframes = processor.keyframes(other_asset)
+
+        assert run_ffprobe.call_count == 2
+        assert keyframes == retagged_keyframes == (0.0,)
+        assert other_keyframes == (0.0, 1.0)
+
     def test_crop_works_only_for_video_assets(self, processor, unknown_asset):
         crop_operator = processor.crop(x=0, y=0, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT)
 
@@ -357,3 +845,145 @@ class TestFFmpegProcessor:
 
         assert rotated_asset.width != video_asset.width
         assert rotated_asset.height != video_asset.height
+
+    @pytest.mark.parametrize('angle, expand, path', [
+        (90.0, True, 'copy'),
+        (180.0, False, 'copy'),
+        (90.0, False, 'transcode'),
+        (45.0, True, 'transcode'),
+    ])
+    def test_plan_rotation_copies_streams_for_right_angles(self, processor, mp4_video_asset, angle, expand, path):
+        assert processor.plan_rotation(mp4_video_asset, angle, expand=expand) == path
+
+    def test_plan_rotation_transcodes_when_container_has_no_rotation_metadata(self, processor, mkv_video_asset):
+        assert processor.plan_rotation(mkv_video_asset, 180.0) == 'transcode'
+
+    def test_rotate_by_right_angle_stores_rotation_without_re_encoding(self, processor, mp4_video_asset):
+        rotate_operator = processor.rotate(angle=90, expand=True)
+
+        rotated_asset = rotate_operator(mp4_video_asset)
+
+        command = ('ffprobe -print_format json -loglevel error -select_streams v:0 '
+                   '-show_entries stream=codec_name,width,height:stream_side_data=rotation -i pipe:').split()
+        result = subprocess_run(command, input=rotated_asset.essence.read(), stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, check=True)
+        stream = json.loads(result.stdout.decode('utf-8'))['streams'][0]
+        assert (stream['width'], stream['height']) == (mp4_video_asset.width, mp4_video_asset.height)
+        assert abs(float(stream['side_data_list'][0]['rotation'])) == 90
+        assert (rotated_asset.width, rotated_asset.height) == (mp4_video_asset.height, mp4_video_asset.width)
+        assert rotated_asset.rotation_plan == 'copy'
+
+    def test_rotate_reports_re_encoding_in_rotation_plan(self, processor, mkv_video_asset):
+        rotate_operator = processor.rotate(angle=180)
+
+        rotated_asset = rotate_operator(mkv_video_asset)
+
+        assert rotated_asset.rotation_plan == 'transcode'
+
+
+_MEDIA_DATA = b'\x01\x02\x03\x04' * 64 * 1024
+
+
+def _box(box_type, payload):
+    return struct.pack('>L4s', 8 + len(payload), box_type) + payload
+
+
+def _mp4_boxes(media_data):
+    """
+    Returns the boxes of a minimal MP4 file with a single video chunk.
+    """
+    ftyp = _box(b'ftyp', b'isom\x00\x00\x00\x00isom')
+    hdlr = _box(b'hdlr', bytes(8) + b'vide' + bytes(12))
+    moov_size = 8 + 8 + 8 + len(hdlr) + 8 + 8 + 20
+    stco = _box(b'stco', struct.pack('>LLL', 0, 1, len(ftyp) + moov_size + 8))
+    moov = _box(b'moov', _box(b'trak', _box(b'mdia', hdlr + _box(b'minf', _box(b'stbl', stco)))))
+    return ftyp, moov, _box(b'mdat', media_data)
+
+
+class _ReadCountingFile(io.BytesIO):
+    bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+class TestMP4MetadataProcessor:
+    @pytest.fixture(name='processor')
+    def mp4_metadata_processor(self):
+        return madam.video.MP4MetadataProcessor()
+
+    def test_supports_ffmetadata(self, processor):
+        assert 'ffmetadata' in processor.formats
+
+    def test_read_returns_encoder_written_by_ffmpeg(self, processor, mp4_video_asset):
+        metadata = processor.read(mp4_video_asset.essence)
+
+        assert metadata['ffmetadata']['encoder'].startswith('Lavf')
+
+    def test_read_raises_error_when_file_format_is_unsupported(self, processor, mkv_video_asset):
+        with pytest.raises(UnsupportedFormatError):
+            processor.read(mkv_video_asset.essence)
+
+    def test_strip_returns_essence_without_metadata(self, processor, mp4_video_asset):
+        stripped_essence = processor.strip(mp4_video_asset.essence)
+
+        assert not processor.read(stripped_essence)['ffmetadata']
+
+    def test_combine_returns_mp4_with_metadata(self, processor, mp4_video_asset, tmpdir):
+        metadata = dict(ffmetadata=dict(title='Nocturne', artist='Frédéric Chopin', track='3/10'))
+
+        essence_with_metadata = processor.combine(mp4_video_asset.essence, metadata)
+
+        essence_file = tmpdir.join('essence_with_metadata.mp4')
+        essence_file.write(essence_with_metadata.read(), 'wb')
+        mp4 = MP4(str(essence_file))
+        assert mp4.tags['\xa9nam'] == ['Nocturne']
+        assert mp4.tags['\xa9ART'] == ['Frédéric Chopin']
+        assert mp4.tags['trkn'] == [(3, 10)]
+
+    def test_combine_preserves_media_data_when_movie_box_precedes_it(self, processor, mp4_video_asset, tmpdir):
+        original_file = tmpdir.join('original.mp4')
+        original_file.write(mp4_video_asset.essence.read(), 'wb')
+        source_file = tmpdir.join('faststart.mp4')
+        command = ['ffmpeg', '-loglevel', 'error', '-i', str(original_file), '-codec', 'copy',
+                   '-movflags', '+faststart', '-y', str(source_file)]
+        subprocess_run(command, stderr=subprocess.PIPE, check=True)
+        metadata = dict(ffmetadata=dict(comment='Lorem ipsum ' * 1000))
+
+        essence_with_metadata = processor.combine(source_file.open('rb'), metadata)
+
+        command = 'ffmpeg -loglevel error -f mp4 -i pipe: -f framemd5 -'.split()
+        original_frames = subprocess_run(command, input=source_file.read('rb'), stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE, check=True).stdout
+        frames = subprocess_run(command, input=essence_with_metadata.read(), stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, check=True).stdout
+        assert frames == original_frames
+
+    def test_read_reads_only_movie_box(self, processor):
+        source = _ReadCountingFile(b''.join(_mp4_boxes(_MEDIA_DATA)))
+
+        processor.read(source)
+
+        assert source.bytes_read < len(_MEDIA_DATA)
+
+    def test_combine_shifts_chunk_offsets_of_media_data_after_movie_box(self, processor):
+        source = io.BytesIO(b''.join(_mp4_boxes(_MEDIA_DATA)))
+
+        essence_with_metadata = processor.combine(source, dict(ffmetadata=dict(title='Nocturne')))
+
+        data = essence_with_metadata.read()
+        chunk_offset = struct.unpack_from('>L', data, data.index(b'stco') + 12)[0]
+        assert data[chunk_offset:chunk_offset + len(_MEDIA_DATA)] == _MEDIA_DATA
+        assert processor.read(io.BytesIO(data))['ffmetadata'] == dict(title='Nocturne')
+
+    def test_combine_raises_error_when_metadata_format_is_unsupported(self, processor, mp4_video_asset):
+        with pytest.raises(UnsupportedFormatError):
+            processor.combine(mp4_video_asset.essence, {'123abc': 'Test artist'})
+
+    def test_combine_raises_error_when_metadata_contains_unsupported_keys(self, processor, mp4_video_asset):
+        metadata = dict(ffmetadata=dict(foo='bar'))
+
+        with pytest.raises(ValueError):
+            processor.combine(mp4_video_asset.essence, metadata)